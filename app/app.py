@@ -5,6 +5,10 @@ import dash_bootstrap_components as dbc
 from dash import CeleryManager, DiskcacheManager
 from flask import Flask
 
+from pages.components.cache_admin import register_cache_routes
+from pages.components.upload_routes import register_upload_routes
+from pages.components.worker_init import register_worker_hooks
+
 if "REDIS_URL" in os.environ:
     # Use Redis & Celery if REDIS_URL set as an env variable
     print("Using REDIS_URL: ", os.environ["REDIS_URL"])
@@ -28,6 +32,9 @@ else:
     celery_broker = Celery(__name__, broker=REDIS_URL, backend=REDIS_URL)
     background_callback_manager = CeleryManager(celery_broker)
 
+# preloads Celery workers when they start
+register_worker_hooks()
+
 FONT_AWESOME = (
     "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css"
 )
@@ -46,6 +53,9 @@ app = dash.Dash(
 
 app.config.suppress_callback_exceptions = True
 
+register_cache_routes(server)
+register_upload_routes(server)
+
 app.layout = dbc.Container(
     [
         dbc.NavbarSimple(
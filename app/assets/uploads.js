@@ -0,0 +1,188 @@
+// Chunked uploads of the input files: the files are sent in chunks to the
+// /uploads endpoints (pages/components/upload_routes.py), which parse them on
+// the server. Interrupted uploads are resumed where they stopped, also after
+// a reload of the page. poll_uploads passes the progress and the upload
+// records to the layout.
+
+var UPLOAD_LABEL = "Drag and Drop or Select Files";
+var UPLOAD_RETRIES = 5;
+var UPLOAD_RETRY_DELAY = 2000;
+
+window.dysregnetUploads = {version: 0, seen: 0, uploads: {}};
+
+function UploadError(message, status) {
+    this.message = message;
+    this.status = status;
+}
+
+function getUploadsUrl(path) {
+    var config = JSON.parse(document.getElementById("_dash-config").textContent);
+    return (config.requests_pathname_prefix || "/") + "uploads" + (path || "");
+}
+
+function requestUpload(method, path, body) {
+    return fetch(getUploadsUrl(path), {method: method, body: body}).then(function(response) {
+        return response.json().catch(function() { return {}; }).then(function(status) {
+            // 409: the chunk did not start at the offset of the upload, resume at its offset
+            if (response.ok || response.status === 409) {
+                return status;
+            }
+            throw new UploadError(status.error || response.statusText, response.status);
+        });
+    });
+}
+
+function wait(ms) {
+    return new Promise(function(resolve) { setTimeout(resolve, ms); });
+}
+
+function setUpload(kind, file, update) {
+    var state = window.dysregnetUploads;
+    var upload = state.uploads[kind];
+    // a newer file of the same kind replaced this one
+    if (upload !== undefined && upload.file !== file) {
+        return;
+    }
+    state.uploads[kind] = Object.assign({file: file, changed: true}, upload, update, {changed: true});
+    state.version += 1;
+}
+
+function sendChunks(kind, file, status, retries) {
+    if (status.done) {
+        return Promise.resolve(status);
+    }
+    setUpload(kind, file, {progress: status.offset / file.size});
+
+    var end = Math.min(status.offset + status.chunk_size, file.size);
+    return requestUpload("PUT", "/" + status.id + "?offset=" + status.offset, file.slice(status.offset, end)).then(
+        function(next) {
+            // another request appends a chunk of this upload at the moment
+            if (next.offset === status.offset && !next.done) {
+                return wait(UPLOAD_RETRY_DELAY).then(function() {
+                    return sendChunks(kind, file, next, 0);
+                });
+            }
+            return sendChunks(kind, file, next, 0);
+        },
+        function(error) {
+            // the server rejected the file, or it is not reachable for long
+            if (error.status !== undefined || retries >= UPLOAD_RETRIES) {
+                throw error;
+            }
+            return wait(UPLOAD_RETRY_DELAY).then(function() {
+                return requestUpload("GET", "/" + status.id);
+            }).then(function(current) {
+                return sendChunks(kind, file, current, retries + 1);
+            }, function() {
+                return sendChunks(kind, file, status, retries + 1);
+            });
+        }
+    );
+}
+
+function uploadFile(kind, file) {
+    var key = ["dysregnet-upload", kind, file.name, file.size, file.lastModified].join(":");
+    var uploadId = window.localStorage.getItem(key);
+
+    window.dysregnetUploads.uploads[kind] = undefined;
+    setUpload(kind, file, {progress: 0, upload: null, error: null});
+
+    var resumed = uploadId ? requestUpload("GET", "/" + uploadId).catch(function() { return null; }) : Promise.resolve(null);
+    return resumed.then(function(status) {
+        if (status && status.id && !status.error) {
+            return status;
+        }
+        return requestUpload("POST", "", JSON.stringify({kind: kind, name: file.name, size: file.size}));
+    }).then(function(status) {
+        window.localStorage.setItem(key, status.id);
+        return sendChunks(kind, file, status, 0);
+    }).then(function(status) {
+        window.localStorage.removeItem(key);
+        setUpload(kind, file, {progress: 1, upload: status.upload});
+    }).catch(function(error) {
+        if (error.status !== undefined) {
+            window.localStorage.removeItem(key);
+        }
+        setUpload(kind, file, {error: error.message || String(error)});
+    });
+}
+
+document.addEventListener("click", function(event) {
+    var target = event.target.closest(".chunked-upload");
+    if (target === null) {
+        return;
+    }
+    var input = document.createElement("input");
+    input.type = "file";
+    input.accept = ".csv";
+    input.addEventListener("change", function() {
+        if (input.files.length) {
+            uploadFile(target.id, input.files[0]);
+        }
+    });
+    input.click();
+});
+
+document.addEventListener("dragover", function(event) {
+    if (event.target.closest(".chunked-upload") !== null) {
+        event.preventDefault();
+    }
+});
+
+document.addEventListener("drop", function(event) {
+    var target = event.target.closest(".chunked-upload");
+    if (target === null) {
+        return;
+    }
+    event.preventDefault();
+    if (event.dataTransfer.files.length) {
+        uploadFile(target.id, event.dataTransfer.files[0]);
+    }
+});
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    uploads: {
+        poll_uploads: function(n_intervals) {
+            var state = window.dysregnetUploads;
+            if (state.version === state.seen) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            state.seen = state.version;
+
+            var no_update = window.dash_clientside.no_update;
+            var labels = [];
+            var records = [];
+            var errors = [];
+            var done = false;
+            for (var kind of ["expression", "meta", "network"]) {
+                var upload = state.uploads[kind];
+                if (upload === undefined || !upload.changed) {
+                    labels.push(no_update);
+                    records.push(no_update);
+                    continue;
+                }
+                upload.changed = false;
+                if (upload.error) {
+                    errors.push(upload.error);
+                    labels.push(UPLOAD_LABEL);
+                    records.push({});
+                } else if (upload.upload) {
+                    labels.push(upload.file.name);
+                    records.push(upload.upload);
+                    done = true;
+                } else {
+                    labels.push(upload.file.name + " (" + Math.floor(upload.progress * 100) + "%)");
+                    records.push(no_update);
+                }
+            }
+
+            if (errors.length) {
+                return labels.concat(records, ["Error: Something went wrong (" + errors.join(", ") + ")", {"display": "block"}]);
+            }
+            if (done) {
+                return labels.concat(records, ["", {"display": "none"}]);
+            }
+            return labels.concat(records, [no_update, no_update]);
+        }
+    }
+});
@@ -0,0 +1,219 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr
+from os.path import dirname, join
+from typing import Any, Dict, List, Union
+from uuid import uuid4
+
+import pandas as pd
+
+from pages.components.control_data import ControlData
+from pages.components.dysregnet_cache import has_cached_run
+from pages.components.dysregnet_dataset import DysRegNetDataset, to_float_dtype
+from pages.components.run_dysregnet import get_parameters, get_results
+
+# Parameters of a cohort which sets none, the defaults of the run form
+DEFAULT_PARAMETERS = {
+    "condition": "condition",
+    "cat_cov": [],
+    "con_cov": [],
+    "zscoring": False,
+    "bonferroni": 1e-2,
+    "normaltest": False,
+    "normaltest_alpha": 1e-3,
+    "r2": None,
+    "condition_direction": True,
+}
+
+# Inputs shared by all cohorts of a worker process, set by init_worker
+worker_inputs = None
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """
+    Reads a batch manifest, a JSON file like
+
+        {
+            "network": "network.csv",
+            "control": "gene_tpm_2017_v8_thyroid.gct",
+            "parameters": {"bonferroni": 0.05},
+            "cohorts": [
+                {"name": "THCA", "expression": "thca.csv"},
+                {"name": "BRCA", "expression": "brca.csv", "parameters": {"r2": 0.3}}
+            ]
+        }
+
+    The network and the control data set (a file of GTEX_CONTROL_DATA,
+    optional) are shared by all cohorts. Cohorts without control data need a
+    "meta" file. "parameters" are the ones of run_dysregnet.get_parameters,
+    per cohort they override the ones of the manifest. A cohort can set its
+    "session_id", otherwise a new one is generated. Paths are relative to the
+    manifest.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    root = dirname(os.path.abspath(path))
+    manifest["network"] = join(root, manifest["network"])
+    for i, cohort in enumerate(manifest["cohorts"]):
+        cohort.setdefault("name", f"cohort {i + 1}")
+        cohort.setdefault("session_id", str(uuid4()))
+        cohort["expression"] = join(root, cohort["expression"])
+        if cohort.get("meta") is not None:
+            cohort["meta"] = join(root, cohort["meta"])
+        elif manifest.get("control") is None:
+            raise ValueError(f"{cohort['name']}: meta data or control data is required")
+        cohort["parameters"] = {
+            **DEFAULT_PARAMETERS,
+            **manifest.get("parameters", {}),
+            **cohort.get("parameters", {}),
+        }
+    return manifest
+
+
+def init_worker(network: pd.DataFrame, control: Union[str, None]):
+    """
+    Sets the inputs shared by the cohorts of a worker process. Forked workers
+    reuse the control data parsed by the batch process.
+    """
+    global worker_inputs
+
+    control_data = ControlData()
+    if control is not None:
+        control_data.load_control_data(control)
+    worker_inputs = {"network": network, "control": control, "data": control_data}
+
+
+def get_dataset(cohort: Dict[str, Any]) -> DysRegNetDataset:
+    """
+    Builds the inputs of a cohort like the upload and control data callbacks.
+    """
+    expression = pd.read_csv(cohort["expression"])
+    control = worker_inputs["control"]
+    if control is not None:
+        control_data = worker_inputs["data"]
+        # the parsed control data is cached, filtering replaces it with a copy
+        control_data.load_control_data(control)
+        expression, meta, genes_not_exist = control_data.merge_control_data(expression)
+        if expression is None:
+            raise ValueError("all genes do not exist in the control data")
+        if len(genes_not_exist):
+            print(
+                f"{cohort['name']}: {len(genes_not_exist)} genes are missing in the"
+                " control data set and dropped"
+            )
+    else:
+        meta = pd.read_csv(cohort["meta"])
+    return DysRegNetDataset(to_float_dtype(expression), meta, worker_inputs["network"])
+
+
+def run_cohort(cohort: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs DysRegNet for a cohort and caches the results with its session.
+
+    Returns:
+        Dict[str, Any]: the summary row of the cohort
+    """
+    row = {
+        "name": cohort["name"],
+        "session_id": cohort["session_id"],
+        "status": "failed",
+        "samples": None,
+        "edges": None,
+        "seconds": None,
+        "edges/s": None,
+        "error": "",
+    }
+    start = time.time()
+    try:
+        dataset = get_dataset(cohort)
+        parameters = get_parameters(**cohort["parameters"])
+        row["samples"] = dataset.n_samples
+        row["edges"] = dataset.n_edges
+        cached = has_cached_run(parameters, dataset)
+
+        # the progress bars of parallel cohorts are not readable
+        with redirect_stderr(io.StringIO()):
+            get_results(dataset, session_id=cohort["session_id"], **parameters)
+        row["status"] = "cached" if cached else "done"
+    except Exception as e:
+        row["error"] = str(e)
+    row["seconds"] = round(time.time() - start, 2)
+    if row["edges"] is not None and row["status"] != "failed":
+        row["edges/s"] = round(row["edges"] / max(row["seconds"], 1e-3), 1)
+    return row
+
+
+def run_batch(manifest: Dict[str, Any], jobs: int) -> List[Dict[str, Any]]:
+    """
+    Runs the cohorts of a manifest in a pool of jobs processes. The network
+    and the control data are loaded once, before the pool starts.
+
+    Returns:
+        List[Dict[str, Any]]: the summary rows in the order of the manifest
+    """
+    network = pd.read_csv(manifest["network"])
+    control = manifest.get("control")
+    # parsed once, forked workers share it
+    init_worker(network, control)
+
+    cohorts = manifest["cohorts"]
+    rows = {}
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_worker, initargs=(network, control)
+    ) as pool:
+        futures = {pool.submit(run_cohort, cohort): cohort for cohort in cohorts}
+        for future in as_completed(futures):
+            row = future.result()
+            rows[row["session_id"]] = row
+            print(
+                f"[{len(rows)}/{len(cohorts)}] {row['name']}: {row['status']}"
+                f" in {row['seconds']}s {row['error']}"
+            )
+    return [rows[cohort["session_id"]] for cohort in cohorts]
+
+
+def print_summary(rows: List[Dict[str, Any]], seconds: float):
+    summary = pd.DataFrame(rows).set_index("name")
+    print(summary.to_string())
+
+    done = summary[summary["status"] != "failed"]
+    print(
+        f"{len(done)} of {len(summary)} cohorts in {seconds:.1f}s,"
+        f" {len(done) / seconds * 3600:.1f} cohorts/h,"
+        f" {done['edges'].sum() / seconds:.1f} edges/s"
+    )
+    print("Open the results on the user data page: /user_data?<session_id>")
+
+
+def main(args: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Runs DysRegNet for the cohorts of a manifest and caches the"
+        " results, which can be opened in the app by their session id."
+    )
+    parser.add_argument("manifest", help="JSON manifest of the cohorts")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="cohorts run at the same time (default: 1)",
+    )
+    parser.add_argument("--summary", help="write the summary to this CSV file")
+    args = parser.parse_args(args)
+
+    start = time.time()
+    rows = run_batch(load_manifest(args.manifest), max(args.jobs, 1))
+    print_summary(rows, max(time.time() - start, 1e-3))
+    if args.summary:
+        pd.DataFrame(rows).to_csv(args.summary, index=False)
+    return 1 if any(row["status"] == "failed" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import argparse
+import io
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Any, Dict, List, Tuple
+
+import dysregnet
+import numpy as np
+import pandas as pd
+
+from pages.components.dysregnet_engine import fit_run, get_thresholds, run_native
+from pages.components.dysregnet_parallel import prepare_run
+
+# Threshold options of the compared runs, on top of BASE_OPTIONS
+OPTIONS = [
+    {},
+    {"direction_condition": True},
+    {"zscoring": True, "R2_threshold": 0.3},
+    {"normaltest": True, "normaltest_alpha": 0.05, "bonferroni_alpha": 0.5},
+    {"bonferroni_alpha": 0.5, "direction_condition": True, "R2_threshold": 0.5},
+    {"zscoring": True, "normaltest": True, "direction_condition": True},
+]
+BASE_OPTIONS = {
+    "conCol": "condition",
+    "zscoring": False,
+    "bonferroni_alpha": 1e-2,
+    "R2_threshold": None,
+    "normaltest": False,
+    "normaltest_alpha": 1e-3,
+    "direction_condition": False,
+}
+
+
+def make_dataset(
+    seed: int,
+    covariates: bool,
+    degenerate: bool,
+    controls: int = 50,
+    cases: int = 30,
+    genes: int = 25,
+) -> Dict[str, Any]:
+    """
+    Returns the arguments of dysregnet.run for a synthetic cohort: correlated
+    genes, a gene dysregulated in the cases, duplicated edges and a self loop.
+    Degenerate cohorts add edges the native engine fits with statsmodels
+    (constant, zero and collinear genes).
+    """
+    rng = np.random.default_rng(seed)
+    names = [f"G{i}" for i in range(genes)]
+    samples = [f"S{i}" for i in range(controls + cases)]
+
+    values = rng.normal(5, 1, (len(samples), genes))
+    for i in range(1, genes):
+        values[:, i] += 0.8 * values[:, i - 1]
+    values[controls:, 3] += rng.normal(0, 4, cases)
+    expression = pd.DataFrame(values, columns=names)
+    if degenerate:
+        expression["G5"] = 0.0
+        expression["G6"] = 3.0
+        expression.loc[:10, "G7"] = 1.0
+        expression["G8"] = expression["G2"] * 2 + 1
+    expression.insert(0, "sample", samples)
+
+    meta = pd.DataFrame(
+        {
+            "sample": samples,
+            "condition": [0] * controls + [1] * cases,
+            "sex": rng.choice(["m", "f"], len(samples)),
+            "age": rng.normal(50, 10, len(samples)),
+        }
+    )
+
+    edges = {tuple(rng.choice(names, 2)) for _ in range(150)}
+    GRN = pd.DataFrame(sorted(edges), columns=["TF", "target"])
+    extra = [("G1", "G1")]
+    if degenerate:
+        extra += [("G5", "G1"), ("G1", "G5"), ("G6", "G2"), ("G7", "G3"), ("G8", "G2")]
+    GRN = pd.concat([GRN, GRN.iloc[:5], pd.DataFrame(extra, columns=["TF", "target"])])
+    return {
+        "expression_data": expression,
+        "meta": meta,
+        "GRN": GRN,
+        "CatCov": ["sex"] if covariates else [],
+        "ConCov": ["age"] if covariates else [],
+    }
+
+
+def run_quietly(function, *args, **kwargs):
+    with redirect_stderr(io.StringIO()), redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def run_float32(**kwargs) -> pd.DataFrame:
+    """
+    Runs the native engine like DYSREGNET_FLOAT32=True does: single precision
+    expression data and residuals of the models.
+    """
+    expression = kwargs["expression_data"]
+    columns = expression.select_dtypes(include="floating").columns
+    kwargs["expression_data"] = expression.astype(
+        {column: np.float32 for column in columns}
+    )
+    data = prepare_run(**kwargs)
+    models = fit_run(data)
+    models.residuals = models.residuals.astype(np.float32)
+    return models.to_results(**get_thresholds(data)).to_frame()
+
+
+def get_constant_targets(kwargs: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    Returns the edges whose target gene is constant in the control samples.
+    Their residuals and z-scores are rounding errors, which differ between
+    double and single precision inputs.
+    """
+    meta = kwargs["meta"].set_index("sample")
+    expression = kwargs["expression_data"].set_index("sample")
+    controls = expression.loc[meta.index[meta[kwargs["conCol"]] == 0]]
+    constant = set(controls.columns[controls.nunique() == 1])
+    return [
+        (source, target)
+        for source, target in kwargs["GRN"].itertuples(index=False)
+        if target in constant
+    ]
+
+
+def compare(
+    expected: pd.DataFrame,
+    results: pd.DataFrame,
+    exact: bool,
+    ignore: List[Tuple[str, str]] = (),
+) -> Tuple[bool, str]:
+    """
+    Compares results with the ones of dysregnet.run. The dysregulation calls
+    (the non-zero pattern and the signs) must be equal, the values equal
+    within the float32 precision of the results, or within rtol=1e-3 if not
+    exact (single precision inputs). The edges to ignore are not compared.
+
+    Returns:
+        Tuple[bool, str]: whether they match and a description of the difference
+    """
+    if list(results.columns) != list(expected.columns):
+        return False, "different edges"
+    if list(results.index) != list(expected.index):
+        return False, "different patients"
+
+    compared = ~expected.columns.isin(ignore)
+    expected = expected.loc[:, compared].to_numpy(dtype=np.float64)
+    results = results.loc[:, compared].to_numpy(dtype=np.float64)
+    calls = (np.sign(expected) != np.sign(results)).sum()
+    if calls:
+        return False, f"{calls} different calls"
+    if not np.allclose(results, expected, rtol=1e-5 if exact else 1e-3, atol=0):
+        return False, f"max difference {np.abs(results - expected).max():.3g}"
+    message = f"{int((expected != 0).sum())} calls"
+    if not compared.all():
+        message += f", {(~compared).sum()} edges not compared"
+    return True, message
+
+
+def check(seeds: int) -> List[Dict[str, Any]]:
+    """
+    Compares the native engine, in double and single precision, with
+    dysregnet.run on synthetic cohorts with and without covariates. In single
+    precision, edges whose target gene is constant in the controls are not
+    compared.
+
+    Returns:
+        List[Dict[str, Any]]: one row per compared run
+    """
+    rows = []
+    for seed in range(seeds):
+        for covariates in (True, False):
+            for options in OPTIONS:
+                # dysregnet.run fails on them without covariates or with z-scoring
+                degenerate = covariates and not options.get("zscoring")
+                dataset = make_dataset(seed, covariates, degenerate)
+                kwargs = {**dataset, **BASE_OPTIONS, **options}
+                expected = run_quietly(dysregnet.run, **kwargs).get_results()
+                for precision, runner, ignore in (
+                    (
+                        "float64",
+                        lambda: run_native(prepare_run(**kwargs)).to_frame(),
+                        [],
+                    ),
+                    (
+                        "float32",
+                        lambda: run_float32(**kwargs),
+                        get_constant_targets(kwargs),
+                    ),
+                ):
+                    match, message = compare(
+                        expected, run_quietly(runner), precision == "float64", ignore
+                    )
+                    rows.append(
+                        {
+                            "seed": seed,
+                            "covariates": covariates,
+                            "options": options,
+                            "precision": precision,
+                            "match": match,
+                            "result": message,
+                        }
+                    )
+    return rows
+
+
+def main(args: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Checks that the native engine (DYSREGNET_ENGINE=native), also"
+        " in single precision (DYSREGNET_FLOAT32=True), returns the results of"
+        " dysregnet.run on synthetic data."
+    )
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        default=4,
+        help="synthetic cohorts with and without covariates (default: 4)",
+    )
+    args = parser.parse_args(args)
+
+    rows = pd.DataFrame(check(args.seeds))
+    print(rows.to_string(index=False))
+    failed = (~rows["match"]).sum()
+    print(f"{len(rows) - failed} of {len(rows)} runs match dysregnet.run")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
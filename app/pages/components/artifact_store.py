@@ -0,0 +1,323 @@
+import json
+import mmap
+import os
+from abc import ABC, abstractmethod
+from os.path import join
+from typing import Dict, List, Sequence, Tuple, Union
+from uuid import uuid4
+
+import redis
+
+# Backend of the session artifacts (results, partitions and input tables):
+# "redis" (default), "filesystem" or "s3". Redis always keeps the session
+# metadata, the LRU index and the pointers to the artifacts.
+ARTIFACT_STORE = os.getenv("DYSREGNET_ARTIFACT_STORE", "redis")
+# Local or shared folder of the filesystem backend
+ARTIFACT_DIR = os.getenv("DYSREGNET_ARTIFACT_DIR", "artifacts/")
+# Bucket, key prefix and endpoint (e.g. of a MinIO server) of the s3 backend,
+# credentials are read by boto3 from the usual AWS environment variables
+S3_BUCKET = os.getenv("DYSREGNET_S3_BUCKET", "")
+S3_PREFIX = os.getenv("DYSREGNET_S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("DYSREGNET_S3_ENDPOINT_URL") or None
+
+# Artifacts with fields (e.g. gene partitions) are a single object outside of
+# redis: the magic bytes, one version byte, the uint32 length of a JSON index
+# {field: [offset, length]} and the index, followed by the field values.
+MAPPING_MAGIC = b"DRM"
+MAPPING_VERSION = 1
+
+Artifact = Union[bytes, Dict[str, bytes]]
+
+
+class ArtifactStore(ABC):
+    """
+    Stores session artifacts by key. An artifact is either a single blob or a
+    mapping of fields to blobs, of which single fields can be read. Backends
+    implement all methods.
+    """
+
+    @abstractmethod
+    def get_many(self, keys: Sequence[str]) -> List[Union[bytes, None]]:
+        """
+        Returns the blobs of keys, None for missing ones. Blobs are bytes or
+        read-only memoryviews, which the caller must not keep longer than needed.
+        """
+        ...
+
+    @abstractmethod
+    def get_fields(
+        self, key: str, fields: Sequence[str]
+    ) -> Union[List[Union[bytes, None]], None]:
+        """
+        Returns fields of a mapping artifact, None if the artifact is missing
+        and None for missing fields.
+        """
+        ...
+
+    @abstractmethod
+    def put_many(self, artifacts: Dict[str, Artifact]): ...
+
+    @abstractmethod
+    def exists_many(self, keys: Sequence[str]) -> List[bool]: ...
+
+    @abstractmethod
+    def delete_many(self, keys: Sequence[str]): ...
+
+
+class RedisArtifactStore(ArtifactStore):
+    """
+    Keeps artifacts in redis next to the session metadata, mappings as redis hashes.
+    """
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+
+    def get_many(self, keys):
+        return self.client.mget(keys) if keys else []
+
+    def get_fields(self, key, fields):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.hmget(key, fields)
+        exists, values = pipe.execute()
+        return values if exists else None
+
+    def put_many(self, artifacts):
+        pipe = self.client.pipeline(transaction=False)
+        for key, artifact in artifacts.items():
+            if isinstance(artifact, dict):
+                pipe.hset(key, mapping=artifact)
+            else:
+                pipe.set(key, artifact)
+        pipe.execute()
+
+    def exists_many(self, keys):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        return [bool(exists) for exists in pipe.execute()]
+
+    def delete_many(self, keys):
+        if keys:
+            self.client.delete(*keys)
+
+
+class FileSystemArtifactStore(ArtifactStore):
+    """
+    Keeps artifacts as files in a local or shared folder. Files are written
+    atomically and read memory-mapped: blobs and fields are memoryviews of the
+    mapping, so only the pages which are read are loaded. The file is unmapped
+    when the last view of it is released.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, key: str) -> str:
+        return join(self.directory, key.replace(":", "-"))
+
+    def open(self, key: str) -> Union[mmap.mmap, None]:
+        try:
+            with open(self.get_path(key), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    def get_many(self, keys):
+        blobs = []
+        for key in keys:
+            mapped = self.open(key)
+            blobs.append(memoryview(mapped) if mapped is not None else None)
+        return blobs
+
+    def get_fields(self, key, fields):
+        mapped = self.open(key)
+        if mapped is None:
+            return None
+        view = memoryview(mapped)
+        index, start = read_mapping_index(view)
+        return [
+            (
+                view[start + index[field][0] : start + sum(index[field])]
+                if field in index
+                else None
+            )
+            for field in fields
+        ]
+
+    def put_many(self, artifacts):
+        for key, artifact in artifacts.items():
+            path = self.get_path(key)
+            tmp_path = f"{path}.{uuid4().hex}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(
+                    dump_mapping(artifact) if isinstance(artifact, dict) else artifact
+                )
+            os.replace(tmp_path, path)
+
+    def exists_many(self, keys):
+        return [os.path.exists(self.get_path(key)) for key in keys]
+
+    def delete_many(self, keys):
+        for key in keys:
+            try:
+                os.remove(self.get_path(key))
+            except FileNotFoundError:
+                pass
+
+
+class S3ArtifactStore(ArtifactStore):
+    """
+    Keeps artifacts as objects of an S3 compatible bucket (e.g. MinIO).
+    Fields of a mapping are read with range requests.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError(
+                "DYSREGNET_ARTIFACT_STORE=s3 requires boto3 (pip install boto3)"
+            ) from e
+        if not bucket:
+            raise RuntimeError(
+                "DYSREGNET_ARTIFACT_STORE=s3 requires DYSREGNET_S3_BUCKET"
+            )
+
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def is_missing(self, error: Exception) -> bool:
+        return error.response.get("Error", {}).get("Code") in (
+            "404",
+            "NoSuchKey",
+            "NotFound",
+        )
+
+    def get(self, key: str, byte_range: str = None) -> Union[bytes, None]:
+        kwargs = {"Range": byte_range} if byte_range else {}
+        try:
+            return self.client.get_object(
+                Bucket=self.bucket, Key=self.prefix + key, **kwargs
+            )["Body"].read()
+        except self.client_error as e:
+            if self.is_missing(e):
+                return None
+            raise
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def get_fields(self, key, fields):
+        # the index is usually much smaller than the first 64 KiB
+        head = self.get(key, "bytes=0-65535")
+        if head is None:
+            return None
+        header_size = len(MAPPING_MAGIC) + 5 + int.from_bytes(head[4:8], "little")
+        if len(head) < header_size:
+            head = self.get(key, f"bytes=0-{header_size - 1}")
+
+        index, start = read_mapping_index(head)
+        return [
+            (
+                self.get(
+                    key,
+                    f"bytes={start + index[field][0]}-"
+                    f"{start + sum(index[field]) - 1}",
+                )
+                if field in index and index[field][1] > 0
+                else (b"" if field in index else None)
+            )
+            for field in fields
+        ]
+
+    def put_many(self, artifacts):
+        for key, artifact in artifacts.items():
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.prefix + key,
+                Body=dump_mapping(artifact) if isinstance(artifact, dict) else artifact,
+            )
+
+    def exists_many(self, keys):
+        exists = []
+        for key in keys:
+            try:
+                self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+                exists.append(True)
+            except self.client_error as e:
+                if not self.is_missing(e):
+                    raise
+                exists.append(False)
+        return exists
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        # at most 1000 keys per request
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": self.prefix + key} for key in keys[i : i + 1000]
+                    ],
+                    "Quiet": True,
+                },
+            )
+
+
+def dump_mapping(mapping: Dict[str, bytes]) -> bytes:
+    """
+    Joins the fields of a mapping artifact into a single blob with an index.
+    """
+    index = {}
+    offset = 0
+    for field, value in mapping.items():
+        index[field] = [offset, len(value)]
+        offset += len(value)
+    header = json.dumps(index).encode("utf-8")
+    return b"".join(
+        [
+            MAPPING_MAGIC + bytes([MAPPING_VERSION]),
+            len(header).to_bytes(4, "little"),
+            header,
+            *mapping.values(),
+        ]
+    )
+
+
+def read_mapping_index(blob) -> Tuple[Dict[str, List[int]], int]:
+    """
+    Returns the index {field: [offset, length]} of a mapping blob and the
+    position its values start at.
+    """
+    if blob[: len(MAPPING_MAGIC)] != MAPPING_MAGIC:
+        raise ValueError("Not a DysRegNet mapping artifact")
+    version = blob[len(MAPPING_MAGIC)]
+    if version != MAPPING_VERSION:
+        raise ValueError(f"Unsupported DysRegNet mapping format version: {version}")
+
+    start = len(MAPPING_MAGIC) + 1
+    header_size = int.from_bytes(blob[start : start + 4], "little")
+    start += 4
+    return json.loads(bytes(blob[start : start + header_size])), start + header_size
+
+
+def get_artifact_store(client: redis.Redis) -> ArtifactStore:
+    """
+    Returns the artifact store configured by DYSREGNET_ARTIFACT_STORE.
+
+    Args:
+        client (redis.Redis): the client of the session cache, used by the redis backend
+    """
+    if ARTIFACT_STORE == "redis":
+        return RedisArtifactStore(client)
+    if ARTIFACT_STORE == "filesystem":
+        return FileSystemArtifactStore(ARTIFACT_DIR)
+    if ARTIFACT_STORE == "s3":
+        return S3ArtifactStore(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL)
+    raise ValueError(f"Unknown DYSREGNET_ARTIFACT_STORE: {ARTIFACT_STORE}")
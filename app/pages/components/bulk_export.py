@@ -0,0 +1,152 @@
+import os
+import time
+import zipfile
+from os.path import join
+from typing import Any, Callable, List, Union
+from uuid import uuid4
+
+from pages.components.db import NetworkDB
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports/")
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+# Finished exports are removed after this many seconds (default: one day)
+EXPORT_MAX_AGE = int(os.getenv("EXPORT_MAX_AGE", str(24 * 60 * 60)))
+
+
+def remove_expired_exports():
+    """
+    Deletes export files in EXPORT_DIR that are older than EXPORT_MAX_AGE.
+    """
+    if not os.path.isdir(EXPORT_DIR):
+        return
+
+    now = time.time()
+    for filename in os.listdir(EXPORT_DIR):
+        path = join(EXPORT_DIR, filename)
+        if os.path.isfile(path) and now - os.path.getmtime(path) > EXPORT_MAX_AGE:
+            os.remove(path)
+
+
+def iter_regulation_pages(db: NetworkDB, cancer_id: str, page_size: int):
+    """
+    Yields all regulations of a cancer type page by page.
+
+    Args:
+        db (NetworkDB): The database connection.
+        cancer_id (str): The cancer type, e.g. "THCA".
+        page_size (int): The number of regulations per query.
+
+    Yields:
+        List[List[Any]]: Rows of [regulation_id, direction, fraction].
+    """
+    after = ""
+    while True:
+        page = db.get_regulation_page(cancer_id, after, page_size)
+        if len(page) == 0:
+            return
+        yield page
+        after = page[-1][0]
+
+
+def export_cancer_network(
+    cancer_id: str,
+    include_dysregulation: bool,
+    set_progress: Union[Callable[[Any], None], None] = None,
+    db: Union[NetworkDB, None] = None,
+    page_size: int = EXPORT_PAGE_SIZE,
+) -> str:
+    """
+    Streams the complete regulation set of a cancer type, and optionally the sparse
+    patient dysregulation matrix, into a compressed zip file inside EXPORT_DIR.
+
+    Args:
+        cancer_id (str): The cancer type, e.g. "THCA".
+        include_dysregulation (bool): Flag indicating whether to export patient dysregulations.
+        set_progress (Callable): Optional background callback progress setter.
+        db (NetworkDB): The database connection, a new one is opened if None.
+        page_size (int): The number of regulations per query.
+
+    Returns:
+        str: The file name of the export inside EXPORT_DIR.
+    """
+    close_db = db is None
+    db = NetworkDB() if db is None else db
+
+    try:
+        # get_cancer_ids returns an empty list if the database is not available
+        cancer_ids = db.get_cancer_ids()
+        if not cancer_ids:
+            raise ValueError("The database is not available, please try again later")
+        # Labels can not be query parameters, so only known cancer ids are allowed
+        if cancer_id not in cancer_ids:
+            raise ValueError(f"Unknown cancer type: {cancer_id}")
+
+        total = db.get_regulation_count(cancer_id)
+        steps = max(total * 2 if include_dysregulation else total, 1)
+        done = 0
+
+        def report(n: int):
+            if set_progress is not None:
+                set_progress((str(n), str(steps), f"{n / steps * 100:.0f}%"))
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        remove_expired_exports()
+
+        suffix = "full" if include_dysregulation else "network"
+        filename = f"{cancer_id}_{suffix}_{uuid4().hex}.zip"
+        tmp_path = join(EXPORT_DIR, "." + filename + ".part")
+
+        report(done)
+        try:
+            with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                with zf.open("regulations.csv", "w", force_zip64=True) as f:
+                    f.write(b"source,target,type,fraction\n")
+                    for page in iter_regulation_pages(db, cancer_id, page_size):
+                        f.write(
+                            "".join(get_regulation_row(*row) for row in page).encode()
+                        )
+                        done += len(page)
+                        report(done)
+
+                if include_dysregulation:
+                    # Only non-zero dysregulations are stored in the database,
+                    # so the matrix is written in sparse (coordinate) format
+                    with zf.open("dysregulations.csv", "w", force_zip64=True) as f:
+                        f.write(b"source,target,patient_id,value\n")
+                        for page in iter_regulation_pages(db, cancer_id, page_size):
+                            regulation_ids: List[str] = [row[0] for row in page]
+                            dysregulations = db.get_dysregulation_page(
+                                regulation_ids, cancer_id
+                            )
+                            f.write(
+                                "".join(
+                                    get_dysregulation_row(*row)
+                                    for row in dysregulations
+                                ).encode()
+                            )
+                            done += len(page)
+                            report(done)
+
+        except BaseException:
+            # Also cleans up after a cancelled job
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        os.replace(tmp_path, join(EXPORT_DIR, filename))
+        return filename
+
+    finally:
+        if close_db:
+            db.close()
+
+
+def get_regulation_row(regulation_id: str, direction: str, fraction: float) -> str:
+    source, target = regulation_id.split(":")
+    regulation_type = "repression" if direction == "-" else "activation"
+    return f"{source},{target},{regulation_type},{fraction}\n"
+
+
+def get_dysregulation_row(regulation_id: str, patient_id: str, value: float) -> str:
+    source, target = regulation_id.split(":")
+    return f"{source},{target},{patient_id},{value}\n"
@@ -0,0 +1,94 @@
+import hmac
+import os
+import time
+
+from flask import Flask, Response, abort, jsonify, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from pages.components.dysregnet_cache import get_cache_usage, get_session_footprints
+from pages.components.dysregnet_queue import get_queue
+
+# Token for the admin listing of cached sessions, the listing is disabled if unset.
+# Session IDs give access to the results, so the listing must not be public.
+ADMIN_TOKEN = os.getenv("DYSREGNET_ADMIN_TOKEN", "")
+
+
+class CacheUsageCollector:
+    """
+    Reports the current Redis usage of the session cache on every scrape.
+    """
+
+    def collect(self):
+        usage = get_cache_usage()
+        yield GaugeMetricFamily(
+            "dysregnet_cache_size_bytes",
+            "Total bytes of all cached sessions and their parts",
+            value=usage["bytes"],
+        )
+        yield GaugeMetricFamily(
+            "dysregnet_cache_keys", "Number of cached keys", value=usage["keys"]
+        )
+        yield GaugeMetricFamily(
+            "dysregnet_cache_sessions",
+            "Number of cached sessions",
+            value=usage["sessions"],
+        )
+
+
+cache_registry = CollectorRegistry()
+cache_registry.register(CacheUsageCollector())
+
+
+def generate_metrics() -> bytes:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # aggregate the metrics of all gunicorn and Celery processes
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry) + generate_latest(cache_registry)
+    return generate_latest(REGISTRY) + generate_latest(cache_registry)
+
+
+def register_cache_routes(server: Flask):
+    """
+    Registers the /metrics endpoint (Prometheus text format) and the admin
+    listings of the largest cached sessions and of the DysRegNet job queue on
+    the flask server.
+    """
+
+    def check_token():
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if (
+            not ADMIN_TOKEN
+            or scheme != "Bearer"
+            or not hmac.compare_digest(token, ADMIN_TOKEN)
+        ):
+            abort(404)
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(generate_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
+    @server.route("/admin/sessions")
+    def admin_sessions():
+        check_token()
+
+        now = time.time()
+        footprints = get_session_footprints(request.args.get("limit", 50, type=int))
+        for footprint in footprints:
+            footprint["age"] = (
+                now - footprint["created"] if footprint["created"] is not None else None
+            )
+            footprint["idle"] = now - footprint["last_access"]
+        return jsonify(footprints)
+
+    @server.route("/admin/queue")
+    def admin_queue():
+        check_token()
+        return jsonify(get_queue())
@@ -0,0 +1,56 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+# Metrics of the DysRegNet session cache, exposed on /metrics (see cache_admin.py).
+# With several gunicorn or Celery processes, set PROMETHEUS_MULTIPROC_DIR to a
+# shared, empty directory so the metrics of all processes are aggregated.
+
+CACHE_LATENCY = Histogram(
+    "dysregnet_cache_operation_seconds",
+    "Duration of session cache operations",
+    ["operation"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+CACHE_BYTES = Counter(
+    "dysregnet_cache_bytes_total",
+    "Bytes written to (in) and read from (out) the session cache",
+    ["direction"],
+)
+CACHE_ENTRY_BYTES = Histogram(
+    "dysregnet_cache_entry_bytes",
+    "Size of blobs written to the session cache",
+    ["kind"],
+    buckets=tuple(1024 * 4**i for i in range(11)),
+)
+CACHE_LOOKUPS = Counter(
+    "dysregnet_cache_lookups_total",
+    "Session cache lookups by operation and result (hit or miss)",
+    ["operation", "result"],
+)
+CACHE_EVICTIONS = Counter(
+    "dysregnet_cache_evictions_total",
+    "Keys removed from the session cache by reason (expired or budget)",
+    ["reason"],
+)
+CACHE_EVICTED_BYTES = Counter(
+    "dysregnet_cache_evicted_bytes_total",
+    "Bytes evicted from the session cache to stay within the memory budget",
+)
+
+
+@contextmanager
+def measure(operation: str):
+    """
+    Records the duration of the wrapped block as cache operation.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        CACHE_LATENCY.labels(operation).observe(time.perf_counter() - start)
+
+
+def count_lookup(operation: str, hit: bool):
+    CACHE_LOOKUPS.labels(operation, "hit" if hit else "miss").inc()
@@ -1,14 +1,24 @@
 import os
-from os.path import isfile, join
+from collections import OrderedDict
+from os.path import getmtime, isfile, join
 import re
+from threading import Lock
 import pandas as pd
 from pandas.testing import assert_index_equal
 import mygene
 from cmapPy.pandasGEXpress.parse_gct import parse
 from cmapPy.pandasGEXpress.write_gct import write
+from pages.components.dysregnet_dataset import FLOAT_DTYPE
 
 mg = mygene.MyGeneInfo()
 
+# Parsed control data sets of the most recently selected tissues, kept per process
+# (default: 2, 0 disables it). Preloaded sets (see preload_control_data) are kept as well.
+CONTROL_DATA_CACHE_SIZE = int(os.getenv("DYSREGNET_CONTROL_DATA_CACHE_SIZE", "2"))
+parsed_control_data: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+preloaded_control_data = set()
+parsed_control_data_lock = Lock()
+
 def convert_to_ensembleid(gene_symbols: pd.Index):
 
     query_result = mg.querymany(qterms=gene_symbols, scopes='symbol', fields='symbol,ensembl.gene')
@@ -65,6 +75,26 @@ class ControlData:
         return gene_id
 
     def load_control_data(self, filename: str):
+        # Parsing a .gct file takes seconds, parsed files are reused until they change
+        path = join(self.control_data_dir, filename)
+        key = f"{path}:{getmtime(path)}"
+
+        with parsed_control_data_lock:
+            if key in parsed_control_data:
+                parsed_control_data.move_to_end(key)
+                # filter_control_data does not modify the parsed data
+                self.control_data = parsed_control_data[key]
+                return
+
+        self.parse_control_data(filename)
+
+        with parsed_control_data_lock:
+            parsed_control_data[key] = self.control_data
+            unpinned = [k for k in parsed_control_data if k not in preloaded_control_data]
+            for k in unpinned[:max(len(unpinned) - CONTROL_DATA_CACHE_SIZE, 0)]:
+                del parsed_control_data[k]
+
+    def parse_control_data(self, filename: str):
         # Get a dataframe from .gct file
         self.control_data = parse(join(self.control_data_dir, filename)).data_df
 
@@ -84,6 +114,20 @@ class ControlData:
 
             # raise ValueError("Duplicate index")
 
+    def preload_control_data(self, filenames):
+        """
+        Parses control data sets ahead of the first request and keeps them,
+        "all" preloads every set of the control data folder.
+        """
+        if filenames == "all":
+            filenames = [option["value"] for option in self.get_control_data_options()]
+        for filename in filenames:
+            path = join(self.control_data_dir, filename)
+            with parsed_control_data_lock:
+                preloaded_control_data.add(f"{path}:{getmtime(path)}")
+            self.load_control_data(filename)
+        self.control_data = None
+
     def filter_control_data(self, genes: pd.Index):
         try:
             # Index rows of genes and transpose to make genes columns
@@ -98,8 +142,8 @@ class ControlData:
                 genes = genes.intersection(self.control_data.index)
                 print("Genes in intersection (count): ", len(genes))
 
-            # symbol id as index
-            self.control_data = self.control_data.loc[genes].T.astype(float)
+            # symbol id as index, float32 with DYSREGNET_FLOAT32
+            self.control_data = self.control_data.loc[genes].T.astype(FLOAT_DTYPE)
 
             assert_index_equal(self.control_data.columns, genes)
 
@@ -113,6 +157,32 @@ class ControlData:
             self.control_data = None
             print("Not every gene in user data exists in the selected control data set")
             return None
+
+    def merge_control_data(self, expression_df: pd.DataFrame):
+        """
+        Appends the loaded control data, filtered to the genes of the expression data,
+        to the expression data as control samples.
+        Returns the merged expression data, its meta data (condition 1 for the samples of
+        the expression data, 0 for the controls) and the genes dropped from the expression data.
+        The frames are None if the control data can not be used with the expression data.
+        """
+        genes_not_exist = self.filter_control_data(expression_df.columns[1:])
+        if self.control_data is None:
+            return None, None, genes_not_exist
+
+        self.control_data.insert(0, expression_df.columns[0], self.control_data.index)
+
+        expression_df = expression_df.drop(columns=genes_not_exist)
+        assert_index_equal(expression_df.columns, self.control_data.columns)
+
+        meta_df = pd.DataFrame({
+            "sample": expression_df.iloc[:, 0].to_list() + self.control_data.iloc[:, 0].to_list(),
+            "condition": [1] * expression_df.shape[0] + [0] * self.control_data.shape[0],
+        })
+        expression_df = pd.concat([expression_df, self.control_data])
+        expression_df.reset_index(drop=True, inplace=True)
+
+        return expression_df, meta_df, genes_not_exist
     
 
 # if __name__ == "__main__":
@@ -133,6 +133,32 @@ class NetworkDB:
         print("Dysregulation patient specific transaction time: " + str(time.time() - start))
         return result
 
+    def get_regulation_count(self, cancer_id):
+        command = f"MATCH (r:{cancer_id}_Regulation) RETURN count(r)"
+        count = self.get_value(command)
+        # get_value returns an empty list if the query failed
+        if not count:
+            raise ValueError(f"Could not count the regulations of {cancer_id}")
+        return count[0]
+
+    def get_regulation_page(self, cancer_id, after, limit):
+        # Keyset pagination on regulation_id keeps every page an index seek,
+        # instead of SKIP re-reading all previous pages
+        query = (
+            f"MATCH (r:{cancer_id}_Regulation) WHERE r.regulation_id > $after\n"
+            "RETURN r.regulation_id, r.direction, r.fraction\n"
+            "ORDER BY r.regulation_id LIMIT $limit"
+        )
+        return self.get_values(query, {"after": after, "limit": limit})
+
+    def get_dysregulation_page(self, regulation_ids, cancer_id):
+        query = (
+            f"MATCH (r:{cancer_id}_Regulation) WHERE r.regulation_id IN $regulation_ids\n"
+            f"MATCH (p:{cancer_id}_Patient) -[d:DYSREGULATED]-> (r)\n"
+            "RETURN r.regulation_id, p.patient_id, d.value"
+        )
+        return self.get_values(query, {"regulation_ids": regulation_ids})
+
     def get_value(self, command):
         try:
             with self.driver.session() as session:
@@ -142,9 +168,9 @@ class NetworkDB:
             print(e)
             return []
 
-    def get_values(self, command):
+    def get_values(self, command, parameters=None):
         with self.driver.session() as session:
-            return session.run(command).values()
+            return session.run(command, parameters).values()
 
     def get_data(self, command):
         with self.driver.session() as session:
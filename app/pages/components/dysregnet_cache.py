@@ -1,11 +1,48 @@
+import hashlib
 import json
-from typing import Dict, List, Union
+import os
+import time
+from collections import OrderedDict
+from functools import partial
+from threading import Lock
+from typing import Any, Dict, List, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import redis
 
+from pages.components.artifact_store import get_artifact_store
+from pages.components.cache_metrics import (
+    CACHE_BYTES,
+    CACHE_ENTRY_BYTES,
+    CACHE_EVICTED_BYTES,
+    CACHE_EVICTIONS,
+    CACHE_LATENCY,
+    count_lookup,
+    measure,
+)
+from pages.components.dysregnet_dataset import DysRegNetDataset, get_table_hash
+from pages.components.dysregnet_engine import EdgeModels
+from pages.components.dysregnet_parallel import merge_chunks
+from pages.components.dysregnet_results import (
+    DysregulationMatrix,
+    get_sources,
+    get_summary,
+    get_targets,
+)
+from pages.components.dysregnet_serialization import (
+    dump_models,
+    dump_partitions,
+    dump_results,
+    dump_table,
+    load_models,
+    load_partitions,
+    load_results,
+    load_session,
+    load_table,
+)
+
 # TODO:
-# - implement functionality of maximum number of cached items or time limit
 # - implement sanity checks when caching or retrieving cached data
 #
 # For inspiration take flask_caching as an template:
@@ -17,45 +54,1117 @@ import redis
 
 CACHE_KEY_PREFIX = "DysRegNet_"
 
-cache = redis.Redis(host="127.0.0.1", port=6379, db=0, decode_responses=True)
+# A session is a redis hash "DysRegNet_<session_id>" with the fields
+# - results: key of the results blob
+# - parameters: JSON of the DysRegNet parameters
+# - inputs: JSON of input names (expression, meta, network) to table blob keys
+# - summary: JSON of summary stats (patients, genes, number of edges, ...)
+# - parts: JSON list of all blob keys of the session
+# - run: hash of all inputs and parameters
+# - partitions: JSON list of the keys of the results partitioned by source and
+#   by target gene, mappings of gene to partition blob
+# - created: unix time the session was cached
+# Sessions cached before were a single blob "DysRegNet_<session_id>" holding
+# results and parameters (including the inputs), they are still read.
+SESSION_FIELDS = ("results", "parameters", "inputs", "summary")
+
+# Blobs (artifacts) are content addressed and shared between sessions:
+# input tables by the hash of their content, results by the run hash.
+# They are kept in the artifact store, by default in redis as well.
+INPUT_KEY_PREFIX = "DysRegNet:input:"
+RESULT_KEY_PREFIX = "DysRegNet:result:"
+# Run hash to the latest session_id with these results
+RUN_KEY_PREFIX = "DysRegNet:run:"
+# Progress and finished edge chunks of running sessions, chunk results are
+# stored under <prefix><session_id>:<chunk>
+PARTIAL_KEY_PREFIX = "DysRegNet:partial:"
+# Fitted edge models, shared by runs which only differ in THRESHOLD_PARAMETERS
+MODELS_KEY_PREFIX = "DysRegNet:models:"
+# State of chunked uploads, the parsed blocks are stored under <prefix><upload_id>:<block>
+UPLOAD_KEY_PREFIX = "DysRegNet:upload:"
+# Sorted set of the blocks of unfinished uploads scored by the time they expire,
+# they are not in the LRU index, so they are not evicted while uploading
+UPLOAD_BLOCKS_KEY = "DysRegNet:upload_blocks"
+THRESHOLD_PARAMETERS = ("bonferroni", "r2", "normaltest_alpha", "condition_direction")
+
+# Inputs of a run: a dataset, or tables by name as DataFrame, dict or key of a
+# table stored with cache_inputs
+Inputs = Union[
+    DysRegNetDataset,
+    Dict[str, Union[pd.DataFrame, Dict[str, Dict[str, str]], str]],
+]
+
+# Sorted set of cached keys scored by their last access time (LRU order)
+CACHE_LRU_KEY = "DysRegNet:lru"
+# Hash of cached keys and their size in bytes
+CACHE_SIZES_KEY = "DysRegNet:sizes"
+# Total bytes of the keys in CACHE_SIZES_KEY, kept by set_sizes and remove_from_index
+CACHE_TOTAL_KEY = "DysRegNet:total"
+# Least recently used keys read at once while evicting
+EVICTION_BATCH_SIZE = 100
+
+# Seconds a session is kept after its last access, 0 disables expiry (default: 7 days)
+CACHE_TTL = int(os.getenv("DYSREGNET_CACHE_TTL", str(7 * 24 * 60 * 60)))
+# Seconds the progress of a running session is kept after its last finished chunk
+PARTIAL_TTL = CACHE_TTL or 24 * 60 * 60
+# Total bytes of all cached sessions, least recently used sessions are evicted
+# beyond this budget, 0 disables the budget (default: 2 GiB)
+CACHE_MAX_BYTES = int(os.getenv("DYSREGNET_CACHE_MAX_BYTES", str(2 * 1024**3)))
+# Maximum bytes of a single session, 0 disables the quota (default: 512 MiB)
+CACHE_SESSION_MAX_BYTES = int(
+    os.getenv("DYSREGNET_CACHE_SESSION_MAX_BYTES", str(512 * 1024**2))
+)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379")
+if "://" not in REDIS_URL:
+    # e.g. REDIS_URL=127.0.0.1:6379 as in the .env file
+    REDIS_URL = "redis://" + REDIS_URL
+
+# Parsed results of the most recently read sessions, kept per process (default: 16).
+# Results blobs are content addressed, so their key is the version a local
+# entry is validated against, 0 disables the local cache.
+LOCAL_CACHE_SIZE = int(os.getenv("DYSREGNET_LOCAL_CACHE_SIZE", "16"))
+local_results: "OrderedDict[str, DysregulationMatrix]" = OrderedDict()
+local_results_lock = Lock()
+
+# One pool per process, shared by all callbacks of a gunicorn or Celery worker.
+# Responses are bytes, as sessions are stored as binary blobs.
+pool = redis.ConnectionPool.from_url(REDIS_URL)
+cache = redis.Redis(connection_pool=pool)
+# Results, partitions and input tables (see DYSREGNET_ARTIFACT_STORE),
+# redis keeps the sessions, the LRU index and the sizes
+store = get_artifact_store(cache)
 
 
-def cache_data(session_id: str, results, parameters):
+def session_key(session_id) -> str:
+    return CACHE_KEY_PREFIX + str(session_id)
+
+
+def is_artifact(key: str) -> bool:
+    return key.startswith(
+        (
+            INPUT_KEY_PREFIX,
+            RESULT_KEY_PREFIX,
+            PARTIAL_KEY_PREFIX,
+            MODELS_KEY_PREFIX,
+            UPLOAD_KEY_PREFIX,
+        )
+    )
+
+
+def cache_data(
+    session_id: str,
+    results: Union[DysregulationMatrix, pd.DataFrame],
+    parameters: Dict[str, Any],
+    inputs: Inputs,
+    models: EdgeModels = None,
+):
     """
-    Function to set DysRegNet parameters and result in redis cache by session_id.
+    Function to set DysRegNet parameters, inputs and result in redis cache by session_id.
     Args:
         session_id (str): unique session identifier
-        results (Dict[Dict[str, str]]): string dictionary of DysRegNet results
-        parameters (Dict[str, [Dict[str, Dict[str, str]],
-        str, List[str], bool, float, Union[float, None]]]): dict of DysRegNet
-        parameters
+        results (Union[DysregulationMatrix, pd.DataFrame]): DysRegNet results with
+        (source, target) columns
+        parameters (Dict[str, [str, List[str], bool, float, Union[float, None]]]):
+        dict of DysRegNet parameters
+        inputs (Inputs): expression, meta and network data as dataset or dict,
+        whose values may be keys returned by cache_inputs
+        models (EdgeModels): fitted edge models of the native engine, which are
+        only cached if the session fits into CACHE_SESSION_MAX_BYTES with them
+    Raises:
+        ValueError: if the session exceeds CACHE_SESSION_MAX_BYTES
+    """
+    cache_data_many(
+        {
+            session_id: {
+                "results": results,
+                "parameters": parameters,
+                "inputs": inputs,
+                "models": models,
+            }
+        }
+    )
+
+
+@CACHE_LATENCY.labels("write").time()
+def cache_data_many(data: Dict[str, Dict[str, Any]]):
+    """
+    Function to cache several sessions with two redis round trips.
+    Inputs and results are stored under content hashes, so blobs which are
+    already cached (e.g. the same network) are shared instead of stored again.
+    Args:
+        data (Dict[str, Dict[str, Any]]): session_id to
+        {"results": ..., "parameters": ..., "inputs": ...} as in cache_data
+    Raises:
+        ValueError: if a session exceeds CACHE_SESSION_MAX_BYTES
     """
 
-    cache.set(
-        CACHE_KEY_PREFIX + session_id,
-        json.dumps({"results": results, "parameters": parameters}),
+    now = time.time()
+    sessions = {}
+    parts = {}
+    # inputs stored before with cache_inputs
+    stored = set()
+    for session_id, entry in data.items():
+        inputs = get_input_tables(entry["inputs"])
+        input_keys = get_input_keys(entry["inputs"])
+        stored.update(key for name, key in input_keys.items() if name not in inputs)
+        run_hash = get_run_hash(entry["parameters"], input_keys)
+        results_key = RESULT_KEY_PREFIX + run_hash
+
+        results = entry["results"]
+        if isinstance(results, pd.DataFrame):
+            results = DysregulationMatrix.from_frame(results)
+
+        parts[results_key] = (dump_results, results)
+        parts.update(
+            {input_keys[name]: (dump_table, table) for name, table in inputs.items()}
+        )
+        session = {
+            "results": results_key,
+            "parameters": json.dumps(entry["parameters"]),
+            "inputs": json.dumps(input_keys),
+            "summary": json.dumps(get_summary(results)),
+            "run": run_hash,
+            "created": str(now),
+        }
+        session_parts = [results_key, *input_keys.values()]
+        if len(results.columns) > 0:
+            partition_keys = [results_key + ":by_source", results_key + ":by_target"]
+            for level, key in enumerate(partition_keys):
+                parts[key] = (partial(dump_partitions, level=level), results)
+            session["partitions"] = json.dumps(partition_keys)
+            session_parts.extend(partition_keys)
+        if entry.get("models") is not None:
+            models_key = MODELS_KEY_PREFIX + get_fit_hash(
+                entry["parameters"], input_keys
+            )
+            parts[models_key] = (dump_models, entry["models"])
+            session["models"] = models_key
+            session_parts.append(models_key)
+        session["parts"] = json.dumps(session_parts)
+        sessions[session_key(session_id)] = session
+
+    # only serialize and send parts which are not cached yet
+    part_keys = [*parts, *stored]
+    with measure("serialize"):
+        blobs = {
+            key: dump(value)
+            for (key, (dump, value)), exists in zip(
+                parts.items(), store.exists_many(list(parts))
+            )
+            if not exists
+        }
+
+    sizes = {key: get_mapping_size(session) for key, session in sessions.items()}
+    sizes.update(
+        {
+            key: get_mapping_size(blob) if isinstance(blob, dict) else len(blob)
+            for key, blob in blobs.items()
+        }
     )
 
+    for key, session in sessions.items():
+        if not CACHE_SESSION_MAX_BYTES:
+            break
+        size = get_session_size(sizes, key, session)
+        if size > CACHE_SESSION_MAX_BYTES and "models" in session:
+            # the models only speed up reruns, the session is cached without them
+            models_key = session.pop("models")
+            session["parts"] = json.dumps(
+                [part for part in json.loads(session["parts"]) if part != models_key]
+            )
+            if not any(
+                models_key in json.loads(other["parts"]) for other in sessions.values()
+            ):
+                blobs.pop(models_key, None)
+                sizes.pop(models_key, None)
+                part_keys.remove(models_key)
+            sizes[key] = get_mapping_size(session)
+            size = get_session_size(sizes, key, session)
+        if size > CACHE_SESSION_MAX_BYTES:
+            raise ValueError(
+                f"DysRegNet results are too large to be cached ({size / 1024**2:.1f} MiB,"
+                f" limit: {CACHE_SESSION_MAX_BYTES / 1024**2:.1f} MiB)"
+            )
+
+    # artifacts first, so sessions never point to missing artifacts
+    store.put_many(blobs)
+
+    pipe = cache.pipeline(transaction=False)
+    for key, session in sessions.items():
+        pipe.hset(key, mapping=session)
+        pipe.set(RUN_KEY_PREFIX + session["run"], key[len(CACHE_KEY_PREFIX) :])
+        sizes[RUN_KEY_PREFIX + session["run"]] = len(key)
+    if CACHE_TTL:
+        # artifacts outside of redis are expired by evict_data
+        for key in [*sizes, *part_keys]:
+            pipe.expire(key, CACHE_TTL)
+    pipe.zadd(CACHE_LRU_KEY, {key: now for key in [*sizes, *part_keys]})
+    set_sizes(pipe, sizes)
+    pipe.execute()
+
+    CACHE_BYTES.labels("in").inc(sum(sizes.values()))
+    for key in blobs:
+        CACHE_ENTRY_BYTES.labels(get_part_kind(key)).observe(sizes[key])
+
+    evict_data(keep={*sizes, *part_keys})
+
+
+def get_session_size(sizes: Dict[str, int], key: str, session: Dict[str, str]) -> int:
+    return sizes[key] + sum(sizes.get(part, 0) for part in json.loads(session["parts"]))
+
 
-def get_data(session_id):
+def cache_inputs(inputs: Inputs) -> Dict[str, str]:
     """
-    Function to get cached DysRegNet result data based on session_id.
+    Function to store input tables ahead of a run, e.g. for subtasks on other
+    workers which read them.
+
+    Returns:
+        Dict[str, str]: input name to key, which can be passed as input to cache_data
     """
+    tables = get_input_tables(inputs)
+    input_keys = get_input_keys(inputs)
+    keys = list(input_keys.values())
+    missing = {key for key, exists in zip(keys, store.exists_many(keys)) if not exists}
+    cache_artifacts(
+        {
+            key: dump_table(tables[name])
+            for name, key in input_keys.items()
+            if key in missing
+        },
+        touch=keys,
+    )
+    return input_keys
 
-    if "DysRegNet_" + str(session_id) in cache.keys():
-        return json.loads(cache.get(CACHE_KEY_PREFIX + str(session_id)))
-    else:
+
+def cache_artifacts(blobs: Dict[str, bytes], touch: Sequence[str] = ()):
+    """
+    Function to store artifacts which do not belong to a session yet (inputs
+    ahead of a run, intermediate results of a distributed run). They are
+    indexed like session parts, so they expire and count for the budget.
+
+    Args:
+        blobs (Dict[str, bytes]): artifacts to store
+        touch (Sequence[str]): stored artifacts to mark as recently used
+    """
+    store.put_many(blobs)
+    index_artifacts({key: len(blob) for key, blob in blobs.items()}, touch=touch)
+
+
+def index_artifacts(sizes: Dict[str, int], touch: Sequence[str] = ()):
+    """
+    Function to index artifacts which are already in the store (e.g. the
+    blocks of a finished upload), see cache_artifacts.
+
+    Args:
+        sizes (Dict[str, int]): bytes of the stored artifacts to index
+        touch (Sequence[str]): indexed artifacts to mark as recently used
+    """
+    keys = [*sizes, *touch]
+    if not keys:
+        return
+    pipe = cache.pipeline(transaction=False)
+    if CACHE_TTL:
+        for key in keys:
+            pipe.expire(key, CACHE_TTL)
+    pipe.zadd(CACHE_LRU_KEY, {key: time.time() for key in keys})
+    if sizes:
+        set_sizes(pipe, sizes)
+    pipe.execute()
+
+    CACHE_BYTES.labels("in").inc(sum(sizes.values()))
+    for key, size in sizes.items():
+        CACHE_ENTRY_BYTES.labels(get_part_kind(key)).observe(size)
+
+    evict_data(keep=set(keys))
+
+
+def get_artifacts(keys: Sequence[str]) -> List[Union[bytes, None]]:
+    """
+    Function to read artifacts stored with cache_artifacts, None for missing ones.
+    """
+    blobs = store.get_many(keys)
+    CACHE_BYTES.labels("out").inc(sum(len(blob) for blob in blobs if blob))
+    return blobs
+
+
+def delete_artifacts(keys: Sequence[str]):
+    if keys:
+        store.delete_many(keys)
+        remove_from_index(list(keys))
+
+
+def get_input_tables(inputs: Inputs) -> Dict[str, pd.DataFrame]:
+    """
+    Returns the input tables which are not given by their keys.
+    """
+    if isinstance(inputs, DysRegNetDataset):
+        return inputs.tables
+    return {
+        name: pd.DataFrame(table)
+        for name, table in inputs.items()
+        if not isinstance(table, str)
+    }
+
+
+def get_input_keys(inputs: Inputs) -> Dict[str, str]:
+    """
+    Returns the keys of the input tables, the content hashes of datasets are
+    only computed once.
+    """
+    if isinstance(inputs, DysRegNetDataset):
+        return {
+            name: INPUT_KEY_PREFIX + inputs.get_hash(name) for name in inputs.tables
+        }
+    return {
+        name: (
+            table
+            if isinstance(table, str)
+            else INPUT_KEY_PREFIX + get_table_hash(pd.DataFrame(table))
+        )
+        for name, table in inputs.items()
+    }
+
+
+def get_part_kind(key: str) -> str:
+    if key.startswith(INPUT_KEY_PREFIX):
+        return "input"
+    if key.startswith(PARTIAL_KEY_PREFIX):
+        return "partial"
+    if key.startswith(MODELS_KEY_PREFIX):
+        return "models"
+    if key.startswith(UPLOAD_KEY_PREFIX):
+        return "upload"
+    if key.endswith((":by_source", ":by_target")):
+        return "partitions"
+    return "results"
+
+
+def get_run_hash(parameters: Dict[str, Any], input_keys: Dict[str, str]) -> str:
+    """
+    Returns a hash of all inputs and parameters of a DysRegNet run. Covariate
+    lists are sorted, as their order does not change the results.
+    """
+    normalized = dict(parameters)
+    for name in ("cat_cov", "con_cov"):
+        normalized[name] = sorted(normalized.get(name) or [])
+
+    return hashlib.sha256(
+        json.dumps(
+            {"parameters": normalized, "inputs": input_keys}, sort_keys=True
+        ).encode()
+    ).hexdigest()
+
+
+def get_fit_hash(parameters: Dict[str, Any], input_keys: Dict[str, str]) -> str:
+    """
+    Returns a hash of the inputs and parameters the edge models of a run are
+    fitted with, i.e. without the thresholds.
+    """
+    return get_run_hash(
+        {
+            name: value
+            for name, value in parameters.items()
+            if name not in THRESHOLD_PARAMETERS
+        },
+        input_keys,
+    )
+
+
+def get_cached_models(
+    parameters: Dict[str, Any],
+    inputs: Inputs,
+) -> Union[EdgeModels, None]:
+    """
+    Function to look up the fitted edge models of a run with the same inputs
+    and parameters apart from the thresholds.
+
+    Returns:
+        Union[EdgeModels, None]: the models, None if they are not cached
+    """
+    input_keys = get_input_keys(inputs)
+    blob = store.get_many([MODELS_KEY_PREFIX + get_fit_hash(parameters, input_keys)])[0]
+    count_lookup("models", blob is not None)
+    if blob is None:
+        return None
+
+    CACHE_BYTES.labels("out").inc(len(blob))
+    with measure("deserialize"):
+        return load_models(blob)
+
+
+def has_cached_run(parameters: Dict[str, Any], inputs: Inputs) -> bool:
+    """
+    Function to check if a DysRegNet run is answered from the cache, either by
+    an identical run or by the fitted edge models of a run with other thresholds.
+    """
+    input_keys = get_input_keys(inputs)
+    cached_session_id = cache.get(RUN_KEY_PREFIX + get_run_hash(parameters, input_keys))
+    if cached_session_id is not None and check_cache(cached_session_id.decode()):
+        return True
+    return store.exists_many(
+        [MODELS_KEY_PREFIX + get_fit_hash(parameters, input_keys)]
+    )[0]
+
+
+def copy_cached_run(
+    parameters: Dict[str, Any],
+    inputs: Inputs,
+    session_id: str,
+) -> bool:
+    """
+    Function to look up an identical DysRegNet run (same inputs and parameters)
+    and, if all of its parts are still cached, store it as new session session_id.
+
+    Returns:
+        bool: True if the cached run was copied to session_id
+    """
+    input_keys = get_input_keys(inputs)
+    run_hash = get_run_hash(parameters, input_keys)
+
+    cached_session_id = cache.get(RUN_KEY_PREFIX + run_hash)
+    session = (
+        cache.hgetall(session_key(cached_session_id.decode()))
+        if cached_session_id is not None and check_cache(cached_session_id.decode())
+        else None
+    )
+    count_lookup("run", bool(session))
+    if not session:
+        return False
+
+    key = session_key(session_id)
+    session[b"created"] = str(time.time())
+    touched = [key, RUN_KEY_PREFIX + run_hash, *json.loads(session[b"parts"])]
+    pipe = cache.pipeline(transaction=False)
+    pipe.hset(key, mapping=session)
+    pipe.set(RUN_KEY_PREFIX + run_hash, session_id)
+    if CACHE_TTL:
+        for touched_key in touched:
+            pipe.expire(touched_key, CACHE_TTL)
+    pipe.zadd(CACHE_LRU_KEY, {touched_key: time.time() for touched_key in touched})
+    set_sizes(pipe, {key: get_mapping_size(session)})
+    pipe.execute()
+
+    return True
+
+
+def get_mapping_size(mapping: Dict[str, Union[str, bytes]]) -> int:
+    return sum(len(field) + len(value) for field, value in mapping.items())
+
+
+def evict_data(keep=()) -> List[str]:
+    """
+    Function to drop expired keys from the LRU index and to evict the least
+    recently used sessions until the cache fits into CACHE_MAX_BYTES.
+
+    Args:
+        keep (Iterable[str]): keys which must not be evicted, e.g. the ones just cached
+
+    Returns:
+        List[str]: the evicted keys
+    """
+
+    # keys expired by redis are still in the index, they are the oldest ones
+    if CACHE_TTL:
+        expired = [
+            key.decode()
+            for key in cache.zrangebyscore(
+                CACHE_LRU_KEY, "-inf", time.time() - CACHE_TTL
+            )
+        ]
+        if expired:
+            store.delete_many([key for key in expired if is_artifact(key)])
+            remove_from_index(expired)
+            CACHE_EVICTIONS.labels("expired").inc(len(expired))
+
+    if not CACHE_MAX_BYTES:
+        return []
+    total = get_total_size()
+    if total <= CACHE_MAX_BYTES:
+        return []
+
+    # only the least recently used keys are read, as many as the budget needs
+    entries = []
+    evictable = 0
+    while total - evictable > CACHE_MAX_BYTES:
+        keys = [
+            key.decode()
+            for key in cache.zrange(
+                CACHE_LRU_KEY, len(entries), len(entries) + EVICTION_BATCH_SIZE - 1
+            )
+        ]
+        if not keys:
+            # the whole index was read, its sizes are the exact total
+            total = sum(size for _, size in entries)
+            cache.set(CACHE_TOTAL_KEY, total)
+            break
+        sizes = [int(size or 0) for size in cache.hmget(CACHE_SIZES_KEY, keys)]
+        entries.extend(zip(keys, sizes))
+        evictable += sum(size for key, size in zip(keys, sizes) if key not in keep)
+
+    evicted = {}
+    for key, size in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        if key in keep:
+            continue
+        total -= size
+        evicted[key] = size
+
+    if evicted:
+        store.delete_many([key for key in evicted if is_artifact(key)])
+        metadata = [key for key in evicted if not is_artifact(key)]
+        if metadata:
+            cache.delete(*metadata)
+        remove_from_index(list(evicted))
+        CACHE_EVICTIONS.labels("budget").inc(len(evicted))
+        CACHE_EVICTED_BYTES.inc(sum(evicted.values()))
+
+    return list(evicted)
+
+
+def get_total_size() -> int:
+    """
+    Returns the total bytes of all indexed keys.
+    """
+    total = cache.get(CACHE_TOTAL_KEY)
+    if total is None:
+        # e.g. the index of a previous version, counted once
+        total = sum(int(size) for size in cache.hvals(CACHE_SIZES_KEY))
+        cache.set(CACHE_TOTAL_KEY, total)
+    return int(total)
+
+
+def set_sizes(pipe: redis.client.Pipeline, sizes: Dict[str, int]):
+    """
+    Adds setting the sizes of indexed keys to pipe, and the change of the total.
+    """
+    previous = cache.hmget(CACHE_SIZES_KEY, list(sizes))
+    pipe.hset(CACHE_SIZES_KEY, mapping=sizes)
+    pipe.incrby(
+        CACHE_TOTAL_KEY,
+        sum(sizes.values()) - sum(int(size or 0) for size in previous),
+    )
+
+
+def remove_from_index(keys: List[str]):
+    sizes = cache.hmget(CACHE_SIZES_KEY, keys)
+    pipe = cache.pipeline(transaction=False)
+    pipe.zrem(CACHE_LRU_KEY, *keys)
+    for key in keys:
+        pipe.hdel(CACHE_SIZES_KEY, key)
+    deleted = pipe.execute()[1:]
+    # only keys this call removed, so concurrent evictions count them once
+    freed = sum(int(size or 0) for size, done in zip(sizes, deleted) if done)
+    if freed:
+        cache.decrby(CACHE_TOTAL_KEY, freed)
+
+
+@CACHE_LATENCY.labels("read").time()
+def get_data_many(
+    session_ids: List[str], fields: Sequence[str] = ("results", "parameters")
+) -> List[Union[Dict[str, Any], None]]:
+    """
+    Function to get parts of several cached sessions. Only the requested fields
+    are fetched and decoded, using two redis round trips for any number of sessions.
+    Reading a session extends the expiry of all its parts and marks them as
+    recently used. Parsed results are kept in a per-process LRU and only
+    re-fetched if their blob changed or was evicted.
+
+    Args:
+        session_ids (List[str]): unique session identifiers
+        fields (Sequence[str]): any of SESSION_FIELDS
+
+    Returns:
+        List[Union[Dict[str, Any], None]]: the cached fields, None for missing
+        sessions. results are a DysregulationMatrix, inputs a dict of DataFrames.
+    """
+
+    keys = [session_key(session_id) for session_id in session_ids]
+    pipe = cache.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, ["parts", *fields])
+    replies = pipe.execute(raise_on_error=False)
+
+    # collect blob keys to read and keys to touch for all sessions,
+    # results which are parsed already are only checked for existence
+    sessions = []
+    legacy_keys = []
+    blob_keys = []
+    local = {}
+    touched = []
+    for key, reply in zip(keys, replies):
+        if isinstance(reply, redis.ResponseError):
+            # single blob session of a previous version
+            sessions.append(None)
+            legacy_keys.append(key)
+            touched.append(key)
+        elif reply[0] is None:
+            sessions.append({})
+        else:
+            session = dict(zip(fields, reply[1:]))
+            if "results" in fields:
+                results_key = session["results"].decode()
+                results = get_local_results(results_key)
+                count_lookup("local", results is not None)
+                if results is None:
+                    blob_keys.append(results_key)
+                else:
+                    local[results_key] = results
+            if "inputs" in fields:
+                session["inputs"] = json.loads(session["inputs"])
+                blob_keys.extend(session["inputs"].values())
+            sessions.append(session)
+            touched.append(key)
+            touched.extend(json.loads(reply[0]))
+
+    blobs = dict(zip(blob_keys, store.get_many(blob_keys)))
+    local_exists = store.exists_many(list(local)) if local else []
+
+    pipe = cache.pipeline(transaction=False)
+    if legacy_keys:
+        pipe.mget(legacy_keys)
+    if CACHE_TTL:
+        for key in touched:
+            pipe.expire(key, CACHE_TTL)
+    if touched:
+        # xx: only refresh keys which are still indexed
+        pipe.zadd(CACHE_LRU_KEY, {key: time.time() for key in touched}, xx=True)
+    replies = pipe.execute()
+    if legacy_keys:
+        blobs.update(zip(legacy_keys, replies[0]))
+
+    # drop parsed results whose blob was evicted meanwhile
+    parsed = {}
+    for key, exists in zip(local, local_exists):
+        if exists:
+            parsed[key] = local[key]
+        else:
+            drop_local_results(key)
+
+    CACHE_BYTES.labels("out").inc(sum(len(blob) for blob in blobs.values() if blob))
+
+    data = []
+    with measure("deserialize"):
+        for key, session in zip(keys, sessions):
+            if session is None:
+                data.append(decode_legacy_session(blobs[key], fields))
+            elif not session:
+                data.append(None)
+            else:
+                data.append(decode_session(session, fields, blobs, parsed))
+
+    for session in data:
+        count_lookup("read", session is not None)
+
+    return data
+
+
+def get_local_results(key: str) -> Union[DysregulationMatrix, None]:
+    with local_results_lock:
+        results = local_results.get(key)
+        if results is not None:
+            local_results.move_to_end(key)
+        return results
+
+
+def set_local_results(key: str, results: DysregulationMatrix):
+    if not LOCAL_CACHE_SIZE:
+        return
+    with local_results_lock:
+        local_results[key] = results
+        local_results.move_to_end(key)
+        while len(local_results) > LOCAL_CACHE_SIZE:
+            local_results.popitem(last=False)
+
+
+def drop_local_results(key: str):
+    with local_results_lock:
+        local_results.pop(key, None)
+
+
+def decode_session(
+    session: Dict[str, Any],
+    fields: Sequence[str],
+    blobs: Dict[str, bytes],
+    parsed: Dict[str, DysregulationMatrix],
+) -> Union[Dict[str, Any], None]:
+    decoded = {}
+    for field in fields:
+        if field == "results":
+            key = session["results"].decode()
+            if key in parsed:
+                decoded["results"] = parsed[key]
+                continue
+            if blobs.get(key) is None:
+                # evicted part
+                return None
+            decoded["results"] = load_results(blobs[key])
+            set_local_results(key, decoded["results"])
+        elif field == "inputs":
+            decoded["inputs"] = {}
+            for name, key in session["inputs"].items():
+                if blobs[key] is None:
+                    return None
+                decoded["inputs"][name] = load_table(blobs[key])
+        else:
+            decoded[field] = json.loads(session[field])
+    return decoded
+
+
+def decode_legacy_session(
+    blob: Union[bytes, None], fields: Sequence[str]
+) -> Union[Dict[str, Any], None]:
+    if blob is None:
+        return None
+
+    data = load_session(blob)
+    parameters = dict(data["parameters"])
+    inputs = {
+        name: pd.DataFrame(parameters.pop(name))
+        for name in ("expression", "meta", "network")
+        if name in parameters
+    }
+    decoded = {
+        "results": data["results"],
+        "parameters": parameters,
+        "inputs": inputs,
+        "summary": get_summary(data["results"]),
+    }
+    return {field: decoded[field] for field in fields}
+
+
+def get_data(session_id, fields: Sequence[str] = ("results", "parameters")):
+    """
+    Function to get cached DysRegNet data based on session_id.
+    """
+
+    data = get_data_many([session_id], fields)[0]
+    if data is None:
+        # results of a running session computed so far
+        data = get_partial_data(session_id, fields)
+    if data is None:
         raise RuntimeError("Missing session_id: " + str(session_id))
+    return data
+
+
+def get_cached_results(session_id) -> DysregulationMatrix:
+    """
+    Function to get cached sparse DysRegNet results with (source, target) columns.
+    The matrix may be shared with other callbacks of this process, do not modify it.
+    """
+    return get_data(session_id, ["results"])["results"]
+
+
+@CACHE_LATENCY.labels("neighborhood").time()
+def get_cached_neighborhood(
+    session_id, genes: List[str]
+) -> Tuple[DysregulationMatrix, DysregulationMatrix]:
+    """
+    Function to get the cached results of all edges with a source and of all edges
+    with a target among genes, like get_sources and get_targets on the results.
+    Only the partitions of these genes are fetched, the full results are loaded
+    for sessions cached without partitions.
+    """
+    key = session_key(session_id)
+    reply = (
+        cache.pipeline(transaction=False)
+        .hmget(key, ["parts", "partitions", "summary"])
+        .execute(raise_on_error=False)[0]
+    )
+    if isinstance(reply, redis.ResponseError) or reply[1] is None:
+        count_lookup("neighborhood", False)
+        results = get_cached_results(session_id)
+        return get_sources(results, genes), get_targets(results, genes)
+
+    source_key, target_key = json.loads(reply[1])
+    touched = [key, *json.loads(reply[0])]
+    source_blobs = store.get_fields(source_key, genes)
+    target_blobs = store.get_fields(target_key, genes)
+
+    pipe = cache.pipeline(transaction=False)
+    if CACHE_TTL:
+        for touched_key in touched:
+            pipe.expire(touched_key, CACHE_TTL)
+    pipe.zadd(CACHE_LRU_KEY, {key: time.time() for key in touched}, xx=True)
+    pipe.execute()
+
+    found = source_blobs is not None and target_blobs is not None
+    count_lookup("neighborhood", found)
+    if not found:
+        # evicted partitions
+        results = get_cached_results(session_id)
+        return get_sources(results, genes), get_targets(results, genes)
+
+    CACHE_BYTES.labels("out").inc(
+        sum(len(blob) for blob in source_blobs + target_blobs if blob)
+    )
+    patients = json.loads(reply[2])["patients"]
+    return (
+        load_partitions(source_blobs, patients),
+        load_partitions(target_blobs, patients),
+    )
+
+
+def start_partial(session_id: str, edges: int):
+    """
+    Function to register a running session, whose finished edge chunks are
+    published with cache_partial until the session is cached with cache_data.
+
+    Args:
+        session_id (str): the session of the run
+        edges (int): the number of edges of the run
+    """
+    key = PARTIAL_KEY_PREFIX + session_id
+    pipe = cache.pipeline(transaction=False)
+    pipe.delete(key)
+    pipe.hset(key, mapping={"edges": edges, "done": 0, "created": str(time.time())})
+    pipe.expire(key, PARTIAL_TTL)
+    pipe.execute()
+
+
+def cache_partial(
+    session_id: str, chunk: int, results: DysregulationMatrix, edges: int
+) -> str:
+    """
+    Function to publish the results of a finished edge chunk of a running session.
+    Chunks which finish after the run was dropped (e.g. it failed) are discarded.
+
+    Args:
+        session_id (str): the session of the run
+        chunk (int): the position of the chunk in the GRN
+        results (DysregulationMatrix): the results of the chunk
+        edges (int): the number of GRN edges of the chunk
+
+    Returns:
+        str: the key of the chunk results
+    """
+    partial_key = PARTIAL_KEY_PREFIX + session_id
+    key = f"{partial_key}:{chunk}"
+    cache_artifacts({key: dump_results(results)})
 
+    def publish(pipe: redis.client.Pipeline) -> bool:
+        if not pipe.exists(partial_key):
+            return False
+        pipe.multi()
+        pipe.hset(partial_key, f"chunk:{chunk}", key)
+        pipe.hincrby(partial_key, "done", edges)
+        pipe.expire(partial_key, PARTIAL_TTL)
+        return True
 
-def get_cached_results(session_id):
-    results = pd.DataFrame(get_data(session_id)["results"])
-    # TODO? [tuple(c.split(",")) for c in results_convert.columns]
-    return results
+    # the progress must not be recreated once drop_partial removed it
+    if not cache.transaction(publish, partial_key, value_from_callable=True):
+        delete_artifacts([key])
+    return key
+
+
+def get_partial(session_id: str) -> Union[Dict[str, Any], None]:
+    """
+    Function to get the progress of a running session.
+
+    Returns:
+        Union[Dict[str, Any], None]: {"edges": ..., "done": ..., "chunks": ...} with
+        the number of edges of the run, of the finished edges and the keys of the
+        finished chunks in GRN order, None if the session is not running
+    """
+    partial = cache.hgetall(PARTIAL_KEY_PREFIX + session_id)
+    # e.g. the chunks of a dropped run published by a previous version
+    if b"edges" not in partial:
+        return None
+
+    chunks = sorted(
+        (int(field.decode().split(":")[1]), key.decode())
+        for field, key in partial.items()
+        if field.startswith(b"chunk:")
+    )
+    return {
+        "edges": int(partial[b"edges"]),
+        "done": int(partial[b"done"]),
+        "chunks": [key for _, key in chunks],
+    }
+
+
+def get_partial_results(session_id: str) -> Union[DysregulationMatrix, None]:
+    """
+    Function to get the results of the finished edge chunks of a running session.
+
+    Returns:
+        Union[DysregulationMatrix, None]: the results so far, None if the session
+        is not running
+    """
+    partial = get_partial(session_id)
+    if partial is None:
+        return None
+
+    blobs = [blob for blob in get_artifacts(partial["chunks"]) if blob is not None]
+    if not blobs:
+        return DysregulationMatrix.from_coo(
+            np.array([], dtype=np.float32), [], [], [], [], []
+        )
+    with measure("deserialize"):
+        return merge_chunks([load_results(blob) for blob in blobs])
+
+
+def get_partial_data(
+    session_id: str, fields: Sequence[str]
+) -> Union[Dict[str, Any], None]:
+    if not set(fields) <= {"results", "summary"}:
+        return None
+    results = get_partial_results(session_id)
+    if results is None:
+        return None
+    return {"results": results, "summary": get_summary(results)}
+
+
+def drop_partial(session_id: str):
+    """
+    Function to remove the progress and chunks of a finished or failed run.
+    """
+    partial_key = PARTIAL_KEY_PREFIX + session_id
+
+    def drop(pipe: redis.client.Pipeline) -> List[str]:
+        chunks = [
+            key.decode()
+            for field, key in pipe.hgetall(partial_key).items()
+            if field.startswith(b"chunk:")
+        ]
+        pipe.multi()
+        pipe.delete(partial_key)
+        return chunks
+
+    # chunks published meanwhile are dropped as well
+    delete_artifacts(cache.transaction(drop, partial_key, value_from_callable=True))
+
+
+def get_cached_results_frame(session_id) -> pd.DataFrame:
+    """
+    Function to get cached DysRegNet results as dense DataFrame.
+    """
+    return get_cached_results(session_id).to_frame()
+
+
+def get_cached_parameters(session_id) -> Dict[str, Any]:
+    """
+    Function to get the cached DysRegNet parameters (without inputs).
+    """
+    return get_data(session_id, ["parameters"])["parameters"]
+
+
+def get_cached_inputs(session_id) -> Dict[str, pd.DataFrame]:
+    """
+    Function to get the cached expression, meta and network data.
+    """
+    return get_data(session_id, ["inputs"])["inputs"]
+
+
+def get_cached_summary(session_id) -> Dict[str, Any]:
+    """
+    Function to get the cached summary stats (patients, genes, edges, dysregulations).
+    """
+    return get_data(session_id, ["summary"])["summary"]
 
 
 def check_cache(session_id):
     """
-    Function to check if session_id is in cache.
+    Function to check if session_id and all its parts are in cache.
+    """
+    key = session_key(session_id)
+    pipe = cache.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.hget(key, "parts")
+    exists, parts = pipe.execute(raise_on_error=False)
+
+    if not exists:
+        found = False
+    elif isinstance(parts, redis.ResponseError) or parts is None:
+        # single blob session of a previous version
+        found = True
+    else:
+        found = all(store.exists_many(json.loads(parts)))
+
+    count_lookup("check", found)
+    return found
+
+
+def get_session_footprints(limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Function to list the largest cached sessions for capacity planning.
+
+    bytes counts the session and all its parts, unique_bytes only the parts
+    which are not shared with other sessions (e.g. the same network).
+
+    Args:
+        limit (int): maximum number of sessions
+
+    Returns:
+        List[Dict[str, Any]]: session_id, bytes, unique_bytes, created and
+        last_access (unix time, created is None for sessions of previous versions),
+        largest first
+    """
+    entries = cache.zrange(CACHE_LRU_KEY, 0, -1, withscores=True)
+    last_access = {
+        key.decode(): score
+        for key, score in entries
+        if key.decode().startswith(CACHE_KEY_PREFIX)
+    }
+    keys = list(last_access)
+    if not keys:
+        return []
+
+    pipe = cache.pipeline(transaction=False)
+    for key in keys:
+        pipe.hmget(key, ["parts", "created"])
+    replies = pipe.execute(raise_on_error=False)
+
+    sessions = {}
+    for key, reply in zip(keys, replies):
+        if isinstance(reply, redis.ResponseError):
+            # single blob session of a previous version
+            sessions[key] = ([], None)
+        elif reply[0] is not None:
+            sessions[key] = (json.loads(reply[0]), reply[1])
+
+    references = {}
+    for parts, _ in sessions.values():
+        for part in parts:
+            references[part] = references.get(part, 0) + 1
+
+    size_keys = [*sessions, *references]
+    sizes = dict(
+        zip(
+            size_keys,
+            (
+                [int(size or 0) for size in cache.hmget(CACHE_SIZES_KEY, size_keys)]
+                if size_keys
+                else []
+            ),
+        )
+    )
+
+    footprints = [
+        {
+            "session_id": key[len(CACHE_KEY_PREFIX) :],
+            "bytes": sizes[key] + sum(sizes[part] for part in parts),
+            "unique_bytes": sizes[key]
+            + sum(sizes[part] for part in parts if references[part] == 1),
+            "created": float(created) if created is not None else None,
+            "last_access": last_access[key],
+        }
+        for key, (parts, created) in sessions.items()
+    ]
+    footprints.sort(key=lambda footprint: footprint["bytes"], reverse=True)
+    return footprints[:limit]
+
+
+def get_cache_usage() -> Dict[str, int]:
+    """
+    Function to get the total size and number of cached keys and sessions.
     """
-    return "DysRegNet_" + str(session_id) in cache.keys()
+    sizes = cache.hgetall(CACHE_SIZES_KEY)
+    return {
+        "bytes": sum(int(size) for size in sizes.values()),
+        "keys": len(sizes),
+        "sessions": sum(
+            1 for key in sizes if key.decode().startswith(CACHE_KEY_PREFIX)
+        ),
+    }
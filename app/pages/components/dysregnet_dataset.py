@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+# Keeps expression and control data, input artifacts and fitted residuals in
+# single precision, which halves their memory and serialized size. The models
+# are still fitted in double precision.
+FLOAT32 = os.getenv("DYSREGNET_FLOAT32", "False") == "True"
+FLOAT_DTYPE = np.float32 if FLOAT32 else np.float64
+
+
+class DysRegNetDataset:
+    """
+    Input tables of a DysRegNet run: expression data, metadata and the gene
+    regulatory network.
+
+    The tables are loaded once from the stored uploads when a run starts and
+    then passed by reference to the run, the engines and the session cache.
+    Their content hashes (see get_table_hash) and the number of edges a run
+    fits are computed at most once.
+    """
+
+    def __init__(
+        self, expression: pd.DataFrame, meta: pd.DataFrame, network: pd.DataFrame
+    ):
+        self.expression = expression
+        self.meta = meta
+        self.network = network
+        self.hashes = {}
+        self.run_edges = None
+
+    @property
+    def tables(self) -> Dict[str, pd.DataFrame]:
+        return {
+            "expression": self.expression,
+            "meta": self.meta,
+            "network": self.network,
+        }
+
+    @property
+    def n_samples(self) -> int:
+        return len(self.expression)
+
+    @property
+    def n_genes(self) -> int:
+        # the first column holds the sample ids
+        return max(len(self.expression.columns) - 1, 0)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.network)
+
+    @property
+    def n_run_edges(self) -> int:
+        """
+        The edges of the network a run fits, see get_run_network.
+        """
+        if self.run_edges is None:
+            self.run_edges = len(
+                get_run_network(self.network, self.expression.columns[1:])
+            )
+        return self.run_edges
+
+    def get_hash(self, name: str) -> str:
+        """
+        Returns the content hash of the table name ("expression", "meta" or "network").
+        """
+        if name not in self.hashes:
+            self.hashes[name] = get_table_hash(self.tables[name])
+        return self.hashes[name]
+
+
+def get_run_network(network: pd.DataFrame, genes: Iterable[str]) -> pd.DataFrame:
+    """
+    Returns the edges a DysRegNet run fits like dysregnet.run does: the edges
+    between genes of the expression data, without duplicates.
+    """
+    genes = set(genes)
+    return network[
+        network.iloc[:, 0].isin(genes) & network.iloc[:, 1].isin(genes)
+    ].drop_duplicates()
+
+
+def to_float_dtype(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the table with its float columns in FLOAT_DTYPE.
+    """
+    columns = table.select_dtypes(include="floating").columns
+    if FLOAT_DTYPE is np.float64 or columns.empty:
+        return table
+    return table.astype({column: FLOAT_DTYPE for column in columns})
+
+
+def get_table_hash(table: pd.DataFrame) -> str:
+    """
+    Returns a content hash of an input table.
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps([str(column) for column in table.columns]).encode())
+    sha.update(json.dumps([str(dtype) for dtype in table.dtypes]).encode())
+    sha.update(pd.util.hash_pandas_object(table).to_numpy().tobytes())
+    return sha.hexdigest()
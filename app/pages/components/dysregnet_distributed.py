@@ -0,0 +1,191 @@
+import os
+import time
+from threading import Lock
+from types import SimpleNamespace
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from celery import chord, current_app, current_task, shared_task
+from tqdm import tqdm
+
+from pages.components.dysregnet_cache import (
+    cache_data,
+    cache_inputs,
+    cache_partial,
+    drop_partial,
+    get_artifacts,
+    get_cached_results,
+    get_partial,
+    start_partial,
+)
+from pages.components.dysregnet_dataset import DysRegNetDataset
+from pages.components.dysregnet_parallel import (
+    fit_chunk,
+    get_chunks,
+    merge_chunks,
+    prepare_run,
+)
+from pages.components.dysregnet_progress import edge_progress
+from pages.components.dysregnet_results import DysregulationMatrix
+from pages.components.dysregnet_serialization import load_results, load_table
+
+# Edge chunks of a DysRegNet run which are fitted as Celery subtasks on all
+# workers (0 runs it in the calling worker, default). The run waits for its
+# subtasks, so they need workers which are not busy with runs themselves:
+# they are sent to their own queue, which must not be the one of the runs.
+CELERY_CHUNKS = int(os.getenv("DYSREGNET_CELERY_CHUNKS", "0"))
+CELERY_QUEUE = os.getenv("DYSREGNET_CELERY_QUEUE", "dysregnet_chunks")
+# Seconds between two progress updates of a distributed run
+POLL_INTERVAL = 0.5
+
+# Preprocessed inputs of the last job a worker fitted chunks of, so the
+# chunks of one job only preprocess the inputs once per worker
+job_data = {}
+job_data_lock = Lock()
+
+
+def get_job_data(
+    job_id: str, input_keys: Dict[str, str], arguments: Dict[str, Any]
+) -> SimpleNamespace:
+    with job_data_lock:
+        if job_id not in job_data:
+            tables = {
+                name: load_table(blob)
+                for name, blob in zip(
+                    input_keys, get_artifacts(list(input_keys.values()))
+                )
+            }
+            job_data.clear()
+            job_data[job_id] = prepare_run(
+                expression_data=tables["expression"],
+                meta=tables["meta"],
+                GRN=tables["network"],
+                **arguments,
+            )
+        return job_data[job_id]
+
+
+@shared_task(name="dysregnet.run_chunk")
+def run_chunk_task(
+    job_id: str,
+    session_id: str,
+    chunk: int,
+    start: int,
+    stop: int,
+    input_keys: Dict[str, str],
+    arguments: Dict[str, Any],
+) -> str:
+    """
+    Fits the GRN edges start to stop of a distributed run and publishes the
+    chunk results as partial results of the session.
+
+    Returns:
+        str: the key of the chunk results
+    """
+    results = fit_chunk(get_job_data(job_id, input_keys, arguments), start, stop)
+    return cache_partial(session_id, chunk, results, stop - start)
+
+
+@shared_task(name="dysregnet.merge_chunks")
+def merge_chunks_task(
+    chunk_keys: List[str],
+    session_id: str,
+    parameters: Dict[str, Any],
+    input_keys: Dict[str, str],
+):
+    """
+    Merges the chunk results of a distributed run in GRN order and caches
+    them as the results of the session.
+    """
+    blobs = get_artifacts(chunk_keys)
+    if any(blob is None for blob in blobs):
+        raise RuntimeError("Results of a DysRegNet chunk were evicted from the cache")
+
+    results = merge_chunks([load_results(blob) for blob in blobs])
+    cache_data(session_id, results, parameters=parameters, inputs=input_keys)
+    drop_partial(session_id)
+
+
+def run_distributed(
+    chunks: int,
+    session_id: str,
+    parameters: Dict[str, Any],
+    dataset: DysRegNetDataset,
+    arguments: Dict[str, Any],
+) -> DysregulationMatrix:
+    """
+    Runs DysRegNet as a chord of edge chunk subtasks on the Celery workers,
+    whose merge step caches the results of the session. The inputs are shared
+    with the workers through the session cache. Finished chunks are partial
+    results of the session until the merge step, their progress is printed
+    like the edge loop of dysregnet.run.
+
+    Args:
+        chunks (int): the number of edge chunks
+        session_id (str): the session the results are cached for
+        parameters (Dict[str, Any]): the parameters of the session
+        dataset (DysRegNetDataset): expression, meta and network data
+        arguments (Dict[str, Any]): the arguments of dysregnet.run without the inputs
+
+    Raises:
+        ValueError: if DYSREGNET_CELERY_QUEUE is the queue of the run
+
+    Returns:
+        DysregulationMatrix: The sparse DysRegNet results.
+    """
+    # runs waiting for their chunks could occupy all workers of their queue
+    run_queues = {current_app.conf.task_default_queue}
+    if current_task and current_task.request.delivery_info:
+        run_queues.add(current_task.request.delivery_info.get("routing_key"))
+    if CELERY_QUEUE in run_queues:
+        raise ValueError(
+            f"DYSREGNET_CELERY_QUEUE={CELERY_QUEUE} is the queue of the runs, their"
+            " chunks need a queue of their own"
+        )
+
+    # checks the inputs before any subtask is started
+    n_edges = len(
+        prepare_run(
+            expression_data=dataset.expression,
+            meta=dataset.meta,
+            GRN=dataset.network,
+            **arguments,
+        ).GRN
+    )
+    input_keys = cache_inputs(dataset)
+    start_partial(session_id, n_edges)
+
+    job_id = uuid4().hex
+    ranges = get_chunks(n_edges, chunks)
+    result = chord(
+        [
+            run_chunk_task.s(
+                job_id, session_id, i, start, stop, input_keys, arguments
+            ).set(queue=CELERY_QUEUE)
+            for i, (start, stop) in enumerate(ranges)
+        ]
+    )(merge_chunks_task.s(session_id, parameters, input_keys).set(queue=CELERY_QUEUE))
+
+    try:
+        with edge_progress() as progress:
+            while not result.ready():
+                time.sleep(POLL_INTERVAL)
+                update_progress(progress, session_id)
+            update_progress(progress, session_id)
+        # raises the error of a failed subtask
+        result.maybe_throw()
+    finally:
+        if not result.successful():
+            # chunks which did not start yet are not fitted anymore
+            result.parent.revoke()
+            result.revoke()
+            drop_partial(session_id)
+
+    return get_cached_results(session_id)
+
+
+def update_progress(progress: tqdm, session_id: str):
+    partial = get_partial(session_id)
+    done = partial["done"] if partial is not None else progress.n
+    if done > progress.n:
+        progress.update(done - progress.n)
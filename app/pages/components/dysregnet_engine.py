@@ -0,0 +1,328 @@
+import os
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+from scipy import sparse, stats
+from tqdm import tqdm
+
+from pages.components.dysregnet_dataset import FLOAT_DTYPE
+from pages.components.dysregnet_progress import edge_progress
+from pages.components.dysregnet_results import DysregulationMatrix
+
+# Engine which fits the edge models: "dysregnet" fits one statsmodels OLS model
+# per edge like dysregnet.run (default), "native" fits all edges with batched
+# NumPy least squares and returns the same results.
+ENGINE = os.getenv("DYSREGNET_ENGINE", "dysregnet")
+# Edges fitted at once by the native engine, bounds its memory to about
+# 4 x samples x BLOCK_SIZE floats
+BLOCK_SIZE = 4096
+
+
+class EdgeModels:
+    """
+    Fitted models of GRN edges on the control samples: R², the coefficient of
+    the source gene and the residuals (prediction - observation) of the cases,
+    standardized with the mean and standard deviation of the control residuals.
+    These are all DysRegNet needs to score the cases with any thresholds.
+    """
+
+    def __init__(
+        self,
+        edges: List[Tuple[str, str]],
+        patients: pd.Index,
+        r2: np.ndarray,
+        coef: np.ndarray,
+        residuals: np.ndarray,
+        mean: np.ndarray,
+        std: np.ndarray,
+        normaltest: np.ndarray,
+    ):
+        self.edges = edges
+        self.patients = patients
+        self.r2 = r2
+        self.coef = coef
+        self.residuals = residuals
+        self.mean = mean
+        self.std = std
+        self.normaltest = normaltest
+
+    def get_zscores(self) -> np.ndarray:
+        """
+        Returns the raw residual z-scores, patients x edges.
+        """
+        # perfect fits have infinite z-scores, like in dysregnet.run
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.residuals - self.mean) / self.std
+
+    def get_pvalues(self, direction_condition: bool) -> np.ndarray:
+        """
+        Returns the raw p-values of the z-scores, patients x edges, one sided
+        with the direction condition and two sided otherwise.
+        """
+        sides = 1 if direction_condition else 2
+        return stats.norm.sf(np.abs(self.get_zscores())) * sides
+
+    def score(
+        self,
+        bonferroni_alpha: float,
+        R2_threshold: Union[float, None],
+        normaltest: bool,
+        normaltest_alpha: float,
+        direction_condition: bool,
+    ) -> np.ndarray:
+        """
+        Returns the DysRegNet z-scores of the cases, patients x edges, with the
+        thresholds and the direction condition of dysregnet.run applied.
+        """
+        zscores = self.get_zscores()
+        direction = np.sign(self.coef)
+
+        pvalues = self.get_pvalues(direction_condition)
+        # Bonferroni correction across the patients of an edge
+        valid = np.minimum(pvalues * len(self.patients), 1) < bonferroni_alpha
+        if direction_condition:
+            valid &= direction * self.residuals > 0
+
+        # edges whose models fit badly are not scored
+        skip = np.zeros(len(self.edges), dtype=bool)
+        if R2_threshold is not None:
+            skip |= R2_threshold > self.r2
+        if normaltest:
+            skip |= self.normaltest > normaltest_alpha
+        valid &= ~skip
+
+        return np.round(np.where(valid, np.abs(zscores) * direction, 0.0), 1)
+
+    def get_block(self, start: int, stop: int) -> "EdgeModels":
+        return EdgeModels(
+            self.edges[start:stop],
+            self.patients,
+            self.r2[start:stop],
+            self.coef[start:stop],
+            self.residuals[:, start:stop],
+            self.mean[start:stop],
+            self.std[start:stop],
+            self.normaltest[start:stop],
+        )
+
+    def to_results(self, **thresholds) -> DysregulationMatrix:
+        # scored per block of edges, so only the sparse results are in memory at once
+        blocks = [
+            sparse.csc_matrix(
+                self.get_block(start, start + BLOCK_SIZE)
+                .score(**thresholds)
+                .astype(np.float32)
+            )
+            for start in range(0, len(self.edges), BLOCK_SIZE)
+        ]
+        return DysregulationMatrix(
+            (
+                sparse.hstack(blocks, format="csc")
+                if blocks
+                else sparse.csc_matrix((len(self.patients), 0), dtype=np.float32)
+            ),
+            pd.Index(self.patients, name="patient id"),
+            (
+                pd.MultiIndex.from_tuples(self.edges)
+                if self.edges
+                else pd.MultiIndex.from_arrays([[], []])
+            ),
+        )
+
+
+def get_samples(data: SimpleNamespace) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+    """
+    Returns the control and case samples and the covariate columns of a
+    prepared run, like dysregnet.functions.dyregnet_model.
+    """
+    if data.cov_df is None:
+        return data.expr.loc[data.control], data.expr.loc[data.case], []
+
+    control = pd.merge(
+        data.cov_df.loc[data.control], data.expr, left_index=True, right_index=True
+    ).drop_duplicates()
+    case = pd.merge(
+        data.cov_df.loc[data.case], data.expr, left_index=True, right_index=True
+    ).drop_duplicates()
+    return control, case, list(data.cov_df.columns)
+
+
+def get_edges(GRN: pd.DataFrame) -> List[Tuple[str, str]]:
+    """
+    Returns the unique edges of a GRN in order, without self loops.
+    """
+    edges = dict.fromkeys(zip(GRN.iloc[:, 0], GRN.iloc[:, 1]))
+    return [edge for edge in edges if edge[0] != edge[1]]
+
+
+def is_nonzero_constant(values: np.ndarray) -> np.ndarray:
+    """
+    Returns the columns statsmodels' add_constant treats as constant, the
+    models of edges with such columns have no separate intercept.
+    """
+    return (np.ptp(values, axis=0) == 0) & np.all(values != 0, axis=0)
+
+
+def fit_edge(
+    control: pd.DataFrame,
+    case: pd.DataFrame,
+    covariates: List[str],
+    edge: Tuple[str, str],
+) -> Tuple[float, float, np.ndarray, pd.Series]:
+    """
+    Fits the model of one edge with statsmodels exactly like dysregnet.run.
+
+    Returns:
+        Tuple[float, float, np.ndarray, pd.Series]: R², source coefficient,
+        case residuals and control residuals
+    """
+    x_train = sm.add_constant(control[[edge[0]] + covariates])
+    model = sm.OLS(control[edge[1]].values, x_train).fit()
+    resid_control = model.predict(x_train) - control[edge[1]].values
+
+    x_test = sm.add_constant(case[[edge[0]] + covariates])
+    resid_case = np.asarray(model.predict(x_test) - case[edge[1]].values)
+    return model.rsquared, model.params.iloc[1], resid_case, resid_control
+
+
+def fit_edges(
+    data: SimpleNamespace, edges: List[Tuple[str, str]], progress: tqdm = None
+) -> EdgeModels:
+    """
+    Fits the models target ~ source + covariates of all edges on the control
+    samples. The design without the source gene is shared by all edges, so it
+    is decomposed once and the source and target genes are projected onto its
+    orthogonal complement (Frisch-Waugh-Lovell), which leaves one regression
+    coefficient per edge. Edges whose design is degenerate for this (constant
+    or collinear source genes, perfect fits) are fitted with statsmodels like
+    dysregnet.run.
+
+    Args:
+        data (SimpleNamespace): a run prepared by dysregnet_parallel.prepare_run
+        edges (List[Tuple[str, str]]): unique edges without self loops
+        progress (tqdm): progress bar which is updated per block of edges
+    """
+    control, case, covariates = get_samples(data)
+
+    # shared design: intercept and covariates
+    design = np.column_stack(
+        [np.ones(len(control)), control[covariates].to_numpy(dtype=np.float64)]
+    )
+    design_case = np.column_stack(
+        [np.ones(len(case)), case[covariates].to_numpy(dtype=np.float64)]
+    )
+    design_pinv = np.linalg.pinv(design)
+    # models which are not fitted natively: covariates which replace the
+    # intercept and designs without residual degrees of freedom
+    fallback = (
+        is_nonzero_constant(design[:, 1:]).any()
+        or is_nonzero_constant(design_case[:, 1:]).any()
+        or len(control) <= design.shape[1] + 1
+    )
+
+    genes = list(dict.fromkeys(gene for edge in edges for gene in edge))
+    gene_index = {gene: i for i, gene in enumerate(genes)}
+    expr_control = control[genes].to_numpy(dtype=np.float64)
+    expr_case = case[genes].to_numpy(dtype=np.float64)
+    for values in (design, design_case, expr_control, expr_case):
+        # statsmodels refuses to fit these as well
+        if not np.isfinite(values).all():
+            raise ValueError("Expression data or covariates contain inf or nans")
+
+    blocks = []
+    for start in range(0, len(edges), BLOCK_SIZE):
+        block = edges[start : start + BLOCK_SIZE]
+        sources = [gene_index[source] for source, _ in block]
+        targets = [gene_index[target] for _, target in block]
+
+        x, y = expr_control[:, sources], expr_control[:, targets]
+        x_case, y_case = expr_case[:, sources], expr_case[:, targets]
+
+        # residuals of source and target on the shared design
+        x_resid = x - design @ (design_pinv @ x)
+        y_resid = y - design @ (design_pinv @ y)
+        ss = np.einsum("ij,ij->j", x_resid, x_resid)
+        degenerate = (
+            fallback
+            | is_nonzero_constant(x)
+            | is_nonzero_constant(x_case)
+            | (ss <= 1e-10 * np.einsum("ij,ij->j", x, x))
+        )
+        ss[degenerate] = 1
+
+        coef = np.einsum("ij,ij->j", x_resid, y_resid) / ss
+        gamma = design_pinv @ (y - x * coef)
+        resid_control = y_resid - x_resid * coef
+        ssr = np.einsum("ij,ij->j", resid_control, resid_control)
+        tss = np.einsum("ij,ij->j", y - y.mean(axis=0), y - y.mean(axis=0))
+        # (almost) perfect fits, their residuals are rounding errors
+        degenerate |= ssr <= 1e-12 * (tss + np.einsum("ij,ij->j", y, y))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r2 = 1 - ssr / tss
+
+        # DysRegNet residuals are prediction - observation
+        resid_control = -resid_control
+        resid_case = design_case @ gamma + x_case * coef - y_case
+
+        mean = resid_control.mean(axis=0)
+        std = resid_control.std(axis=0, ddof=1)
+        for i in np.flatnonzero(degenerate):
+            r2[i], coef[i], resid_case[:, i], resid = fit_edge(
+                control, case, covariates, block[i]
+            )
+            resid_control[:, i] = resid
+            mean[i], std[i] = resid.mean(), resid.std()
+
+        normal = (
+            stats.normaltest(resid_control, axis=0)[1]
+            if data.normaltest
+            else np.full(len(block), np.nan)
+        )
+        # float32 with DYSREGNET_FLOAT32, the scores are rounded to 0.1 anyway
+        blocks.append((r2, coef, resid_case.astype(FLOAT_DTYPE), mean, std, normal))
+        if progress is not None:
+            progress.update(len(block))
+
+    if not blocks:
+        empty = np.zeros(0)
+        blocks.append((empty, empty, np.zeros((len(case), 0)), empty, empty, empty))
+
+    r2, coef, resid_case, mean, std, normal = (
+        np.concatenate(arrays, axis=-1) for arrays in zip(*blocks)
+    )
+    return EdgeModels(edges, case.index, r2, coef, resid_case, mean, std, normal)
+
+
+def get_thresholds(data: SimpleNamespace) -> Dict[str, Any]:
+    """
+    Returns the arguments of EdgeModels.score of a prepared run.
+    """
+    return {
+        "bonferroni_alpha": data.bonferroni_alpha,
+        "R2_threshold": data.R2_threshold,
+        "normaltest": data.normaltest,
+        "normaltest_alpha": data.normaltest_alpha,
+        "direction_condition": data.direction_condition,
+    }
+
+
+def fit_run(data: SimpleNamespace) -> EdgeModels:
+    """
+    Fits the models of all GRN edges of a prepared run with the native engine.
+    """
+    edges = get_edges(data.GRN)
+    with edge_progress() as progress:
+        models = fit_edges(data, edges, progress)
+        progress.update(len(data.GRN) - len(edges))
+    return models
+
+
+def run_native(data: SimpleNamespace) -> DysregulationMatrix:
+    """
+    Fits and scores the GRN edges of a prepared run with the native engine,
+    the results equal the ones of dysregnet.run.
+    """
+    return fit_run(data).to_results(**get_thresholds(data))
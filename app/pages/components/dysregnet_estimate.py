@@ -0,0 +1,298 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Union
+
+import numpy as np
+from scipy import optimize
+
+from pages.components.dysregnet_cache import cache
+from pages.components.dysregnet_engine import ENGINE
+
+# Recorded runs per engine, the estimates are calibrated with the latest ones
+BENCHMARKS_KEY_PREFIX = "DysRegNet:benchmarks:"
+MAX_BENCHMARKS = 200
+# Recorded runs needed before they replace the default coefficients
+MIN_BENCHMARKS = 5
+# Runs smaller than this fraction of the median run weigh as much as one of
+# this size in the calibration, so tiny measurements do not dominate it
+MIN_RELATIVE_WEIGHT = 0.1
+
+# Runs which are estimated to take longer are refused, runs which are estimated
+# to need more memory are fitted in edge chunks (0 disables the limits)
+MAX_RUN_SECONDS = int(os.getenv("DYSREGNET_MAX_RUN_SECONDS", "0"))
+MAX_RUN_MEMORY = int(os.getenv("DYSREGNET_MAX_RUN_MEMORY", "0"))
+
+# Runs measured at the moment in this process (e.g. by a Celery threads pool),
+# see measure_run
+running_measurements: List[Dict[str, bool]] = []
+running_measurements_lock = threading.Lock()
+
+# Coefficients of the default estimates per engine, measured on a single core:
+# seconds of [run, edge, edge x sample x (covariates + 1)] and
+# bytes of [run, sample x gene, sample x edge], the memory of a run includes
+# the one of the worker process with the loaded libraries
+DEFAULT_SECONDS = {
+    "dysregnet": [0.5, 9.5e-3, 1e-9],
+    "native": [0.1, 2.5e-4, 1.7e-8],
+}
+DEFAULT_MEMORY = {
+    "dysregnet": [2e8, 32, 16],
+    "native": [2e8, 32, 48],
+}
+
+
+def get_time_features(
+    samples: int, genes: int, edges: int, covariates: int
+) -> List[float]:
+    return [1, edges, edges * samples * (covariates + 1)]
+
+
+def get_memory_features(
+    samples: int, genes: int, edges: int, covariates: int
+) -> List[float]:
+    return [1, samples * genes, samples * edges]
+
+
+def get_benchmarks(engine: str = None) -> List[Dict[str, Any]]:
+    """
+    Function to get the recorded runs of an engine, latest first.
+    """
+    key = BENCHMARKS_KEY_PREFIX + (engine or ENGINE)
+    return [json.loads(run) for run in cache.lrange(key, 0, -1)]
+
+
+def record_run(
+    samples: int,
+    genes: int,
+    edges: int,
+    covariates: int,
+    seconds: float,
+    memory: Union[int, None],
+):
+    """
+    Function to record the size, duration and peak memory of a finished run
+    for the calibration of the estimates.
+    """
+    key = BENCHMARKS_KEY_PREFIX + ENGINE
+    run = {
+        "samples": samples,
+        "genes": genes,
+        "edges": edges,
+        "covariates": covariates,
+        "seconds": seconds,
+        "memory": memory,
+    }
+    pipe = cache.pipeline(transaction=False)
+    pipe.lpush(key, json.dumps(run))
+    pipe.ltrim(key, 0, MAX_BENCHMARKS - 1)
+    pipe.execute()
+
+
+def fit_coefficients(features: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Fits non-negative coefficients of the features by least squares, relative
+    to the values, so small runs weigh as much as large ones. Values below
+    MIN_RELATIVE_WEIGHT times the median are weighted as if they were that
+    large.
+    """
+    floor = MIN_RELATIVE_WEIGHT * np.median(values)
+    weights = 1 / np.maximum(values, floor)
+    scaled = features * weights[:, None]
+    norms = np.linalg.norm(scaled, axis=0)
+    norms[norms == 0] = 1
+    coefficients, _ = optimize.nnls(scaled / norms, values * weights)
+    return coefficients / norms
+
+
+def get_coefficients() -> Dict[str, np.ndarray]:
+    """
+    Function to get the coefficients of the estimates of the engine, calibrated
+    with its recorded runs if there are enough of them.
+    """
+    coefficients = {
+        "seconds": np.array(DEFAULT_SECONDS[ENGINE], dtype=float),
+        "memory": np.array(DEFAULT_MEMORY[ENGINE], dtype=float),
+    }
+    runs = get_benchmarks()
+    for name, get_features in (
+        ("seconds", get_time_features),
+        ("memory", get_memory_features),
+    ):
+        # runs without a measurement, or with a broken one, are not used
+        measured = [run for run in runs if run[name] is not None and run[name] > 0]
+        if len(measured) < MIN_BENCHMARKS:
+            continue
+        features = np.array(
+            [
+                get_features(
+                    run["samples"], run["genes"], run["edges"], run["covariates"]
+                )
+                for run in measured
+            ],
+            dtype=float,
+        )
+        values = np.array([run[name] for run in measured], dtype=float)
+        coefficients[name] = fit_coefficients(features, values)
+    return coefficients
+
+
+def estimate_run(
+    samples: int, genes: int, edges: int, covariates: int
+) -> Dict[str, float]:
+    """
+    Function to estimate the wall time and the peak memory of a sequential run.
+
+    Args:
+        samples (int): the samples of the expression data
+        genes (int): the genes of the expression data
+        edges (int): the edges of the network
+        covariates (int): the categorical and continuous covariates
+
+    Returns:
+        Dict[str, float]: {"seconds": ..., "memory": ..., "edge_memory": ...}
+        the wall time, the peak memory in bytes and its part which scales with
+        the edges fitted at once
+    """
+    coefficients = get_coefficients()
+    memory = coefficients["memory"] * get_memory_features(
+        samples, genes, edges, covariates
+    )
+    return {
+        "seconds": float(
+            coefficients["seconds"]
+            @ get_time_features(samples, genes, edges, covariates)
+        ),
+        "memory": float(memory.sum()),
+        "edge_memory": float(memory[2]),
+    }
+
+
+def check_limits(estimate: Dict[str, float]) -> int:
+    """
+    Function to check an estimate against the limits of this server.
+
+    Raises:
+        ValueError: if the run exceeds the limits
+
+    Returns:
+        int: the number of edge chunks the run is fitted in to fit into the
+        memory limit, 1 if it fits as a whole
+    """
+    if MAX_RUN_SECONDS and estimate["seconds"] > MAX_RUN_SECONDS:
+        raise ValueError(
+            f"The run is estimated to take {format_duration(estimate['seconds'])},"
+            f" the limit is {format_duration(MAX_RUN_SECONDS)}. Please use fewer"
+            " samples or a smaller network"
+        )
+    if not MAX_RUN_MEMORY or estimate["memory"] <= MAX_RUN_MEMORY:
+        return 1
+
+    available = MAX_RUN_MEMORY - (estimate["memory"] - estimate["edge_memory"])
+    if available <= 0:
+        raise ValueError(
+            f"The run is estimated to need {format_bytes(estimate['memory'])} of"
+            f" memory, the limit is {format_bytes(MAX_RUN_MEMORY)}. Please use"
+            " fewer samples or genes"
+        )
+    return math.ceil(estimate["edge_memory"] / available)
+
+
+def get_rss() -> Union[int, None]:
+    """
+    Returns the resident memory of this process in bytes (Linux only).
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def get_max_rss() -> Union[int, None]:
+    """
+    Returns the peak resident memory of this process so far in bytes.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+@contextmanager
+def measure_run() -> Iterator[Dict[str, Any]]:
+    """
+    Measures the wall time and the peak resident memory of the process during a
+    block. The peak is sampled by a background thread, and is the exact one if
+    the block raised the peak of the process (which a warm worker process that
+    ran larger runs before does not). The memory is process wide, so it is not
+    measured for blocks which overlap with another measured block.
+
+    Yields:
+        Dict[str, Any]: {"seconds": ..., "memory": ...} which are set when the
+        block is finished, memory is None if it can not be measured here
+    """
+    measurement = {"seconds": None, "memory": None}
+    running = {"overlapped": False}
+    with running_measurements_lock:
+        running_measurements.append(running)
+        if len(running_measurements) > 1:
+            for other in running_measurements:
+                other["overlapped"] = True
+    start_rss = get_rss()
+    start_max_rss = get_max_rss()
+    peak = [start_rss]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(0.05):
+            peak[0] = max(peak[0], get_rss() or 0)
+
+    if start_rss is not None:
+        thread = threading.Thread(target=sample, daemon=True)
+        thread.start()
+    start = time.time()
+    try:
+        yield measurement
+    finally:
+        measurement["seconds"] = time.time() - start
+        if start_rss is not None:
+            stop.set()
+            thread.join()
+            peak[0] = max(peak[0], get_rss() or 0)
+        max_rss = get_max_rss()
+        if (
+            max_rss is not None
+            and start_max_rss is not None
+            and max_rss > start_max_rss
+        ):
+            peak[0] = max(peak[0] or 0, max_rss)
+        with running_measurements_lock:
+            running_measurements.remove(running)
+        if not running["overlapped"]:
+            measurement["memory"] = peak[0] or None
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return "less than a minute"
+    if seconds < 90:
+        return "about a minute"
+    if seconds < 90 * 60:
+        return f"about {round(seconds / 60)} minutes"
+    return f"about {seconds / 3600:.1f} hours"
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1000:
+            return f"{size:.0f} {unit}"
+        size /= 1000
+    return f"{size:.1f} TB"
@@ -0,0 +1,307 @@
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from dysregnet import functions
+from scipy import sparse
+
+from pages.components.dysregnet_dataset import get_run_network
+from pages.components.dysregnet_engine import ENGINE, run_native
+from pages.components.dysregnet_progress import edge_progress, redirect_progress
+from pages.components.dysregnet_results import DysregulationMatrix
+
+# Processes of a DysRegNet run, 1 runs it in the calling process (default),
+# 0 uses all cores. Daemonic processes (e.g. Celery prefork workers) can not
+# start a process pool, there runs are sequential as well.
+DYSREGNET_PROCESSES = int(os.getenv("DYSREGNET_PROCESSES", "1"))
+# Edge chunks per process, more chunks balance the load and report progress more often
+CHUNKS_PER_PROCESS = 4
+
+# Data of a worker process, set by init_worker
+worker_data = None
+# Whether the warning about DYSREGNET_PROCESSES in a daemonic process was printed
+warned_daemon = False
+
+
+def get_processes() -> int:
+    """
+    Returns the number of processes a DysRegNet run can use here.
+    """
+    global warned_daemon
+
+    if multiprocessing.current_process().daemon:
+        if DYSREGNET_PROCESSES != 1 and not warned_daemon:
+            print(
+                f"DYSREGNET_PROCESSES={DYSREGNET_PROCESSES} is ignored in daemonic"
+                " processes (e.g. the Celery prefork pool), runs are sequential."
+                " Start the Celery worker with --pool=threads to use it."
+            )
+            warned_daemon = True
+        return 1
+    if DYSREGNET_PROCESSES == 0:
+        return os.cpu_count() or 1
+    return DYSREGNET_PROCESSES
+
+
+def prepare_run(
+    expression_data: pd.DataFrame,
+    GRN: pd.DataFrame,
+    meta: pd.DataFrame,
+    conCol: str,
+    CatCov: List[str],
+    ConCov: List[str],
+    zscoring: bool,
+    bonferroni_alpha: float,
+    R2_threshold: Union[float, None],
+    normaltest: bool,
+    normaltest_alpha: float,
+    direction_condition: bool,
+) -> SimpleNamespace:
+    """
+    Checks and preprocesses the inputs exactly like dysregnet.run, but does not
+    fit the models. Arguments are the ones of dysregnet.run.
+
+    Returns:
+        SimpleNamespace: the attributes dysregnet.functions.dyregnet_model reads
+    """
+    data = SimpleNamespace(
+        conCol=conCol,
+        CatCov=CatCov,
+        ConCov=ConCov,
+        zscoring=zscoring,
+        bonferroni_alpha=bonferroni_alpha,
+        R2_threshold=R2_threshold,
+        normaltest=normaltest,
+        normaltest_alpha=normaltest_alpha,
+        direction_condition=direction_condition,
+    )
+
+    meta = meta.set_index(meta.columns[0])
+    expression_data = expression_data.set_index(expression_data.columns[0])
+    # single precision expression data (DYSREGNET_FLOAT32) is fitted in double precision
+    expression_data = expression_data.astype(
+        {
+            column: np.float64
+            for column in expression_data.select_dtypes(include=np.float32).columns
+        }
+    )
+
+    samples = [s for s in list(meta.index) if s in list(expression_data.index)]
+    if not samples:
+        raise ValueError(
+            "Sample columns are not found or the ids don't match. Please make sure that the first column in 'expression_data' and 'meta' are both sample ids."
+        )
+    data.meta = meta.loc[samples]
+    data.expression_data = expression_data.loc[samples]
+
+    if conCol not in data.meta.columns:
+        raise ValueError(
+            " Invalid conCol value. Could not find the column '%s' in meta DataFrame"
+            % conCol
+        )
+    if set(data.meta[conCol].unique()) != {0, 1}:
+        raise ValueError(
+            " Invalid values in '%s' column in meta DataFrame. Please make sure to have condition column in the meta DataFrame with 0 as control and 1 as the condition (int)."
+            % conCol
+        )
+
+    GRN_genes = list(
+        set(GRN.iloc[:, 0].values.tolist() + GRN.iloc[:, 1].values.tolist())
+    )
+    GRN_genes = [g for g in GRN_genes if g in expression_data.columns]
+    if not GRN_genes:
+        raise ValueError(
+            "Gene id or name in GRN DataFrame do not match the ones in expression_data DataFrame"
+        )
+
+    data.expression_data = data.expression_data[GRN_genes]
+    data.GRN = get_run_network(GRN, GRN_genes)
+
+    data.cov_df, data.expr, data.control, data.case = functions.process_data(data)
+    return data
+
+
+def share_frame(
+    frame: pd.DataFrame,
+) -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    """
+    Copies the values of a numeric DataFrame into shared memory.
+
+    Returns:
+        Tuple[SharedMemory, Dict[str, Any]]: the shared memory block and the
+        description workers attach to it with attach_frame
+    """
+    values = frame.to_numpy(dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+    return shm, {
+        "name": shm.name,
+        "shape": values.shape,
+        "index": list(frame.index),
+        "columns": list(frame.columns),
+    }
+
+
+def attach_frame(
+    description: Dict[str, Any],
+) -> Tuple[shared_memory.SharedMemory, pd.DataFrame]:
+    shm = shared_memory.SharedMemory(name=description["name"])
+    values = np.ndarray(description["shape"], dtype=np.float64, buffer=shm.buf)
+    return shm, pd.DataFrame(
+        values, index=description["index"], columns=description["columns"], copy=False
+    )
+
+
+def init_worker(data: SimpleNamespace, expr: Dict[str, Any], cov: Dict[str, Any]):
+    """
+    Attaches a worker process to the shared expression and covariate matrices.
+    """
+    global worker_data
+
+    shm_expr, data.expr = attach_frame(expr)
+    shm_cov, data.cov_df = attach_frame(cov) if cov is not None else (None, None)
+    # keep the shared memory blocks open as long as the worker lives
+    data.shared_memory = [shm_expr, shm_cov]
+    worker_data = data
+
+
+def fit_chunk(data: SimpleNamespace, start: int, stop: int) -> DysregulationMatrix:
+    """
+    Fits and scores the GRN edges start to stop of a prepared run.
+    """
+    chunk = SimpleNamespace(**vars(data))
+    chunk.GRN = data.GRN.iloc[start:stop]
+
+    # the progress of the chunks is reported by the caller
+    with redirect_progress(io.StringIO()):
+        if ENGINE == "native":
+            return run_native(chunk)
+        results, _ = functions.dyregnet_model(chunk)
+
+    return DysregulationMatrix(
+        sparse.csc_matrix(results.to_numpy(dtype=np.float32)),
+        results.index,
+        get_edge_index(list(results.columns)),
+    )
+
+
+def get_edge_index(edges: List[Tuple[str, str]]) -> pd.MultiIndex:
+    return (
+        pd.MultiIndex.from_tuples(edges)
+        if edges
+        else pd.MultiIndex.from_arrays([[], []])
+    )
+
+
+def get_chunks(n_edges: int, n_chunks: int) -> List[Tuple[int, int]]:
+    """
+    Splits the edges into at most n_chunks consecutive (start, stop) ranges.
+    """
+    bounds = np.linspace(0, n_edges, min(n_chunks, max(n_edges, 1)) + 1, dtype=int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def merge_chunks(chunks: List[DysregulationMatrix]) -> DysregulationMatrix:
+    """
+    Joins the results of consecutive edge chunks in their order.
+    """
+    return DysregulationMatrix(
+        sparse.hstack([chunk.matrix for chunk in chunks], format="csc"),
+        pd.Index(chunks[0].index, name="patient id"),
+        get_edge_index([edge for chunk in chunks for edge in chunk.columns]),
+    )
+
+
+def run_chunk(start: int, stop: int) -> DysregulationMatrix:
+    """
+    Fits and scores the GRN edges start to stop in a worker process.
+    """
+    return fit_chunk(worker_data, start, stop)
+
+
+def run_chunked(
+    chunks: int,
+    on_chunk: Callable[[int, DysregulationMatrix, int], Any] = None,
+    **kwargs,
+) -> DysregulationMatrix:
+    """
+    Runs DysRegNet with the GRN edges split into chunks, which are fitted one
+    after the other, so only the models of one chunk are in memory at once.
+
+    Args:
+        chunks (int): the number of edge chunks
+        on_chunk (Callable[[int, DysregulationMatrix, int], Any]): called with the
+        position, the results and the number of GRN edges of every finished chunk
+        **kwargs: the arguments of dysregnet.run
+
+    Returns:
+        DysregulationMatrix: The sparse DysRegNet results.
+    """
+    data = prepare_run(**kwargs)
+
+    results = []
+    with edge_progress() as progress:
+        for i, (start, stop) in enumerate(get_chunks(len(data.GRN), chunks)):
+            results.append(fit_chunk(data, start, stop))
+            if on_chunk is not None:
+                on_chunk(i, results[-1], stop - start)
+            progress.update(stop - start)
+
+    return merge_chunks(results)
+
+
+def run_parallel(
+    processes: int,
+    on_chunk: Callable[[int, DysregulationMatrix, int], Any] = None,
+    **kwargs,
+) -> DysregulationMatrix:
+    """
+    Runs DysRegNet with the GRN edges split into chunks, which are fitted in a
+    pool of processes. Expression and covariates are preprocessed once and
+    shared with the workers through shared memory. The chunk results are merged
+    in GRN order, so they equal the results of dysregnet.run.
+
+    Args:
+        processes (int): the number of worker processes
+        on_chunk (Callable[[int, DysregulationMatrix, int], Any]): called with the
+        position, the results and the number of GRN edges of every finished chunk
+        **kwargs: the arguments of dysregnet.run
+
+    Returns:
+        DysregulationMatrix: The sparse DysRegNet results.
+    """
+    data = prepare_run(**kwargs)
+    chunks = get_chunks(len(data.GRN), processes * CHUNKS_PER_PROCESS)
+
+    shm_expr, expr = share_frame(data.expr)
+    shm_cov, cov = share_frame(data.cov_df) if data.cov_df is not None else (None, None)
+    # workers get the shared matrices, the rest is small
+    worker = SimpleNamespace(**vars(data))
+    del worker.expr, worker.cov_df, worker.expression_data, worker.meta
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=init_worker, initargs=(worker, expr, cov)
+        ) as pool:
+            futures = [pool.submit(run_chunk, start, stop) for start, stop in chunks]
+
+            results = []
+            with edge_progress() as progress:
+                for i, ((start, stop), future) in enumerate(zip(chunks, futures)):
+                    results.append(future.result())
+                    if on_chunk is not None:
+                        on_chunk(i, results[-1], stop - start)
+                    progress.update(stop - start)
+    finally:
+        for shm in (shm_expr, shm_cov):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    return merge_chunks(results)
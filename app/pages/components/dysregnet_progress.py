@@ -1,31 +1,164 @@
 import io
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, TextIO, Union
+
+from tqdm import tqdm
+
+# Progress events are sent at most this often (seconds), every event of a
+# background callback is a round trip through the Celery result backend
+MIN_INTERVAL = 0.5
+# Edge counter of the tqdm progress bars of the runs, e.g. "\r123it [00:01, 98.20it/s]"
+TQDM_COUNT = re.compile(r"(?:^|\r)\s*(\d+)it\b")
+
+# Progress target of the run of every thread, see redirect_progress
+progress_targets = threading.local()
+stderr_lock = threading.Lock()
+
+
+class ThreadStderr:
+    """
+    Stands in for sys.stderr and passes what a thread writes to the progress
+    target of the thread, or to the original stderr if it has none.
+    """
+
+    def __init__(self, stderr: TextIO):
+        self.stderr = stderr
+
+    def get_target(self) -> TextIO:
+        return getattr(progress_targets, "target", None) or self.stderr
+
+    def write(self, text: str) -> int:
+        return self.get_target().write(text)
+
+    def flush(self):
+        self.get_target().flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stderr, name)
+
+
+@contextmanager
+def redirect_progress(target: TextIO) -> Iterator[TextIO]:
+    """
+    Redirects the stderr output of the calling thread, e.g. the progress bars
+    of dysregnet.run, to target. Unlike contextlib.redirect_stderr, the stderr
+    of other threads is not affected, so concurrent runs of a Celery threads
+    pool keep their progress apart.
+    """
+    with stderr_lock:
+        if not isinstance(sys.stderr, ThreadStderr):
+            sys.stderr = ThreadStderr(sys.stderr)
+    previous = getattr(progress_targets, "target", None)
+    progress_targets.target = target
+    try:
+        yield target
+    finally:
+        progress_targets.target = previous
+
+
+def edge_progress() -> tqdm:
+    """
+    Returns a progress bar of the fitted edges for the runs which do not use
+    the edge loop of dysregnet.run, with the same output, so DysregnetProgress
+    parses all runs alike. It writes to the target of redirect_progress, also
+    when the tqdm monitor thread refreshes it.
+    """
+    return tqdm(file=getattr(progress_targets, "target", None) or sys.stderr)
 
 
 class DysregnetProgress(io.StringIO):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.max = 0
-        self.curr = 0
-        self.set_progress = None
-
-    def set_max(self, max: int):
-        self.max = max
-
-    def write(self, *args, **kwargs):
-        try:
-            self.curr = int(args[0].split("it")[0])
-            self.set_progress(
-                (
-                    str(self.curr),
-                    str(self.max),
-                    f"{self.curr} ({self.curr/self.max*100:.2f}%)",
-                )
-            )
-        except:
-            self.set_progress(
-                (
-                    str(self.curr),
-                    str(self.max),
-                    f"{self.curr} ({self.curr/self.max*100:.2f}%)",
-                )
-            )
+    """
+    Collects the progress of a DysRegNet run from the tqdm output it is set as
+    stderr for, and reports it as events {"stage": ..., "message": ...,
+    "done": ..., "total": ..., "rate": ..., "eta": ...} with the edges done
+    and in total, the edges per second and the estimated seconds left (None
+    until edges are done). Events are throttled to MIN_INTERVAL, changes of
+    the stage are reported at once.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        on_progress: Callable[[Dict[str, Any]], Any],
+        min_interval: float = MIN_INTERVAL,
+    ):
+        super().__init__()
+        self.total = total
+        self.on_progress = on_progress
+        self.min_interval = min_interval
+        self.stage = None
+        self.message = ""
+        self.done = 0
+        self.started = None
+        self.last_event = 0
+
+    def set_stage(self, stage: str, message: str = ""):
+        changed = stage != self.stage
+        self.stage = stage
+        self.message = message
+        self.emit(force=changed)
+
+    def write(self, text: str) -> int:
+        counts = TQDM_COUNT.findall(text)
+        if counts:
+            if self.started is None:
+                self.started = time.time()
+            self.done = int(counts[-1])
+            if self.done >= self.total:
+                self.set_stage("Saving results")
+            elif self.stage != "Fitting edges":
+                self.set_stage("Fitting edges")
+            else:
+                self.emit()
+        return len(text)
+
+    def get_event(self) -> Dict[str, Any]:
+        rate = eta = None
+        if self.started is not None and self.done:
+            rate = self.done / max(time.time() - self.started, 1e-3)
+            eta = max(self.total - self.done, 0) / rate
+        return {
+            "stage": self.stage,
+            "message": self.message,
+            "done": self.done,
+            "total": self.total,
+            "rate": rate,
+            "eta": eta,
+        }
+
+    def emit(self, force: bool = False):
+        now = time.time()
+        if not force and now - self.last_event < self.min_interval:
+            return
+        self.last_event = now
+        self.on_progress(self.get_event())
+
+
+def format_progress(event: Dict[str, Any]) -> str:
+    """
+    Returns a message for the user about the progress of a run.
+    """
+    # dysregnet_estimate imports the engine, which reports its progress here
+    from pages.components.dysregnet_estimate import format_duration
+
+    if event["message"]:
+        return event["message"]
+    if event["stage"] != "Fitting edges" or event["rate"] is None:
+        return f"{event['stage']} ..." if event["stage"] else ""
+    return (
+        f"Fitting edges: {event['done']:,} of {event['total']:,},"
+        f" {event['rate']:,.0f} edges/s, {format_duration(event['eta'])} left"
+    )
+
+
+def format_label(event: Dict[str, Any]) -> Union[str, None]:
+    """
+    Returns the label of the progress bar of a run.
+    """
+    if event["stage"] != "Fitting edges":
+        return event["stage"]
+    return f"{event['done']} ({event['done'] / max(event['total'], 1) * 100:.2f}%)"
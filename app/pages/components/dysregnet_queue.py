@@ -0,0 +1,342 @@
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+from uuid import uuid4
+
+import redis
+
+from pages.components.dysregnet_cache import (
+    cache,
+    get_input_keys,
+    get_run_hash,
+    has_cached_run,
+)
+from pages.components.dysregnet_dataset import DysRegNetDataset
+from pages.components.dysregnet_estimate import estimate_run, format_duration
+
+# Queued job ids by priority, running job ids by start time, the last
+# heartbeat of every job, the job descriptions and the job of every run hash
+QUEUE_KEY = "DysRegNet:queue"
+RUNNING_KEY = "DysRegNet:queue:running"
+HEARTBEAT_KEY = "DysRegNet:queue:heartbeat"
+JOBS_KEY = "DysRegNet:queue:jobs"
+RUNS_KEY = "DysRegNet:queue:runs"
+
+# DysRegNet runs of all users at the same time (0 disables the queue), runs of
+# one user at the same time, and the jobs a user or all users can have queued
+# or running before new runs are refused
+MAX_RUNNING = int(os.getenv("DYSREGNET_MAX_RUNNING", "2"))
+USER_MAX_RUNNING = int(os.getenv("DYSREGNET_USER_MAX_RUNNING", "1"))
+USER_MAX_JOBS = int(os.getenv("DYSREGNET_USER_MAX_JOBS", "3"))
+MAX_JOBS = int(os.getenv("DYSREGNET_MAX_JOBS", "50"))
+# Seconds between two checks of a waiting job
+POLL_INTERVAL = 1
+# Jobs without a heartbeat for this many seconds are dropped, e.g. the ones
+# of cancelled runs whose worker was terminated
+HEARTBEAT_TIMEOUT = 60
+
+
+def get_duration(parameters: Dict[str, Any], dataset: DysRegNetDataset) -> float:
+    """
+    Returns the estimated seconds of a run.
+    """
+    covariates = len(parameters["cat_cov"]) + len(parameters["con_cov"])
+    return estimate_run(
+        dataset.n_samples, dataset.n_genes, dataset.n_run_edges, covariates
+    )["seconds"]
+
+
+def get_jobs(
+    client: Union[redis.Redis, redis.client.Pipeline] = None,
+) -> Dict[str, Dict[str, Any]]:
+    client = cache if client is None else client
+    return {
+        job_id.decode(): json.loads(job)
+        for job_id, job in client.hgetall(JOBS_KEY).items()
+    }
+
+
+def submit(run_hash: str, user: str, seconds: float) -> Tuple[str, bool]:
+    """
+    Function to queue a run. Runs are started by priority, which is the
+    submission time plus the estimated duration, so small runs start before
+    large ones but large runs are not delayed for longer than their duration.
+
+    Args:
+        run_hash (str): hash of the inputs and parameters of the run
+        user (str): the user (browser) who submitted the run
+        seconds (float): the estimated duration of the run
+
+    Raises:
+        RuntimeError: if the user or all users have too many jobs
+
+    Returns:
+        Tuple[str, bool]: the job id and True if it is the job of an identical
+        run which is queued or running already
+    """
+    drop_stale()
+    job_id = uuid4().hex
+    now = time.time()
+    job = {"user": user, "run": run_hash, "seconds": seconds, "submitted": now}
+
+    def queue(pipe: redis.client.Pipeline):
+        duplicate = pipe.hget(RUNS_KEY, run_hash)
+        if duplicate is not None and pipe.hexists(JOBS_KEY, duplicate):
+            return duplicate.decode(), True
+
+        jobs = list(get_jobs(pipe).values())
+        if USER_MAX_JOBS and sum(job["user"] == user for job in jobs) >= USER_MAX_JOBS:
+            raise RuntimeError(
+                f"You have reached the limit of {USER_MAX_JOBS} queued or running "
+                "DysRegNet runs, please wait until one of them is finished"
+            )
+        if MAX_JOBS and len(jobs) >= MAX_JOBS:
+            raise RuntimeError(
+                "Too many DysRegNet runs are queued, please try again later"
+            )
+
+        pipe.multi()
+        pipe.hset(JOBS_KEY, job_id, json.dumps(job))
+        pipe.hset(RUNS_KEY, run_hash, job_id)
+        pipe.zadd(QUEUE_KEY, {job_id: now + seconds})
+        pipe.zadd(HEARTBEAT_KEY, {job_id: now})
+        return job_id, False
+
+    return cache.transaction(
+        queue,
+        JOBS_KEY,
+        RUNS_KEY,
+        value_from_callable=True,
+    )
+
+
+def acquire(job_id: str) -> bool:
+    """
+    Function to start a queued job if a slot is free and it is the first
+    queued job whose user does not run the maximum number of jobs already.
+
+    Returns:
+        bool: True if the job was started
+    """
+    drop_stale()
+
+    def start(pipe: redis.client.Pipeline):
+        running = [job.decode() for job in pipe.zrange(RUNNING_KEY, 0, -1)]
+        if len(running) >= MAX_RUNNING:
+            return False
+
+        jobs = get_jobs(pipe)
+        users = [jobs[job]["user"] for job in running if job in jobs]
+        for queued in pipe.zrange(QUEUE_KEY, 0, -1):
+            queued = queued.decode()
+            if queued not in jobs:
+                continue
+            if (
+                USER_MAX_RUNNING
+                and users.count(jobs[queued]["user"]) >= USER_MAX_RUNNING
+            ):
+                continue
+            if queued != job_id:
+                # the job of another worker is next
+                return False
+
+            pipe.multi()
+            pipe.zrem(QUEUE_KEY, job_id)
+            pipe.zadd(RUNNING_KEY, {job_id: time.time()})
+            return True
+        return False
+
+    return cache.transaction(
+        start, QUEUE_KEY, RUNNING_KEY, JOBS_KEY, value_from_callable=True
+    )
+
+
+def finish(job_ids: List[str]):
+    """
+    Function to remove finished, failed or stale jobs from the queue.
+    """
+    if not job_ids:
+        return
+    jobs = dict(zip(job_ids, cache.hmget(JOBS_KEY, job_ids)))
+    pipe = cache.pipeline(transaction=False)
+    pipe.zrem(QUEUE_KEY, *job_ids)
+    pipe.zrem(RUNNING_KEY, *job_ids)
+    pipe.zrem(HEARTBEAT_KEY, *job_ids)
+    pipe.hdel(JOBS_KEY, *job_ids)
+    pipe.execute()
+
+    for job_id, job in jobs.items():
+        if job is None:
+            continue
+        run_hash = json.loads(job)["run"]
+        # the run hash may point to a newer job already
+        cache.transaction(lambda pipe: release_run(pipe, run_hash, job_id), RUNS_KEY)
+
+
+def release_run(pipe: redis.client.Pipeline, run_hash: str, job_id: str):
+    if pipe.hget(RUNS_KEY, run_hash) == job_id.encode():
+        pipe.multi()
+        pipe.hdel(RUNS_KEY, run_hash)
+
+
+def drop_stale():
+    """
+    Function to remove jobs whose worker stopped sending heartbeats.
+    """
+    stale = cache.zrangebyscore(HEARTBEAT_KEY, "-inf", time.time() - HEARTBEAT_TIMEOUT)
+    finish([job_id.decode() for job_id in stale])
+
+
+def is_active(job_id: str) -> bool:
+    return cache.hexists(JOBS_KEY, job_id)
+
+
+def get_status(job_id: str) -> Dict[str, Any]:
+    """
+    Function to get the queue position of a job and its estimated start. The
+    start assumes the estimated durations of the jobs and that every slot
+    takes the next job in order.
+
+    Returns:
+        Dict[str, Any]: {"position": ..., "queued": ..., "running": ..., "start": ...}
+        with the position of the job in the queue (0 if it is running), the
+        number of queued jobs, whether the job is running and its estimated
+        start in seconds from now
+    """
+    jobs = get_jobs()
+    queued = [job.decode() for job in cache.zrange(QUEUE_KEY, 0, -1)]
+    running = cache.zrange(RUNNING_KEY, 0, -1, withscores=True)
+    now = time.time()
+
+    # seconds until the slots are free
+    slots = [
+        max(jobs[job_id.decode()]["seconds"] - (now - started), 0)
+        for job_id, started in running
+        if job_id.decode() in jobs
+    ]
+    slots += [0] * max(MAX_RUNNING - len(slots), 0)
+    heapq.heapify(slots)
+
+    position = queued.index(job_id) + 1 if job_id in queued else 0
+    for ahead in queued[: max(position - 1, 0)]:
+        if ahead in jobs:
+            heapq.heappush(slots, heapq.heappop(slots) + jobs[ahead]["seconds"])
+
+    return {
+        "position": position,
+        "queued": len(queued),
+        "running": job_id in {job.decode() for job, _ in running},
+        "start": slots[0] if position and slots else 0,
+    }
+
+
+@contextmanager
+def keep_alive(job_id: str) -> Iterator[None]:
+    """
+    Sends heartbeats of a job from a background thread while it waits or runs.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_TIMEOUT / 4):
+            cache.zadd(HEARTBEAT_KEY, {job_id: time.time()}, xx=True)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+@contextmanager
+def queued_run(
+    parameters: Dict[str, Any],
+    dataset: DysRegNetDataset,
+    user: str,
+    on_wait: Callable[[Dict[str, Any]], Any] = None,
+) -> Iterator[None]:
+    """
+    Waits until a DysRegNet run may start and keeps its slot while the block
+    runs. Runs which are answered from the cache are not queued. A run whose
+    identical run is queued or running waits for it and gets its cached results.
+
+    Args:
+        parameters (Dict[str, Any]): the parameters of the run
+        dataset (DysRegNetDataset): the inputs of the run
+        user (str): the user (browser) who submitted the run
+        on_wait (Callable[[Dict[str, Any]], Any]): called with get_status of the
+        waited for job and "duplicate" (True if it is the identical run) while waiting
+    """
+    if not MAX_RUNNING:
+        yield
+        return
+
+    run_hash = get_run_hash(parameters, get_input_keys(dataset))
+    seconds = get_duration(parameters, dataset)
+    while True:
+        if has_cached_run(parameters, dataset):
+            yield
+            return
+
+        job_id, duplicate = submit(run_hash, user, seconds)
+        if not duplicate:
+            break
+        # the identical run caches its results, a failed one is queued again
+        while is_active(job_id):
+            if on_wait is not None:
+                on_wait({**get_status(job_id), "duplicate": True})
+            time.sleep(POLL_INTERVAL)
+
+    with keep_alive(job_id):
+        try:
+            while not acquire(job_id):
+                if not is_active(job_id):
+                    raise RuntimeError("The DysRegNet run was removed from the queue")
+                if on_wait is not None:
+                    on_wait({**get_status(job_id), "duplicate": False})
+                time.sleep(POLL_INTERVAL)
+
+            yield
+        finally:
+            finish([job_id])
+
+
+def get_queue() -> List[Dict[str, Any]]:
+    """
+    Function to list the queued and running jobs in order.
+    """
+    jobs = get_jobs()
+    running = cache.zrange(RUNNING_KEY, 0, -1, withscores=True)
+    queued = cache.zrange(QUEUE_KEY, 0, -1)
+    return [
+        {"job_id": job_id.decode(), "started": started, **jobs[job_id.decode()]}
+        for job_id, started in running
+        if job_id.decode() in jobs
+    ] + [
+        {"job_id": job_id.decode(), "started": None, **jobs[job_id.decode()]}
+        for job_id in queued
+        if job_id.decode() in jobs
+    ]
+
+
+def format_wait(status: Dict[str, Any]) -> str:
+    """
+    Returns a message for the user about a waiting run.
+    """
+    if status["duplicate"]:
+        message = "An identical DysRegNet run is already "
+        if status["running"]:
+            return message + "running, its results will be shown when it is finished."
+        message += f"queued at position {status['position']} of {status['queued']}."
+    else:
+        message = (
+            f"Your run is queued at position {status['position']} of "
+            f"{status['queued']}."
+        )
+    return message + f" Estimated start in {format_duration(status['start'])}."
@@ -1,23 +1,150 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 
-def get_sources(results: pd.DataFrame, ids: List[str]):
-    return results[[t for t in results.columns if t[0] in ids]]
+class DysregulationMatrix:
+    """
+    Sparse DysRegNet results, patients as rows and (source, target) edges as columns.
 
+    Only significant dysregulations are non-zero, so the values are kept as a
+    float32 CSC matrix. Column (edge) selections and per-edge statistics then
+    scale with the number of dysregulations instead of patients x edges.
+    """
 
-def get_targets(results: pd.DataFrame, ids: List[str]):
-    return results[[t for t in results.columns if t[1] in ids]]
+    def __init__(
+        self, matrix: sparse.spmatrix, index: pd.Index, columns: pd.MultiIndex
+    ):
+        self.matrix = sparse.csc_matrix(matrix, dtype=np.float32)
+        self.matrix.eliminate_zeros()
+        self.index = index
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, results: pd.DataFrame) -> "DysregulationMatrix":
+        return cls(
+            sparse.csc_matrix(results.to_numpy(dtype=np.float32)),
+            results.index,
+            pd.MultiIndex.from_tuples(list(results.columns)),
+        )
+
+    @classmethod
+    def from_coo(
+        cls,
+        data: np.ndarray,
+        row: np.ndarray,
+        col: np.ndarray,
+        index: Sequence[str],
+        sources: Sequence[str],
+        targets: Sequence[str],
+    ) -> "DysregulationMatrix":
+        return cls(
+            sparse.coo_matrix((data, (row, col)), shape=(len(index), len(sources))),
+            pd.Index(index, name="patient id"),
+            pd.MultiIndex.from_arrays([sources, targets]),
+        )
+
+    def to_coo(self) -> sparse.coo_matrix:
+        return self.matrix.tocoo()
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            self.matrix.toarray(), index=self.index, columns=self.columns
+        )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def nnz(self) -> int:
+        return self.matrix.nnz
+
+    def select(self, mask: Union[np.ndarray, Sequence[bool]]) -> "DysregulationMatrix":
+        """
+        Returns the edges (columns) selected by a boolean mask.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        return DysregulationMatrix(
+            self.matrix[:, np.flatnonzero(mask)], self.index, self.columns[mask]
+        )
+
+    def get_fractions(self) -> np.ndarray:
+        """
+        Returns the fraction of dysregulated patients per edge.
+        """
+        return np.diff(self.matrix.indptr) / max(len(self.index), 1)
+
+    def get_sums(self) -> np.ndarray:
+        """
+        Returns the sum of dysregulations per edge, its sign is the sign of the mean.
+        """
+        return np.asarray(self.matrix.sum(axis=0)).ravel()
+
+    def get_patient(self, patient_id: str) -> List[Tuple[Tuple[str, str], float]]:
+        """
+        Returns the dysregulated edges of one patient with their values.
+        """
+        rows = np.flatnonzero(self.index == patient_id)
+        if len(rows) == 0:
+            return []
+        patient = self.matrix[rows[0], :].tocoo()
+        return [
+            (self.columns[col], float(value))
+            for col, value in zip(patient.col, patient.data)
+        ]
+
+    def get_triplets(self) -> List[Tuple[Tuple[str, str], str, float]]:
+        """
+        Returns all dysregulations as (edge, patient id, value).
+        """
+        coo = self.to_coo()
+        return [
+            (self.columns[col], self.index[row], float(value))
+            for row, col, value in zip(coo.row, coo.col, coo.data)
+        ]
+
+
+def get_genes(results: Union[DysregulationMatrix, pd.DataFrame]) -> List[str]:
+    """
+    Returns the unique genes of all result edges in order of appearance.
+    """
+    # sources and targets interleaved, in the order of the edges
+    genes = np.column_stack(
+        [results.columns.get_level_values(0), results.columns.get_level_values(1)]
+    ).ravel()
+    return list(pd.unique(genes))
+
+
+def get_summary(results: DysregulationMatrix) -> Dict[str, Any]:
+    """
+    Returns the summary stats of a DysRegNet run, which are cached next to the
+    results so the result page can be set up without loading the results.
+    """
+    return {
+        "patients": [str(patient) for patient in results.index],
+        "genes": get_genes(results),
+        "edges": len(results.columns),
+        "dysregulations": int(results.nnz),
+    }
+
+
+def get_sources(results: DysregulationMatrix, ids: List[str]):
+    return results.select(results.columns.get_level_values(0).isin(ids))
+
+
+def get_targets(results: DysregulationMatrix, ids: List[str]):
+    return results.select(results.columns.get_level_values(1).isin(ids))
 
 
 def get_graph_data(
-    sources: pd.DataFrame,
-    targets: pd.DataFrame,
+    sources: DysregulationMatrix,
+    targets: DysregulationMatrix,
     ids: List[str],
     patient_data: List[List[str]],
 ):
-    targets = targets[targets.columns.difference(sources.columns)]
+    targets = targets.select(~targets.columns.isin(sources.columns))
 
     source_regulations = [
         [
@@ -26,14 +153,13 @@ def get_graph_data(
                     "source": col[0],
                     "target": col[1],
                     "regulation_id": f"{col[0]}:{col[1]}",
-                    "fraction": float((sources[[col]] != 0).sum() / len(sources)),
-                    "weight": float((sources[[col]] != 0).sum() / len(sources)) * 10
-                    + 2,
+                    "fraction": float(fraction),
+                    "weight": float(fraction) * 10 + 2,
                     "classes": (
-                        "r" if sources[col].mean() < 0 else "a"
+                        "r" if total < 0 else "a"
                     ),  # TODO: check if this is correct
                 },
-                "classes": "r" if sources[col].mean() < 0 else "a",
+                "classes": "r" if total < 0 else "a",
             },
             {
                 "data": {
@@ -45,7 +171,9 @@ def get_graph_data(
                 "classes": "t",
             },
         ]
-        for col in sources
+        for col, fraction, total in zip(
+            sources.columns, sources.get_fractions(), sources.get_sums()
+        )
     ]
 
     target_regulations = [
@@ -55,12 +183,11 @@ def get_graph_data(
                     "source": col[0],
                     "target": col[1],
                     "regulation_id": f"{col[0]}:{col[1]}",
-                    "fraction": float((targets[[col]] != 0).sum() / len(targets)),
-                    "weight": float((targets[[col]] != 0).sum() / len(targets)) * 10
-                    + 2,
-                    "classes": "r" if targets[col].mean() < 0 else "a",
+                    "fraction": float(fraction),
+                    "weight": float(fraction) * 10 + 2,
+                    "classes": "r" if total < 0 else "a",
                 },
-                "classes": "r" if targets[col].mean() < 0 else "a",
+                "classes": "r" if total < 0 else "a",
             },
             {
                 "data": {
@@ -72,7 +199,9 @@ def get_graph_data(
                 "classes": "s",
             },
         ]
-        for col in targets
+        for col, fraction, total in zip(
+            targets.columns, targets.get_fractions(), targets.get_sums()
+        )
     ]
     return {
         "center": [
@@ -98,7 +227,9 @@ def get_graph_data(
     }
 
 
-def get_num_regulation(sources: pd.DataFrame, targets: pd.DataFrame) -> Dict[str, int]:
+def get_num_regulation(
+    sources: DysregulationMatrix, targets: DysregulationMatrix
+) -> Dict[str, int]:
     return {
         "total_targets": len(targets.columns),
         "total_sources": len(sources.columns),
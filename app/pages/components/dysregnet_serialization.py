@@ -0,0 +1,342 @@
+import io
+import json
+from typing import Any, Dict, List, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from pages.components.dysregnet_engine import EdgeModels
+from pages.components.dysregnet_results import DysregulationMatrix
+
+# Binary entries start with the magic bytes followed by one version byte.
+# Version 1 are the original JSON text entries {"results": ..., "parameters": ...}
+# with results as dict of dicts and "source,target" column names.
+# Version 2 stores the results on their own as a sparse float32 matrix in
+# coordinate format.
+FORMAT_MAGIC = b"DRN"
+FORMAT_VERSION = 2
+
+# Results are also stored split into one partition per source and per target gene.
+PARTITION_MAGIC = b"DRP"
+PARTITION_VERSION = 1
+
+# Input tables (expression, meta, network) are stored column-wise
+TABLE_MAGIC = b"DRT"
+TABLE_VERSION = 1
+
+# Fitted edge models of the native engine
+MODELS_MAGIC = b"DRF"
+MODELS_VERSION = 1
+
+
+def dump_results(results: Union[DysregulationMatrix, pd.DataFrame]) -> bytes:
+    """
+    Serializes DysRegNet results into a compressed binary blob.
+
+    Only the non-zero results are stored as float32 values with their int32 row
+    (patient) and column (edge) positions, next to the patient, source and
+    target index arrays.
+
+    Args:
+        results (Union[DysregulationMatrix, pd.DataFrame]): DysRegNet results.
+
+    Returns:
+        bytes: The versioned binary blob.
+    """
+    if isinstance(results, pd.DataFrame):
+        results = DysregulationMatrix.from_frame(results)
+
+    coo = results.to_coo()
+    buffer = io.BytesIO()
+    buffer.write(FORMAT_MAGIC + bytes([FORMAT_VERSION]))
+    np.savez_compressed(
+        buffer,
+        data=coo.data.astype(np.float32),
+        row=coo.row.astype(np.int32),
+        col=coo.col.astype(np.int32),
+        patients=np.array(results.index.astype(str), dtype=str),
+        sources=np.array(results.columns.get_level_values(0), dtype=str),
+        targets=np.array(results.columns.get_level_values(1), dtype=str),
+    )
+    return buffer.getvalue()
+
+
+def load_results(blob: bytes) -> DysregulationMatrix:
+    """
+    Deserializes DysRegNet results of any known format version.
+    """
+    return load_session(blob)["results"]
+
+
+def load_session(blob: bytes) -> Dict[str, Any]:
+    """
+    Deserializes a cached session of any known format version.
+
+    Args:
+        blob (bytes): The cached session.
+
+    Returns:
+        Dict[str, Any]: {"results": DysregulationMatrix, "parameters": Dict[str, Any]}
+        with empty parameters for results stored on their own
+    """
+    if blob[: len(FORMAT_MAGIC)] != FORMAT_MAGIC:
+        # version 1, JSON text
+        data = json.loads(blob)
+        results = pd.DataFrame(data["results"])
+        results.columns = pd.MultiIndex.from_tuples(
+            [tuple(c.split(",")) for c in results.columns]
+        )
+        return {
+            "results": DysregulationMatrix.from_frame(results),
+            "parameters": data["parameters"],
+        }
+
+    version = blob[len(FORMAT_MAGIC)]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported DysRegNet cache format version: {version}")
+
+    with np.load(io.BytesIO(blob[len(FORMAT_MAGIC) + 1 :]), allow_pickle=False) as npz:
+        results = DysregulationMatrix.from_coo(
+            npz["data"],
+            npz["row"],
+            npz["col"],
+            npz["patients"],
+            npz["sources"],
+            npz["targets"],
+        )
+
+    return {"results": results, "parameters": {}}
+
+
+def dump_partitions(results: DysregulationMatrix, level: int) -> Dict[str, bytes]:
+    """
+    Serializes DysRegNet results split by the source (level 0) or target (level 1)
+    gene of the edges, so the neighborhood of a few genes can be read on its own.
+
+    Every partition holds the non-zero values of its edges in coordinate format
+    and the positions of its edges in the results, but not the patients.
+    Partitions are small, so they are stored as raw arrays without the npz
+    container and compression: the int32 counts of values and edges, the
+    float32 values, the int32 rows, columns and positions, followed by the
+    newline separated sources and targets.
+
+    Args:
+        results (DysregulationMatrix): DysRegNet results.
+        level (int): 0 to partition by source, 1 to partition by target gene.
+
+    Returns:
+        Dict[str, bytes]: gene to versioned binary blob
+    """
+    codes, genes = pd.factorize(results.columns.get_level_values(level))
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(genes) + 1))
+    sources = results.columns.get_level_values(0).astype(str)
+    targets = results.columns.get_level_values(1).astype(str)
+
+    partitions = {}
+    for i, gene in enumerate(genes):
+        cols = order[bounds[i] : bounds[i + 1]]
+        coo = results.matrix[:, cols].tocoo()
+        partitions[str(gene)] = b"".join(
+            [
+                PARTITION_MAGIC + bytes([PARTITION_VERSION]),
+                np.array([coo.nnz, len(cols)], dtype=np.int32).tobytes(),
+                coo.data.astype(np.float32).tobytes(),
+                coo.row.astype(np.int32).tobytes(),
+                coo.col.astype(np.int32).tobytes(),
+                cols.astype(np.int32).tobytes(),
+                "\n".join([*sources[cols], *targets[cols]]).encode("utf-8"),
+            ]
+        )
+    return partitions
+
+
+def load_partition(blob: bytes) -> Dict[str, np.ndarray]:
+    """
+    Deserializes one partition stored with dump_partitions into its arrays.
+    The numeric arrays are read-only views of the blob, the genes are decoded.
+    """
+    if blob[: len(PARTITION_MAGIC)] != PARTITION_MAGIC:
+        raise ValueError("Not a DysRegNet results partition")
+
+    version = blob[len(PARTITION_MAGIC)]
+    offset = len(PARTITION_MAGIC) + 1
+    if version != PARTITION_VERSION:
+        raise ValueError(f"Unsupported DysRegNet partition format version: {version}")
+
+    nnz, ncols = (
+        int(count) for count in np.frombuffer(blob, np.int32, count=2, offset=offset)
+    )
+    offset += 8
+    arrays = {}
+    for name, dtype, count in (
+        ("data", np.float32, nnz),
+        ("row", np.int32, nnz),
+        ("col", np.int32, nnz),
+        ("positions", np.int32, ncols),
+    ):
+        arrays[name] = np.frombuffer(blob, dtype, count=count, offset=offset)
+        offset += 4 * count
+    genes = bytes(blob[offset:]).decode("utf-8").split("\n") if ncols else []
+    arrays["sources"] = np.array(genes[:ncols], dtype=str)
+    arrays["targets"] = np.array(genes[ncols:], dtype=str)
+    return arrays
+
+
+def load_partitions(
+    blobs: List[Union[bytes, None]], index: Sequence[str]
+) -> DysregulationMatrix:
+    """
+    Deserializes and joins partitions stored with dump_partitions.
+
+    Args:
+        blobs (List[Union[bytes, None]]): The partitions, None for genes without edges.
+        index (Sequence[str]): The patients of the results.
+
+    Returns:
+        DysregulationMatrix: The edges of all partitions in the order of the results.
+    """
+    arrays = {
+        name: [] for name in ("data", "row", "col", "positions", "sources", "targets")
+    }
+    offset = 0
+    for blob in blobs:
+        if blob is None:
+            continue
+        partition = load_partition(blob)
+        for name in arrays:
+            arrays[name].append(
+                partition[name] + offset if name == "col" else partition[name]
+            )
+        offset += len(partition["positions"])
+
+    if offset == 0:
+        return DysregulationMatrix.from_coo(
+            np.array([], dtype=np.float32), [], [], index, [], []
+        )
+
+    arrays = {name: np.concatenate(values) for name, values in arrays.items()}
+    # restore the edge order of the results
+    order = np.argsort(arrays["positions"], kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return DysregulationMatrix.from_coo(
+        arrays["data"],
+        arrays["row"],
+        rank[arrays["col"]],
+        index,
+        arrays["sources"][order],
+        arrays["targets"][order],
+    )
+
+
+def dump_table(table: pd.DataFrame) -> bytes:
+    """
+    Serializes an input table (expression, meta or network data) column-wise
+    into a compressed binary blob.
+
+    Numeric columns keep their dtype, other columns are stored as strings
+    with a separate mask of missing values.
+
+    Args:
+        table (pd.DataFrame): The input table.
+
+    Returns:
+        bytes: The versioned binary blob.
+    """
+    arrays = {
+        "columns": np.array(table.columns.astype(str), dtype=str),
+        "index": (
+            table.index.to_numpy()
+            if pd.api.types.is_numeric_dtype(table.index)
+            else np.array(table.index.astype(str), dtype=str)
+        ),
+    }
+    for i, column in enumerate(table.columns):
+        values = table[column]
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            arrays[f"c{i}"] = values.to_numpy()
+        else:
+            arrays[f"c{i}"] = np.array(values.astype(str), dtype=str)
+            arrays[f"n{i}"] = values.isna().to_numpy()
+
+    buffer = io.BytesIO()
+    buffer.write(TABLE_MAGIC + bytes([TABLE_VERSION]))
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def load_table(blob: bytes) -> pd.DataFrame:
+    """
+    Deserializes an input table stored with dump_table.
+    """
+    if blob[: len(TABLE_MAGIC)] != TABLE_MAGIC:
+        raise ValueError("Not a DysRegNet input table")
+
+    version = blob[len(TABLE_MAGIC)]
+    if version != TABLE_VERSION:
+        raise ValueError(f"Unsupported DysRegNet table format version: {version}")
+
+    with np.load(io.BytesIO(blob[len(TABLE_MAGIC) + 1 :]), allow_pickle=False) as npz:
+        data = {}
+        for i, column in enumerate(npz["columns"]):
+            values = npz[f"c{i}"]
+            if f"n{i}" in npz.files:
+                values = np.where(npz[f"n{i}"], None, values.astype(object))
+            data[column] = values
+        return pd.DataFrame(data, index=npz["index"])
+
+
+def dump_models(models: EdgeModels) -> bytes:
+    """
+    Serializes the fitted edge models of a run into a binary blob.
+
+    The residuals keep their dtype (float64, or float32 with DYSREGNET_FLOAT32),
+    so the models score to exactly the same results again. They hardly compress, so the npz file is not compressed.
+
+    Args:
+        models (EdgeModels): The fitted edge models.
+
+    Returns:
+        bytes: The versioned binary blob.
+    """
+    buffer = io.BytesIO()
+    buffer.write(MODELS_MAGIC + bytes([MODELS_VERSION]))
+    np.savez(
+        buffer,
+        patients=np.array(models.patients.astype(str), dtype=str),
+        sources=np.array([source for source, _ in models.edges], dtype=str),
+        targets=np.array([target for _, target in models.edges], dtype=str),
+        r2=models.r2,
+        coef=models.coef,
+        residuals=models.residuals,
+        mean=models.mean,
+        std=models.std,
+        normaltest=models.normaltest,
+    )
+    return buffer.getvalue()
+
+
+def load_models(blob: bytes) -> EdgeModels:
+    """
+    Deserializes fitted edge models stored with dump_models.
+    """
+    if blob[: len(MODELS_MAGIC)] != MODELS_MAGIC:
+        raise ValueError("Not DysRegNet edge models")
+
+    version = blob[len(MODELS_MAGIC)]
+    if version != MODELS_VERSION:
+        raise ValueError(f"Unsupported DysRegNet models format version: {version}")
+
+    with np.load(io.BytesIO(blob[len(MODELS_MAGIC) + 1 :]), allow_pickle=False) as npz:
+        return EdgeModels(
+            [
+                (str(source), str(target))
+                for source, target in zip(npz["sources"], npz["targets"])
+            ],
+            pd.Index(npz["patients"], name="patient id"),
+            *(
+                npz[name]
+                for name in ("r2", "coef", "residuals", "mean", "std", "normaltest")
+            ),
+        )
@@ -0,0 +1,432 @@
+import hashlib
+import io
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Union
+from uuid import uuid4
+
+import pandas as pd
+
+from pages.components.dysregnet_cache import (
+    CACHE_TTL,
+    INPUT_KEY_PREFIX,
+    UPLOAD_BLOCKS_KEY,
+    UPLOAD_KEY_PREFIX,
+    cache,
+    cache_artifacts,
+    get_artifacts,
+    index_artifacts,
+    store,
+)
+from pages.components.dysregnet_dataset import (
+    FLOAT_DTYPE,
+    DysRegNetDataset,
+    get_table_hash,
+    to_float_dtype,
+)
+from pages.components.dysregnet_serialization import dump_table, load_table
+
+# Uploaded tables are parsed once and stored server side as input artifacts,
+# the dcc.Store components only keep their upload record: the artifact key
+# ("id") and the summary the callbacks need without loading the table.
+# Chunked uploads keep the table as the artifacts of its parsed blocks
+# ("blocks"), which are only joined when the table is loaded
+Upload = Dict[str, Any]
+
+UPLOAD_KINDS = ("expression", "meta", "network")
+# Bytes of a chunk of a chunked upload, every request parses one chunk
+UPLOAD_CHUNK_SIZE = 8 * 1024**2
+# Largest file of a chunked upload in bytes (0 disables the limit)
+MAX_UPLOAD_BYTES = int(os.getenv("DYSREGNET_MAX_UPLOAD_BYTES", "0"))
+# Seconds an unfinished chunked upload can be resumed after its last chunk
+UPLOAD_TTL = 24 * 60 * 60
+# Seconds a chunk may take, longer than the timeout of a gunicorn worker (30 s)
+UPLOAD_LOCK_TIMEOUT = 60
+
+
+def get_samples_hash(samples: Iterable[Any]) -> str:
+    """
+    Returns a hash of the set of sample ids, to compare the samples of uploads.
+    """
+    return hashlib.sha256(
+        json.dumps(sorted(str(sample) for sample in set(samples))).encode()
+    ).hexdigest()
+
+
+def store_upload(table: pd.DataFrame, kind: str) -> Upload:
+    """
+    Function to store a parsed table for the runs of this and other workers.
+    Identical tables share their artifact.
+
+    Args:
+        table (pd.DataFrame): the parsed table
+        kind (str): "expression", "meta" or "network"
+
+    Returns:
+        Upload: {"id": ..., "rows": ..., "columns": ...} with the number of
+        rows and columns, for expression and meta data the hash of their
+        "samples", for meta data the names of the "covariates" (all columns
+        but the sample ids) and the "conditions" (columns with only 0 and 1)
+    """
+    if kind == "expression":
+        table = to_float_dtype(table)
+    key = INPUT_KEY_PREFIX + get_table_hash(table)
+    cache_artifacts({key: dump_table(table)})
+
+    upload = {"id": key, "rows": len(table), "columns": len(table.columns)}
+    if kind in ("expression", "meta"):
+        upload["samples"] = get_samples_hash(table.iloc[:, 0])
+    if kind == "meta":
+        upload["covariates"] = [str(column) for column in table.columns[1:]]
+        upload["conditions"] = [
+            str(column) for column in table.columns[1:] if set(table[column]) == {0, 1}
+        ]
+    return upload
+
+
+def load_upload(upload: Upload) -> pd.DataFrame:
+    """
+    Function to load the table of an upload record. The blocks of a chunked
+    upload are joined, unless a run already stored the whole table.
+
+    Raises:
+        ValueError: if the table expired from the cache
+    """
+    (blob,) = get_artifacts([upload["id"]])
+    if blob is not None:
+        return load_table(blob)
+    blobs = get_artifacts(upload["blocks"]) if "blocks" in upload else [None]
+    if any(blob is None for blob in blobs):
+        raise ValueError(
+            "The uploaded data is no longer available, please upload it again"
+        )
+    return pd.concat([load_table(blob) for blob in blobs], ignore_index=True)
+
+
+def load_dataset(expression: Upload, meta: Upload, network: Upload) -> DysRegNetDataset:
+    """
+    Function to load the dataset of a run from its upload records. The
+    content hashes of the tables are their artifact keys, so the run does not
+    hash or store them again.
+    """
+    dataset = DysRegNetDataset(
+        load_upload(expression), load_upload(meta), load_upload(network)
+    )
+    uploads = {"expression": expression, "meta": meta, "network": network}
+    for name, upload in uploads.items():
+        dataset.hashes[name] = upload["id"][len(INPUT_KEY_PREFIX) :]
+    return dataset
+
+
+def is_upload(upload: Union[Upload, None]) -> bool:
+    return bool(upload) and "id" in upload
+
+
+def start_upload(kind: str, name: str, size: int) -> Dict[str, Any]:
+    """
+    Function to start a chunked upload of a CSV file. The chunks are sent in
+    order with append_upload, which parses the complete lines of every chunk,
+    so only one chunk is held in memory while the file is uploaded.
+
+    Args:
+        kind (str): "expression", "meta" or "network"
+        name (str): the file name
+        size (int): the file size in bytes
+
+    Raises:
+        ValueError: if the kind or the size is invalid
+
+    Returns:
+        Dict[str, Any]: the status of the upload, see get_upload_status
+    """
+    if kind not in UPLOAD_KINDS:
+        raise ValueError(f"Unknown upload kind: {kind}")
+    if size <= 0:
+        raise ValueError("The file is empty")
+    if MAX_UPLOAD_BYTES and size > MAX_UPLOAD_BYTES:
+        raise ValueError(
+            f"The file is too large ({size / 1024**2:.0f} MiB, limit:"
+            f" {MAX_UPLOAD_BYTES / 1024**2:.0f} MiB)"
+        )
+
+    drop_expired_blocks()
+    upload_id = uuid4().hex
+    key = UPLOAD_KEY_PREFIX + upload_id
+    pipe = cache.pipeline(transaction=False)
+    pipe.hset(
+        key,
+        mapping={"kind": kind, "name": name, "size": size, "offset": 0, "rows": 0},
+    )
+    pipe.expire(key, UPLOAD_TTL)
+    pipe.execute()
+    return get_upload_status(upload_id)
+
+
+def get_upload_status(upload_id: str) -> Union[Dict[str, Any], None]:
+    """
+    Function to get the status of a chunked upload.
+
+    Returns:
+        Union[Dict[str, Any], None]: {"id": ..., "kind": ..., "name": ...,
+        "size": ..., "offset": ..., "rows": ..., "chunk_size": ..., "done": ...,
+        "upload": ..., "error": ...} with the bytes received so far (the offset
+        of the next chunk), the rows parsed so far, the upload record once the
+        table is stored and the error of a failed upload. None if the upload is
+        unknown or expired.
+    """
+    state = cache.hgetall(UPLOAD_KEY_PREFIX + upload_id)
+    if not state:
+        return None
+    upload = state.get(b"upload")
+    return {
+        "id": upload_id,
+        "kind": state[b"kind"].decode(),
+        "name": state[b"name"].decode(),
+        "size": int(state[b"size"]),
+        "offset": int(state[b"offset"]),
+        "rows": int(state[b"rows"]),
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "done": upload is not None,
+        "upload": json.loads(upload) if upload is not None else None,
+        "error": state[b"error"].decode() if b"error" in state else None,
+    }
+
+
+def append_upload(upload_id: str, offset: int, chunk: bytes) -> Dict[str, Any]:
+    """
+    Function to append the next chunk of a chunked upload. The chunk is only
+    appended if it starts at the offset of the upload and no other chunk is
+    appended at the same time, otherwise the status is returned unchanged, so
+    the client can resume at the returned offset. The last chunk indexes the
+    blocks of the table as input artifacts.
+
+    Raises:
+        KeyError: if the upload is unknown or expired
+        ValueError: if the chunk can not be parsed, the upload fails then
+
+    Returns:
+        Dict[str, Any]: the status of the upload, see get_upload_status
+    """
+    key = UPLOAD_KEY_PREFIX + upload_id
+    # one chunk of an upload at a time, expires if the worker dies meanwhile
+    if not cache.set(key + ":lock", 1, nx=True, ex=UPLOAD_LOCK_TIMEOUT):
+        return get_upload_status(upload_id)
+    try:
+        status = get_upload_status(upload_id)
+        if status is None:
+            raise KeyError(upload_id)
+        if (
+            status["done"]
+            or status["error"]
+            or offset != status["offset"]
+            or offset + len(chunk) > status["size"]
+        ):
+            return status
+
+        try:
+            parse_chunk(key, status, chunk)
+        except (ValueError, pd.errors.ParserError) as e:
+            drop_upload_blocks(key)
+            cache.hset(key, "error", str(e))
+            raise ValueError(str(e))
+    finally:
+        cache.delete(key + ":lock")
+    return get_upload_status(upload_id)
+
+
+def parse_chunk(key: str, status: Dict[str, Any], chunk: bytes):
+    """
+    Parses the complete lines of a chunk (with the incomplete last line of the
+    chunk before) into a block of rows, the incomplete last line is kept for
+    the next chunk. Lines must not contain quoted line breaks. The blocks
+    after the first one are parsed with its column types (see get_upload_dtypes).
+    The summary of the upload record is collected block by block.
+    """
+    state = cache.hmget(key, ["header", "tail", "blocks", "dtypes", "conditions"])
+    header = json.loads(state[0]) if state[0] is not None else None
+    data = (state[1] or b"") + chunk
+    blocks = json.loads(state[2]) if state[2] is not None else []
+    dtypes = json.loads(state[3]) if state[3] is not None else None
+    conditions = json.loads(state[4]) if state[4] is not None else None
+    last = status["offset"] + len(chunk) == status["size"]
+
+    end = len(data) if last else data.rfind(b"\n") + 1
+    lines, tail = data[:end], data[end:]
+    if header is None and lines:
+        # the first line are the column names
+        end = lines.find(b"\n") + 1 or len(lines)
+        header = get_upload_columns(lines[:end], status["kind"])
+        lines = lines[end:]
+
+    mapping = {"offset": status["offset"] + len(chunk), "tail": tail}
+    if header is not None:
+        mapping["header"] = json.dumps(header)
+    pipe = cache.pipeline(transaction=False)
+    if lines.strip():
+        block = read_block(
+            lines,
+            header,
+            dtypes or get_upload_dtypes(header, status),
+            # the first line is the header
+            status["rows"] + 2,
+        )
+        if dtypes is None:
+            mapping["dtypes"] = json.dumps(
+                {str(column): str(dtype) for column, dtype in block.dtypes.items()}
+            )
+        if status["kind"] in ("expression", "meta"):
+            pipe.sadd(key + ":samples", *{str(sample) for sample in block.iloc[:, 0]})
+            pipe.expire(key + ":samples", UPLOAD_TTL)
+        if status["kind"] == "meta":
+            conditions = get_upload_conditions(block, conditions)
+            mapping["conditions"] = json.dumps(conditions)
+
+        block_key = f"{key}:{len(blocks)}"
+        blob = dump_table(block)
+        store.put_many({block_key: blob})
+        blocks.append(
+            {"key": block_key, "hash": get_table_hash(block), "size": len(blob)}
+        )
+        mapping["blocks"] = json.dumps(blocks)
+        mapping["rows"] = status["rows"] + len(block)
+
+    # the blocks expire with the state of the upload
+    block_keys = [block["key"] for block in blocks]
+    pipe.hset(key, mapping=mapping)
+    for expiring_key in (key, *block_keys):
+        pipe.expire(expiring_key, UPLOAD_TTL)
+    if block_keys:
+        pipe.zadd(
+            UPLOAD_BLOCKS_KEY, {block: time.time() + UPLOAD_TTL for block in block_keys}
+        )
+    pipe.execute()
+
+    if last:
+        finish_upload(key, status["kind"], header, blocks, conditions)
+
+
+def get_upload_conditions(
+    block: pd.DataFrame, conditions: Union[Dict[str, List[int]], None]
+) -> Dict[str, List[int]]:
+    """
+    Returns the meta data columns with only 0 and 1 in the blocks so far and
+    the values they contain, conditions are the ones of the blocks before.
+    """
+    if conditions is None:
+        conditions = {str(column): [] for column in block.columns[1:]}
+    updated = {}
+    for column, values in conditions.items():
+        block_values = set(block[column])
+        if block_values <= {0, 1}:
+            updated[column] = sorted({*values, *(int(v) for v in block_values)})
+    return updated
+
+
+def get_upload_dtypes(header: List[str], status: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the column types of the first block of an upload. Sample ids and
+    genes are text, expression values FLOAT_DTYPE, the types of the other meta
+    data columns are inferred from the first block.
+    """
+    if status["kind"] == "network":
+        return {column: str for column in header}
+    if status["kind"] == "expression":
+        return {header[0]: str, **{column: FLOAT_DTYPE for column in header[1:]}}
+    return {header[0]: str}
+
+
+def read_block(
+    lines: bytes, header: List[str], dtypes: Dict[str, Any], line: int
+) -> pd.DataFrame:
+    """
+    Parses the lines of a block, starting at line of the file, into its rows.
+    """
+    try:
+        return pd.read_csv(
+            io.BytesIO(lines), header=None, names=header, index_col=False, dtype=dtypes
+        )
+    except ValueError as e:
+        raise ValueError(f"Could not parse the rows from line {line} on ({e})")
+
+
+def get_upload_columns(line: bytes, kind: str) -> List[str]:
+    columns = [str(column) for column in pd.read_csv(io.BytesIO(line), nrows=0).columns]
+    if kind == "network" and len(columns) != 2:
+        raise ValueError("Network file must have exactly two columns")
+    return columns
+
+
+def finish_upload(
+    key: str,
+    kind: str,
+    header: List[str],
+    blocks: List[Dict[str, Any]],
+    conditions: Union[Dict[str, List[int]], None],
+):
+    """
+    Indexes the parsed blocks of a finished upload as input artifacts and
+    stores its upload record. The blocks are not joined here, the table is
+    identified by the hash of their content hashes.
+    """
+    if header is None or not blocks:
+        raise ValueError("The file contains no rows")
+    block_keys = [block["key"] for block in blocks]
+    if not all(store.exists_many(block_keys)):
+        raise ValueError("The upload expired, please upload the file again")
+
+    table_hash = hashlib.sha256(
+        json.dumps([block["hash"] for block in blocks]).encode()
+    ).hexdigest()
+    upload = {
+        "id": INPUT_KEY_PREFIX + table_hash,
+        "blocks": block_keys,
+        "rows": int(cache.hget(key, "rows")),
+        "columns": len(header),
+    }
+    if kind in ("expression", "meta"):
+        upload["samples"] = get_samples_hash(
+            sample.decode() for sample in cache.smembers(key + ":samples")
+        )
+    if kind == "meta":
+        upload["covariates"] = header[1:]
+        upload["conditions"] = [
+            column
+            for column in header[1:]
+            if set((conditions or {}).get(column, ())) == {0, 1}
+        ]
+
+    if not CACHE_TTL:
+        # indexed artifacts do not expire
+        pipe = cache.pipeline(transaction=False)
+        for block in block_keys:
+            pipe.persist(block)
+        pipe.execute()
+    index_artifacts({block["key"]: block["size"] for block in blocks})
+    cache.zrem(UPLOAD_BLOCKS_KEY, *block_keys)
+    cache.hdel(key, "blocks", "tail", "conditions")
+    cache.delete(key + ":samples")
+    cache.hset(key, "upload", json.dumps(upload))
+
+
+def drop_upload_blocks(key: str):
+    blocks = cache.hget(key, "blocks")
+    if blocks is not None:
+        delete_blocks([block["key"] for block in json.loads(blocks)])
+    cache.hdel(key, "blocks", "tail", "conditions")
+    cache.delete(key + ":samples")
+
+
+def delete_blocks(blocks: List[str]):
+    if blocks:
+        store.delete_many(blocks)
+        cache.zrem(UPLOAD_BLOCKS_KEY, *blocks)
+
+
+def drop_expired_blocks():
+    """
+    Deletes the blocks of uploads which expired unfinished. Redis expires the
+    blocks itself, the other artifact stores do not.
+    """
+    expired = cache.zrangebyscore(UPLOAD_BLOCKS_KEY, "-inf", time.time())
+    delete_blocks([block.decode() for block in expired])
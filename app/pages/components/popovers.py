@@ -87,6 +87,11 @@ def get_popovers():
                 **Download graph image:**
                 Downloads the displayed network graph as a PNG image.
                 
+                **Export complete cancer network:**
+                Exports all regulations of the selected cancer type, and optionally all patient
+                dysregulations, as a zipped CSV archive. The export runs in the background and a
+                download link appears once it is finished.
+                
                 """,
             ),
             target="downloads_info",
@@ -1,13 +1,63 @@
-from typing import List, Union, Dict
+from functools import partial
+from typing import Any, Dict, List, Union
 
 import dysregnet
-import pandas as pd
-from pages.components.dysregnet_cache import cache_data
+from pages.components.dysregnet_cache import (
+    cache_data,
+    cache_partial,
+    copy_cached_run,
+    drop_partial,
+    get_cached_models,
+    get_cached_results,
+    start_partial,
+)
+from pages.components.dysregnet_dataset import DysRegNetDataset
+from pages.components.dysregnet_distributed import CELERY_CHUNKS, run_distributed
+from pages.components.dysregnet_engine import ENGINE, fit_run
+from pages.components.dysregnet_estimate import (
+    check_limits,
+    estimate_run,
+    measure_run,
+    record_run,
+)
+from pages.components.dysregnet_parallel import (
+    get_processes,
+    prepare_run,
+    run_chunked,
+    run_parallel,
+)
+from pages.components.dysregnet_results import DysregulationMatrix
+
+
+def get_parameters(
+    condition: str,
+    cat_cov: List[str],
+    con_cov: List[str],
+    zscoring: bool,
+    bonferroni: float,
+    normaltest: bool,
+    normaltest_alpha: float,
+    r2: Union[float, None],
+    condition_direction: bool,
+) -> Dict[str, Any]:
+    """
+    Returns the parameters of a DysRegNet run as they are cached with the session.
+    """
+    return {
+        "condition": condition,
+        "cat_cov": cat_cov,
+        "con_cov": con_cov,
+        "zscoring": zscoring,
+        "bonferroni": bonferroni,
+        "r2": r2,
+        "normaltest": normaltest,
+        "normaltest_alpha": normaltest_alpha,
+        "condition_direction": condition_direction,
+    }
+
 
 def get_results(
-    expression: Dict[str, Dict[str, str]],
-    meta: Dict[str, Dict[str, str]],
-    network: Dict[str, Dict[str, str]],
+    dataset: DysRegNetDataset,
     condition: str,
     cat_cov: List[str],
     con_cov: List[str],
@@ -17,15 +67,13 @@ def get_results(
     normaltest_alpha: float,
     r2: Union[float, None],
     condition_direction: bool,
-    session_id: str
-) -> pd.DataFrame:
+    session_id: str,
+) -> DysregulationMatrix:
     """
     Runs the DysRegNet analysis and returns the results.
 
     Args:
-        expression (Dict[str, Dict[str, str]]): The expression data.
-        meta (Dict[str, Dict[str, str]]): The metadata.
-        network (Dict[str, Dict[str, str]]): The gene regulatory network.
+        dataset (DysRegNetDataset): The expression data, metadata and gene regulatory network.
         condition (str): The condition column name.
         cat_cov (List[str]): The categorical covariates.
         con_cov (List[str]): The continuous covariates.
@@ -37,13 +85,28 @@ def get_results(
         condition_direction (bool): Flag indicating whether to consider condition direction.
 
     Returns:
-        pd.DataFrame: The DysRegNet analysis results.
+        DysregulationMatrix: The sparse DysRegNet analysis results.
     """
 
-    result = dysregnet.run(
-        expression_data=pd.DataFrame(expression),
-        meta=pd.DataFrame(meta),
-        GRN=pd.DataFrame(network),
+    parameters = get_parameters(
+        condition,
+        cat_cov,
+        con_cov,
+        zscoring,
+        bonferroni,
+        normaltest,
+        normaltest_alpha,
+        r2,
+        condition_direction,
+    )
+    # identical runs (same inputs and parameters) reuse the cached results
+    if copy_cached_run(parameters, dataset, session_id):
+        return get_cached_results(session_id)
+
+    arguments = dict(
+        expression_data=dataset.expression,
+        meta=dataset.meta,
+        GRN=dataset.network,
         conCol=condition,
         CatCov=cat_cov,
         ConCov=con_cov,
@@ -54,30 +117,119 @@ def get_results(
         normaltest_alpha=normaltest_alpha,  # = 1e-3
         direction_condition=condition_direction,
     )
+    thresholds = dict(
+        bonferroni_alpha=bonferroni,
+        R2_threshold=r2,
+        normaltest=normaltest,
+        normaltest_alpha=normaltest_alpha,
+        direction_condition=condition_direction,
+    )
+
+    # runs which only change thresholds rescore the fitted models of an earlier run
+    models = get_cached_models(parameters, dataset)
+    if models is not None:
+        results = models.to_results(**thresholds)
+        cache_data(
+            session_id, results, parameters=parameters, inputs=dataset, models=models
+        )
+        return results
+
+    covariates = len(cat_cov) + len(con_cov)
+    chunks = get_run_chunks(dataset, cat_cov, con_cov)
+
+    if CELERY_CHUNKS > 0:
+        # edge chunks as Celery subtasks, the merge step caches the results
+        return run_distributed(
+            max(CELERY_CHUNKS, chunks),
+            session_id,
+            parameters,
+            dataset,
+            {
+                name: value
+                for name, value in arguments.items()
+                if name not in ("expression_data", "meta", "GRN")
+            },
+        )
 
-    # get result DataFrame from DysRegNet run object
-    results = result.get_results()
+    processes = get_processes()
+    if processes > 1 or chunks > 1:
+        # edge chunks in a process pool or one after the other,
+        # finished chunks are partial results
+        start_partial(session_id, dataset.n_run_edges)
+        try:
+            if processes > 1:
+                results = run_parallel(
+                    processes, on_chunk=partial(cache_partial, session_id), **arguments
+                )
+            else:
+                results = run_chunked(
+                    chunks, on_chunk=partial(cache_partial, session_id), **arguments
+                )
+            cache_data(session_id, results, parameters=parameters, inputs=dataset)
+        finally:
+            drop_partial(session_id)
+        return results
 
-    # convert result to Dict[str, str]
-    results.columns = [",".join(c) for c in results.columns]
-    results = results.to_dict()
+    models = None
+    with measure_run() as measurement:
+        if ENGINE == "native":
+            # batched least squares instead of one statsmodels fit per edge,
+            # the models are cached for reruns with other thresholds
+            models = fit_run(prepare_run(**arguments))
+            results = models.to_results(**thresholds)
+        else:
+            result = dysregnet.run(**arguments)
+
+            # get result DataFrame with (source, target) columns from DysRegNet run object
+            results = DysregulationMatrix.from_frame(result.get_results())
+    # calibrates the estimates of later runs
+    record_run(
+        dataset.n_samples,
+        dataset.n_genes,
+        dataset.n_run_edges,
+        covariates,
+        measurement["seconds"],
+        measurement["memory"],
+    )
 
     # cache input data and results
-    cache_data(session_id, results, 
-        parameters = {
-            "expression": expression,
-            "meta": meta,
-            "network": network,
-            "condition": condition,
-            "cat_cov": cat_cov,
-            "con_cov": con_cov,
-            "zscoring": zscoring,
-            "bonferroni": bonferroni,
-            "r2": r2,
-            "normaltest": normaltest,
-            "normaltest_alpha": normaltest_alpha,
-            "condition_direction": condition_direction,
-        }
+    cache_data(
+        session_id, results, parameters=parameters, inputs=dataset, models=models
     )
 
     return results
+
+
+def get_run_chunks(
+    dataset: DysRegNetDataset, cat_cov: List[str], con_cov: List[str]
+) -> int:
+    """
+    Returns the number of edge chunks a run is fitted in, runs which would need
+    too much memory at once are fitted in several chunks.
+
+    Raises:
+        ValueError: if the run exceeds the limits of the server
+    """
+    return check_limits(
+        estimate_run(
+            dataset.n_samples,
+            dataset.n_genes,
+            dataset.n_run_edges,
+            len(cat_cov) + len(con_cov),
+        )
+    )
+
+
+def streams_partial_results(
+    dataset: DysRegNetDataset, cat_cov: List[str], con_cov: List[str]
+) -> bool:
+    """
+    Returns True if a run publishes its finished edge chunks as partial results.
+    """
+    if CELERY_CHUNKS > 0 or get_processes() > 1:
+        return True
+    try:
+        return get_run_chunks(dataset, cat_cov, con_cov) > 1
+    except ValueError:
+        # the run is refused
+        return False
@@ -132,9 +132,32 @@ def get_settings():
                                 style={"textAlign": "left"},
                                 size="sm",
                             ),
+                            dbc.Button(
+                                children=[
+                                    html.I(className="fa fa-download mr-1"),
+                                    " Export complete cancer network (.zip)",
+                                ],
+                                id="btn_export_network",
+                                outline=True,
+                                color="primary",
+                                style={"textAlign": "left"},
+                                size="sm",
+                            ),
                         ],
                         className="d-grid gap-2",
                     ),
+                    dbc.Switch(
+                        id="export_dysregulation_switch",
+                        label="Include patient dysregulations",
+                        value=False,
+                        className="mt-2",
+                    ),
+                    dbc.Progress(
+                        id="export_progress",
+                        value=0,
+                        style={"display": "none"},
+                    ),
+                    html.Div(id="export_link", className="mt-2"),
                 ]
             ),
             className="mt-3 mb-3",
@@ -0,0 +1,64 @@
+from flask import Flask, abort, jsonify, request
+
+from pages.components.dysregnet_uploads import (
+    UPLOAD_CHUNK_SIZE,
+    append_upload,
+    get_upload_status,
+    start_upload,
+)
+
+
+def register_upload_routes(server: Flask):
+    """
+    Registers the endpoints of chunked uploads on the flask server:
+
+        POST /uploads             {"kind": ..., "name": ..., "size": ...}
+        PUT  /uploads/<id>?offset=<offset>   the chunk at offset as body
+        GET  /uploads/<id>
+
+    All return the status of the upload (see get_upload_status). A chunk which
+    does not start at the offset of the upload is answered with 409 and the
+    status, so clients resume at its offset.
+    """
+
+    def error(message: str, code: int):
+        return jsonify({"error": message}), code
+
+    @server.route("/uploads", methods=["POST"])
+    def create_upload():
+        body = request.get_json(silent=True) or {}
+        try:
+            status = start_upload(
+                body.get("kind"), str(body.get("name", "")), int(body.get("size", 0))
+            )
+        except (TypeError, ValueError) as e:
+            return error(str(e), 400)
+        return jsonify(status), 201
+
+    @server.route("/uploads/<upload_id>", methods=["PUT"])
+    def upload_chunk(upload_id: str):
+        offset = request.args.get("offset", type=int)
+        if offset is None:
+            return error("offset is required", 400)
+        if (request.content_length or 0) > UPLOAD_CHUNK_SIZE:
+            return error(f"Chunks are limited to {UPLOAD_CHUNK_SIZE} bytes", 413)
+
+        chunk = request.get_data(cache=False)
+        try:
+            status = append_upload(upload_id, offset, chunk)
+        except KeyError:
+            abort(404)
+        except ValueError as e:
+            return error(str(e), 400)
+        if status["error"]:
+            return error(status["error"], 400)
+        if status["offset"] != offset + len(chunk) and not status["done"]:
+            return jsonify(status), 409
+        return jsonify(status)
+
+    @server.route("/uploads/<upload_id>")
+    def upload_status(upload_id: str):
+        status = get_upload_status(upload_id)
+        if status is None:
+            abort(404)
+        return jsonify(status)
@@ -1,7 +1,4 @@
-import base64
-import io
 import time
-from contextlib import redirect_stderr
 from typing import Any, Dict, List, Literal, Tuple, Union
 from uuid import uuid4
 
@@ -9,19 +6,50 @@ import dash
 import dash_bootstrap_components as dbc
 import dash_daq as daq
 import pandas as pd
-from dash import callback, ctx, dcc, html
+from dash import callback, clientside_callback, ctx, dcc, html
 from dash._callback import NoUpdate
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from pandas.testing import assert_index_equal
 
 from pages.components.control_data import ControlData
-from pages.components.dysregnet_cache import check_cache, get_cached_results
-from pages.components.dysregnet_progress import DysregnetProgress
-from pages.components.run_dysregnet import get_results
+from pages.components.dysregnet_cache import (
+    check_cache,
+    get_cached_summary,
+    get_partial,
+)
+from pages.components.dysregnet_estimate import (
+    check_limits,
+    estimate_run,
+    format_bytes,
+    format_duration,
+)
+from pages.components.dysregnet_progress import (
+    DysregnetProgress,
+    format_label,
+    format_progress,
+    redirect_progress,
+)
+from pages.components.dysregnet_results import get_genes
+from pages.components.dysregnet_queue import format_wait, queued_run
+from pages.components.dysregnet_uploads import (
+    Upload,
+    is_upload,
+    load_dataset,
+    load_upload,
+    store_upload,
+)
+from pages.components.run_dysregnet import (
+    get_parameters,
+    get_results,
+    streams_partial_results,
+)
 from pages.components.user_output import get_output_layout
 
 control_data = ControlData()
 
+# Milliseconds between two refreshes of the upload progress
+UPLOAD_REFRESH_INTERVAL = 500
+
 app = dash.get_app()
 
 
@@ -63,10 +91,10 @@ def get_input_layout() -> dbc.Container:
                                     ),
                                 ],
                             ),
-                            dcc.Upload(
+                            html.Div(
                                 id="expression",
+                                className="chunked-upload",
                                 children="Drag and Drop or Select Files",
-                                accept=".csv",
                                 style={
                                     "width": "100%",
                                     "height": "60px",
@@ -163,10 +191,10 @@ def get_input_layout() -> dbc.Container:
                                 ],
                                 align="center",
                             ),
-                            dcc.Upload(
+                            html.Div(
                                 id="meta",
+                                className="chunked-upload",
                                 children="Drag and Drop or Select Files",
-                                accept=".csv",
                             ),
                             dcc.Dropdown(
                                 id="control-option",
@@ -191,10 +219,10 @@ def get_input_layout() -> dbc.Container:
                                     ),
                                 ]
                             ),
-                            dcc.Upload(
+                            html.Div(
                                 id="network",
+                                className="chunked-upload",
                                 children="Drag and Drop or Select Files",
-                                accept=".csv",
                                 style={
                                     "width": "100%",
                                     "height": "60px",
@@ -517,12 +545,21 @@ def get_input_layout() -> dbc.Container:
                 ],
                 justify="center",
             ),
+            dbc.Row(
+                html.Small(id="run_estimate", className="text-muted text-center mt-2"),
+                justify="center",
+            ),
             dbc.Modal(
                 [
                     dbc.ModalHeader(
                         dbc.ModalTitle("Running DysRegNet"), close_button=False
                     ),
-                    dbc.ModalBody([html.Center([dbc.Progress(id="progress")])]),
+                    dbc.ModalBody(
+                        [
+                            html.Center([dbc.Progress(id="progress")]),
+                            html.Div(id="progress_session", className="mt-2"),
+                        ]
+                    ),
                     dbc.ModalFooter(
                         dbc.Button(
                             "Cancel",
@@ -569,6 +606,10 @@ def get_input_layout() -> dbc.Container:
             dash.dcc.Store(id="meta_data", storage_type="memory"),
             dash.dcc.Store(id="meta_data_autogenerated", storage_type="memory"),
             dash.dcc.Store(id="expression_data_autogenerated", storage_type="memory"),
+            # identifies the browser for the per user limits of the job queue
+            dash.dcc.Store(id="client_id", storage_type="local"),
+            # shows the progress of the chunked uploads (assets/uploads.js)
+            dcc.Interval(id="upload_interval", interval=UPLOAD_REFRESH_INTERVAL),
         ],
         id="input_layout",
     )
@@ -717,41 +758,19 @@ def change_layout_toggle(value: bool):
         )
 
 
-@callback(
+clientside_callback(
+    ClientsideFunction(namespace="uploads", function_name="poll_uploads"),
     Output("expression", "children"),
     Output("meta", "children"),
     Output("network", "children"),
-    Input("expression", "filename"),
-    Input("meta", "filename"),
-    Input("network", "filename"),
+    Output("expression_data", "data"),
+    Output("meta_data", "data"),
+    Output("network_data", "data"),
+    Output("errorbox", "children", allow_duplicate=True),
+    Output("errorbox", "style", allow_duplicate=True),
+    Input("upload_interval", "n_intervals"),
+    prevent_initial_call=True,
 )
-def upload_name_update(
-    expression_name: Union[str, None],
-    meta_name: Union[str, None],
-    network_name: Union[str, None],
-) -> Tuple[str, str, str]:
-    """
-    Updates the names of the uploaded files.
-
-    Args:
-        expression_name (str): The name of the expression file.
-        meta_name (str): The name of the meta file.
-        network_name (str): The name of the network file.
-
-    Returns:
-        tuple: A tuple containing the updated names of the expression, meta, and network files.
-    """
-    expression_name = (
-        expression_name
-        if expression_name is not None
-        else "Drag and Drop or Select Files"
-    )
-    meta_name = meta_name if meta_name is not None else "Drag and Drop or Select Files"
-    network_name = (
-        network_name if network_name is not None else "Drag and Drop or Select Files"
-    )
-
-    return expression_name, meta_name, network_name
 
 
 @callback(
@@ -815,63 +834,43 @@ def disable_button(control_option: Union[str, None]):
     ],
     prevent_initial_call=True,
 )
-def prepare_control_data(
-    control_option: Union[str, None], expression: Dict[str, Dict[str, str]]
-):
+def prepare_control_data(control_option: Union[str, None], expression: Upload):
     """
     Generate dropdown options based on the provided (or generated) expression, meta, and network data.
 
     Args:
         control_optoin (str): Selected tissue type of which control data is going to be prepared.
-        expression_data (Dict[str, Dict[str, str]]): User provided expression data.
+        expression_data (Upload): User provided expression data.
 
     Returns:
         tuple: A tuple containing the following elements:
             - missing_genes_message (str): A message listing genes that are not found in the gtex control data set, if any.
             - open_modal (bool): Open the modal which shows the missing_genes_message.
-            - expression_data_auto (Dict[str, Dict[str, str]]): Expression data generated from selected control data option.
-            - meta_data_auto (Dict[str, Dict[str, str]]): Meta data generated from selected control data option.
+            - expression_data_auto (Upload): Expression data generated from selected control data option.
+            - meta_data_auto (Upload): Meta data generated from selected control data option.
             - output (dash.no_update): A special value indicating that the loading-options-output should not be updated.
             - error_message (str): An error message, if any.
             - error_style (dict): A dictionary representing the CSS style for displaying the error message.
     """
 
-    if control_option is not None:
+    if control_option is not None and is_upload(expression):
 
-        control_data.load_control_data(control_option)
+        # the loaded and filtered control data are kept on the instance, one per
+        # call, so concurrent calls in one process do not share them
+        tissue_data = ControlData()
+        tissue_data.load_control_data(control_option)
 
-        expression_df = pd.DataFrame(expression)
+        expression_df = load_upload(expression)
 
         # Original control data is indexed using genes in user expressoin data
         # Genes in user data that do not exist in the control data are returned as a list,
         # which should be dropped from user expression data
-        genes_not_exist = control_data.filter_control_data(expression_df.columns[1:])
-
-        if control_data.control_data is not None:
-
-            control_data.control_data.insert(
-                0, expression_df.columns[0], control_data.control_data.index
-            )
-
-            expression_df.drop(columns=genes_not_exist, inplace=True)
-            assert_index_equal(expression_df.columns, control_data.control_data.columns)
-
-            new_meta = {
-                "sample": expression_df.iloc[:, 0].to_list()
-                + control_data.control_data.iloc[:, 0].to_list(),
-                "condition": [1] * expression_df.shape[0]
-                + [0] * control_data.control_data.shape[0],
-            }
-
-            # Update `condition`, `cat-cov`, `con-cov` dropdown list options
-            # Using the same logic as in `show_dropdown_options` function
-            meta_df = pd.DataFrame(new_meta)
-            expression_df = pd.concat([expression_df, control_data.control_data])
-            expression_df.reset_index(drop=True, inplace=True)
-
-            import sys
+        merged_df, meta_df, genes_not_exist = tissue_data.merge_control_data(
+            expression_df
+        )
 
-            print(sys.getsizeof(expression_df.to_dict()))
+        if merged_df is not None:
+            expression_df = merged_df
 
             if set(meta_df.iloc[:, 0]) != set(expression_df.iloc[:, 0]):
                 return (
@@ -891,8 +890,8 @@ def prepare_control_data(
                         (also dropped in the provided expression data):\n"""
                     + ",\n".join(genes_not_exist),
                     True,
-                    expression_df.to_dict(),
-                    new_meta,
+                    store_upload(expression_df, "expression"),
+                    store_upload(meta_df, "meta"),
                     "",
                     "",
                     {"display": "none"},
@@ -901,8 +900,8 @@ def prepare_control_data(
             return (
                 "",
                 False,
-                expression_df.to_dict(),
-                new_meta,
+                store_upload(expression_df, "expression"),
+                store_upload(meta_df, "meta"),
                 "",
                 "",
                 {"display": "none"},
@@ -926,120 +925,6 @@ def prepare_control_data(
         raise dash.exceptions.PreventUpdate
 
 
-@callback(
-    Output("errorbox", "children", allow_duplicate=True),
-    Output("errorbox", "style", allow_duplicate=True),
-    Output("expression_data", "data"),
-    Input("expression", "contents"),
-    prevent_initial_call=True,
-)
-def load_expression_data(expression: Union[str, None]):
-    """
-    Stores expression dataframes in global variables for generating dropdown options and use in the dysregnet run callback.
-
-    Args:
-        expression (str): Base64 encoded expression data.
-
-    Returns:
-        tuple: A tuple containing the following elements:
-            - error_message (str): An error message, if any.
-            - error_style (Dict): A dictionary representing the CSS style for displaying the error message.
-            - expression_data (Dict[str, Dict[str, str]])
-    """
-    try:
-        expression_df = pd.read_csv(
-            io.StringIO(
-                base64.b64decode(expression.split(",")[1] + "===").decode("utf-8")
-            ),
-        )
-        return ("", {"display": "none"}, expression_df.to_dict())
-
-    except Exception as e:
-        return (
-            f"Error: Something went wrong ({e})",
-            {"display": "block"},
-            {},
-        )
-
-
-@callback(
-    Output("errorbox", "children", allow_duplicate=True),
-    Output("errorbox", "style", allow_duplicate=True),
-    Output("meta_data", "data"),
-    Input("meta", "contents"),
-    prevent_initial_call=True,
-)
-def load_meta_data(meta: Union[str, None]):
-    """
-    Stores metadata dataframes in global variables for generating dropdown options and use in the dysregnet run callback.
-
-    Args:
-        metadata (str): Base64 encoded metadata data.
-
-    Returns:
-        tuple: A tuple containing the following elements:
-            - error_message (str): An error message, if any.
-            - error_style (Dict): A dictionary representing the CSS style for displaying the error message.
-            - metadata_data (Dict[str, Dict[str, str]])
-    """
-    try:
-        meta_df = pd.read_csv(
-            io.StringIO(base64.b64decode(meta.split(",")[1] + "===").decode("utf-8")),
-        )
-        return ("", {"display": "none"}, meta_df.to_dict())
-
-    except Exception as e:
-        return (
-            f"Error: Something went wrong ({e})",
-            {"display": "block"},
-            {},
-        )
-
-
-@callback(
-    Output("errorbox", "children", allow_duplicate=True),
-    Output("errorbox", "style", allow_duplicate=True),
-    Output("network_data", "data"),
-    Input("network", "contents"),
-    prevent_initial_call=True,
-)
-def load_network_data(network: Union[str, None]):
-    """
-    Stores network dataframes in global variables for generating dropdown options and use in the dysregnet run callback.
-
-    Args:
-        network (str): Base64 encoded network data.
-
-    Returns:
-        tuple: A tuple containing the following elements:
-            - error_message (str): An error message, if any.
-            - error_style (Dict): A dictionary representing the CSS style for displaying the error message.
-            - network_data (Dict[str, Dict[str, str]])
-    """
-    try:
-        network_df = pd.read_csv(
-            io.StringIO(
-                base64.b64decode(network.split(",")[1] + "===").decode("utf-8")
-            ),
-        )
-
-        if len(network_df.columns) != 2:
-            return (
-                "Error: Network file must have exactly two columns",
-                {"display": "block"},
-                dash.no_update,
-            )
-
-        return ("", {"display": "none"}, network_df.to_dict())
-
-    except Exception as e:
-        return (
-            f"Error: Something went wrong ({e})",
-            {"display": "block"},
-            {},
-        )
-
-
 @callback(
     Output("condition", "options"),
     Output("cat-cov", "options"),
@@ -1057,22 +942,22 @@ def load_network_data(network: Union[str, None]):
     prevent_initial_call=True,
 )
 def show_dropdown_options(
-    expression_data: Dict[str, Dict[str, str]],
-    meta_data: Dict[str, Dict[str, str]],
-    network_data: Dict[str, Dict[str, str]],
-    expression_data_auto: Dict[str, Dict[str, str]],
-    meta_data_auto: Dict[str, Dict[str, str]],
+    expression_data: Upload,
+    meta_data: Upload,
+    network_data: Upload,
+    expression_data_auto: Upload,
+    meta_data_auto: Upload,
     toggle: bool,
 ):
     """
     Generate dropdown options based on the provided (or generated) expression, meta, and network data.
 
     Args:
-        expression_data (Dict[str, Dict[str, str]]): User provided expression data.
-        meta_data (Dict[str, Dict[str, str]]): User provided meta data.
-        network_data (Dict[str, Dict[str, str]]): User provided network data.
-        expression_data_auto (Dict[str, Dict[str, str]]): Expression data generated from selected control data option.
-        meta_data_auto (Dict[str, Dict[str, str]]): Meta data generated from selected control data option.
+        expression_data (Upload): User provided expression data.
+        meta_data (Upload): User provided meta data.
+        network_data (Upload): User provided network data.
+        expression_data_auto (Upload): Expression data generated from selected control data option.
+        meta_data_auto (Upload): Meta data generated from selected control data option.
 
     Returns:
         tuple: A tuple containing the following elements:
@@ -1085,13 +970,9 @@ def show_dropdown_options(
             - output (dash.no_update): A special value indicating that the loading-options-output should not be updated.
     """
     if toggle:
-        expression_df = pd.DataFrame(expression_data_auto)
-        meta_df = pd.DataFrame(meta_data_auto)
-    else:
-        expression_df = pd.DataFrame(expression_data)
-        meta_df = pd.DataFrame(meta_data)
+        expression_data = expression_data_auto
+        meta_data = meta_data_auto
 
-    network_df = pd.DataFrame(network_data)
     # if set(meta_df.iloc[:, 0]) != set(expression_df.iloc[:, 0]):
     #     return (
     #         [],
@@ -1106,9 +987,9 @@ def show_dropdown_options(
     #         {},
     #     )
 
-    if not expression_df.empty and not meta_df.empty and not network_df.empty:
+    if is_upload(expression_data) and is_upload(meta_data) and is_upload(network_data):
 
-        if set(meta_df.iloc[:, 0]) != set(expression_df.iloc[:, 0]):
+        if meta_data["samples"] != expression_data["samples"]:
             return (
                 [],
                 [],
@@ -1121,12 +1002,10 @@ def show_dropdown_options(
 
         # TODO: check for matching gene names in expression and network
 
-        columns = list(meta_df.columns)[1:]
+        columns = meta_data["covariates"]
 
         conditions = [
-            {"label": option, "value": option}
-            for option in columns
-            if set(meta_df[option]) == {0, 1}
+            {"label": option, "value": option} for option in meta_data["conditions"]
         ]
 
         if len(conditions) == 0:
@@ -1195,6 +1074,65 @@ def enable_run_button(condition: Union[str, None]) -> Tuple[bool, str]:
     return True, "secondary"
 
 
+@callback(
+    Output("run_estimate", "children"),
+    Output("run_estimate", "className"),
+    Input("expression_data", "data"),
+    Input("network_data", "data"),
+    Input("expression_data_autogenerated", "data"),
+    Input("meta-toggle-switch", "on"),
+    Input("cat-cov", "value"),
+    Input("con-cov", "value"),
+    prevent_initial_call=True,
+)
+def show_run_estimate(
+    expression: Union[Upload, None],
+    network: Union[Upload, None],
+    expression_auto: Union[Upload, None],
+    toggle: bool,
+    cat_cov: Union[List[str], None],
+    con_cov: Union[List[str], None],
+) -> Tuple[str, str]:
+    """
+    Shows the estimated runtime and memory of a run with the current inputs,
+    and whether the run exceeds the limits of the server.
+    """
+    if toggle:
+        expression = expression_auto
+    if not is_upload(expression) or not is_upload(network):
+        return "", "text-muted text-center mt-2"
+
+    # the first column are the sample ids
+    estimate = estimate_run(
+        expression["rows"],
+        expression["columns"] - 1,
+        network["rows"],
+        len(cat_cov or []) + len(con_cov or []),
+    )
+    message = (
+        f"Estimated runtime: {format_duration(estimate['seconds'])}, "
+        f"estimated memory: {format_bytes(estimate['memory'])}."
+    )
+    try:
+        chunks = check_limits(estimate)
+    except ValueError as e:
+        return f"{message} {e}.", "text-danger text-center mt-2"
+    if chunks > 1:
+        message += f" The network is fitted in {chunks} parts to fit into memory."
+    return message, "text-muted text-center mt-2"
+
+
+@callback(
+    Output("client_id", "data"),
+    Input("client_id", "modified_timestamp"),
+    State("client_id", "data"),
+)
+def set_client_id(timestamp: int, client_id: Union[str, None]) -> str:
+    if client_id is not None:
+        raise dash.exceptions.PreventUpdate
+    return str(uuid4())
+
+
 @app.callback(
     Output("user-main", "children", allow_duplicate=True),
     Output("errorbox", "children", allow_duplicate=True),
@@ -1219,6 +1157,7 @@ def enable_run_button(condition: Union[str, None]) -> Tuple[bool, str]:
         State("meta_data_autogenerated", "data"),
         State("control-option", "value"),
         State("meta-toggle-switch", "on"),
+        State("client_id", "data"),
     ],
     cancel=[Input("cancel-run", "n_clicks")],
     background=True,
@@ -1229,6 +1168,7 @@ def enable_run_button(condition: Union[str, None]) -> Tuple[bool, str]:
         Output("progress", "value"),
         Output("progress", "max"),
         Output("progress", "label"),
+        Output("progress_session", "children"),
     ],
     interval=100,
     prevent_initial_call=True,
@@ -1245,13 +1185,14 @@ def run(
     normaltest_alpha: Union[float, None],
     r2: Union[float, None],
     condition_direction: bool,
-    expression: Dict[str, Dict[str, str]],
-    network: Dict[str, Dict[str, str]],
-    meta: Dict[str, Dict[str, str]],
-    expression_auto: Dict[str, Dict[str, str]],
-    meta_auto: Dict[str, Dict[str, str]],
+    expression: Upload,
+    network: Upload,
+    meta: Upload,
+    expression_auto: Upload,
+    meta_auto: Upload,
     control_option: Union[str, None],
     toggle: bool,
+    client_id: Union[str, None],
 ) -> Union[
     Tuple[dbc.Container, Literal[""], Dict[str, str]],
     Tuple[NoUpdate, str, Dict[str, str]],
@@ -1271,6 +1212,7 @@ def run(
         normaltest_alpha (float): The significance level for normality test.
         r2 (float): The R-squared threshold.
         condition_direction (str): Flag indicating whether to only include dysregulation that are relevant for the interactions.
+        client_id (str): Identifier of the browser for the limits of the job queue.
 
     Returns:
         object: The output layout for the analysis results.
@@ -1285,32 +1227,67 @@ def run(
         session_id = str(uuid4())
 
         try:
-            with DysregnetProgress() as f:
-                f.set_max(max=len(pd.DataFrame(network)))
-                f.set_progress = set_progress
-
-                with redirect_stderr(new_target=f):
-                    results = get_results(
-                        expression,
-                        meta,
-                        network,
-                        condition,
-                        [] if cat_cov is None else cat_cov,
-                        [] if con_cov is None else con_cov,
-                        zscoring,
-                        1e-2 if bonferroni is None else bonferroni,
-                        normaltest,
-                        1e-3 if normaltest_alpha is None else normaltest_alpha,
-                        r2,
-                        condition_direction,
-                        session_id,
-                    )
+            # the stored uploads are loaded once, the run shares these tables
+            dataset = load_dataset(expression, meta, network)
+
+            link = ""
+            if streams_partial_results(dataset, cat_cov or [], con_cov or []):
+                # finished edges can be inspected while the run continues
+                link = html.A(
+                    "Open the results computed so far in a new tab",
+                    href=app.get_relative_path("/user_data") + "?" + session_id,
+                    target="_blank",
+                )
 
-            results_convert = pd.DataFrame(results)
-            results_convert.columns = [
-                tuple(c.split(",")) for c in results_convert.columns
-            ]
-            out_layout = (get_output_layout(results_convert),)
+            arguments = (
+                condition,
+                [] if cat_cov is None else cat_cov,
+                [] if con_cov is None else con_cov,
+                zscoring,
+                1e-2 if bonferroni is None else bonferroni,
+                normaltest,
+                1e-3 if normaltest_alpha is None else normaltest_alpha,
+                r2,
+                condition_direction,
+            )
+
+            progress = DysregnetProgress(
+                dataset.n_run_edges,
+                on_progress=lambda event: set_progress(
+                    (
+                        str(event["done"]),
+                        str(event["total"]),
+                        format_label(event),
+                        html.Div(
+                            [
+                                html.Div(format_progress(event)),
+                                # start_partial registers the session before
+                                # the first edge is fitted
+                                (
+                                    link
+                                    if event["stage"]
+                                    in ("Fitting edges", "Saving results")
+                                    else ""
+                                ),
+                            ]
+                        ),
+                    )
+                ),
+            )
+            with progress, queued_run(
+                get_parameters(*arguments),
+                dataset,
+                client_id or session_id,
+                on_wait=lambda status: progress.set_stage(
+                    "Waiting", format_wait(status)
+                ),
+            ):
+                progress.set_stage("Preparing")
+
+                with redirect_progress(progress):
+                    results = get_results(dataset, *arguments, session_id)
+
+            out_layout = (get_output_layout(get_genes(results)),)
             return (
                 out_layout,
                 "",
@@ -1342,9 +1319,20 @@ def load_saved(url: str):
         return dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
     if check_cache(session_id):
-        results = get_cached_results(session_id)
-        results.columns = [tuple(c.split(",")) for c in results.columns]
-        out_layout = (get_output_layout(results),)
+        summary = get_cached_summary(session_id)
+        out_layout = (get_output_layout(summary["genes"]),)
+
+        return (
+            out_layout,
+            "",
+            {"display": "None"},
+            session_id,
+        )
+
+    if get_partial(session_id) is not None:
+        # running session, its finished edges are shown and refreshed
+        summary = get_cached_summary(session_id)
+        out_layout = (get_output_layout(summary["genes"], running=True),)
 
         return (
             out_layout,
@@ -2,17 +2,21 @@ from typing import Any, Dict, List
 
 import dash
 import dash_bootstrap_components as dbc
-import pandas as pd
 from dash import callback, clientside_callback, dcc, exceptions, html
 from dash.dependencies import ClientsideFunction, Input, Output, State
 
 from pages.components.detail import detail, user_edge_detail, user_node_detail
-from pages.components.dysregnet_cache import cache, get_cached_results
+from pages.components.dysregnet_cache import (
+    cache,
+    check_cache,
+    get_cached_neighborhood,
+    get_cached_results_frame,
+    get_cached_summary,
+    get_partial,
+)
 from pages.components.dysregnet_results import (
     get_graph_data,
     get_num_regulation,
-    get_sources,
-    get_targets,
     graph_to_csv,
 )
 from pages.components.graph import get_graph
@@ -21,21 +25,35 @@ from pages.components.popovers import get_popovers
 from pages.components.settings import get_user_settings
 from pages.components.tabs import user_data_tabs
 
+# Milliseconds between two refreshes of the results of a running session
+PARTIAL_REFRESH_INTERVAL = 5000
+
 
-def get_output_layout(results: pd.DataFrame) -> dbc.Container:
+def get_output_layout(genes: List[str], running: bool = False) -> dbc.Container:
     """
     Generate the layout for displaying the output results.
 
     Args:
-        results (pandas.DataFrame): The results to be displayed.
+        genes (List[str]): The genes of the results to be displayed.
+        running (bool): True for a running session, whose results so far are
+        displayed and refreshed until the run is finished.
 
     Returns:
         dbc.Container: The layout containing the results.
     """
 
-    genes = results.columns.to_series().explode(ignore_index=True).unique()
     output_layout = html.Div(
         [
+            dbc.Alert(
+                id="user_partial_status",
+                color="info",
+                is_open=running,
+            ),
+            dcc.Interval(
+                id="user_partial_interval",
+                interval=PARTIAL_REFRESH_INTERVAL,
+                disabled=not running,
+            ),
             dbc.Row(
                 [
                     dcc.Dropdown(
@@ -82,7 +100,7 @@ def get_output_layout(results: pd.DataFrame) -> dbc.Container:
             dcc.Store(
                 id="user_genes_store",
                 storage_type="memory",
-                data={"gene_ids": [{"label": gene, "value": gene} for gene in genes]},
+                data=get_genes_data(genes),
             ),
         ]
         + get_popovers(),
@@ -122,29 +140,27 @@ def update_gene_input(
     ),
     Input(component_id="user_gene_id_input", component_property="value"),
     Input(component_id="user_patient_specific", component_property="value"),
+    # new results of a running session
+    Input(component_id="user_genes_store", component_property="data"),
     State(component_id="session_id", component_property="value"),
     prevent_initial_call=True,
 )
-def update_graph_data(genes: List[str], patient_id: str, session_id: str):
-    if len(genes) > 0:
-        results = pd.DataFrame(get_cached_results(session_id))
-        results.columns = [tuple(c.split(",")) for c in results.columns]
+def update_graph_data(
+    genes: List[str], patient_id: str, gene_ids: Dict[str, Any], session_id: str
+):
+    if genes is not None and len(genes) > 0:
+        # only the edges of the query genes are loaded
+        sources, targets = get_cached_neighborhood(session_id, genes)
 
         patient_data = None
         if patient_id is not None:
-            # filtered_results = results[:, results.columns.isin(genes)]
-            filtered_results = results.loc[results.index.isin([patient_id])]
-            filtered_results = filtered_results.loc[
-                :, (filtered_results != 0).any(axis=0)
-            ]
+            # results are cached as float32, DysRegNet z-scores have one decimal
             patient_data = [
-                [":".join(edge), patient_id, filtered_results[edge].iloc[0]]
-                for edge in filtered_results.columns
+                [":".join(edge), patient_id, round(value, 1)]
+                for edge, value in sources.get_patient(patient_id)
+                + targets.get_patient(patient_id)
             ]
 
-        sources = get_sources(results, genes)
-        targets = get_targets(results, genes)
-
         total_regulations = get_num_regulation(sources, targets)
         user_store_graph = get_graph_data(sources, targets, genes, patient_data)
         return (
@@ -198,8 +214,8 @@ def update_detail(node: Dict[str, Any], edge: Dict[str, Any], genes: List[str]):
 )
 def download_dysregnet_results(n_clicks: int, session_id):
     if n_clicks > 0:
-        results = pd.DataFrame(get_cached_results(session_id))
-        # results.columns = [tuple(c.split(",")) for c in results.columns]
+        results = get_cached_results_frame(session_id)
+        results.columns = [",".join(c) for c in results.columns]
         csv_str = results.to_csv()
 
         return dict(content=csv_str + "\n", filename="results.csv")
@@ -216,11 +232,7 @@ def download_dysregnet_results(n_clicks: int, session_id):
 )
 def download_graph_full(n_clicks: int, session_id: str, genes: List[str]):
     if n_clicks > 0 and len(genes) != 0:
-        results = pd.DataFrame(get_cached_results(session_id))
-        results.columns = [tuple(c.split(",")) for c in results.columns]
-
-        sources = get_sources(results, genes)
-        targets = get_targets(results, genes)
+        sources, targets = get_cached_neighborhood(session_id, genes)
 
         graph_data = get_graph_data(sources, targets, genes, None)
 
@@ -316,26 +328,28 @@ def update_dysregulation_plot(
 ):
     if n_clicks > 0 and elements is not None:
         if len(genes) > 0:
-            results = pd.DataFrame(get_cached_results(session_id))
-            results.columns = [c.replace(",", ":") for c in results.columns]
+            # displayed edges all have a source or a target among the query genes
+            sources, targets = get_cached_neighborhood(session_id, genes)
 
             regulation_ids = [
                 element["data"]["regulation_id"]
                 for element in elements
                 if "regulation_id" in element["data"]
             ]
+            edges = [
+                tuple(regulation_id.split(":")) for regulation_id in regulation_ids
+            ]
 
-            results = results.filter(items=regulation_ids)
-            results = results.loc[(results != 0).any(axis=1)]
+            sources = sources.select(sources.columns.isin(edges))
+            targets = targets.select(
+                targets.columns.isin(edges) & ~targets.columns.isin(sources.columns)
+            )
 
-            rows = results.index.tolist()
-            data = []
-            for col in results.columns:
-                rowindex = 0
-                for value in results[col]:
-                    if value != 0:
-                        data.append([str(col), rows[rowindex], value])
-                    rowindex += 1
+            data = [
+                [":".join(edge), patient_id, round(value, 1)]
+                for edge, patient_id, value in sources.get_triplets()
+                + targets.get_triplets()
+            ]
 
             return dysregulation_heatmap(data), [
                 html.I(className="fa fa-refresh mr-1"),
@@ -369,10 +383,57 @@ def show_session_id(url: str, session_id: str):
 @callback(
     Output(component_id="user_patient_specific", component_property="options"),
     Input(component_id="session_id", component_property="value"),
+    Input(component_id="user_genes_store", component_property="data"),
 )
-def update_user_patient_specific_options(session_id):
-    results = pd.DataFrame(get_cached_results(session_id))
-    patient_ids = results.index.tolist()
+def update_user_patient_specific_options(session_id, gene_ids):
+    patient_ids = get_cached_summary(session_id)["patients"]
     dropdown_options = [{"label": name, "value": name} for name in patient_ids]
 
     return dropdown_options
+
+
+@callback(
+    Output("user_genes_store", "data"),
+    Output("user_partial_status", "children"),
+    Output("user_partial_status", "is_open"),
+    Output("user_partial_interval", "disabled"),
+    Input("user_partial_interval", "n_intervals"),
+    State("session_id", "value"),
+    State("user_genes_store", "data"),
+    prevent_initial_call=True,
+)
+def update_partial_results(n_intervals: int, session_id: str, data: Dict[str, Any]):
+    partial = get_partial(session_id)
+    if partial is None:
+        # the run is finished (or failed), show the complete results once
+        if not check_cache(session_id):
+            return (
+                dash.no_update,
+                "The DysRegNet run failed, the results are incomplete.",
+                True,
+                True,
+            )
+        genes = get_cached_summary(session_id)["genes"]
+        return get_genes_data(genes), "", False, True
+
+    done = partial["done"] / max(partial["edges"], 1)
+    status = (
+        f"DysRegNet is still running, showing the results of {partial['done']}"
+        f" of {partial['edges']} edges ({done * 100:.0f}%)."
+    )
+    if partial["done"] == data.get("done"):
+        # no new chunks
+        return dash.no_update, status, True, False
+    genes = get_cached_summary(session_id)["genes"]
+    return get_genes_data(genes, partial["done"]), status, True, False
+
+
+def get_genes_data(genes: List[str], done: int = None) -> Dict[str, Any]:
+    """
+    Returns the data of user_genes_store: the gene dropdown options and the
+    number of edges finished so far of a running session.
+    """
+    return {
+        "gene_ids": [{"label": gene, "value": gene} for gene in genes],
+        "done": done,
+    }
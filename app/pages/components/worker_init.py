@@ -0,0 +1,136 @@
+import importlib
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+import numpy as np
+import pandas as pd
+from celery.signals import worker_init, worker_process_init
+
+# Control data sets (.gct file names, comma separated, or "all") which every
+# Celery worker parses when it starts instead of on the first run (default: none)
+PRELOAD_CONTROL_DATA = os.getenv("DYSREGNET_PRELOAD_CONTROL_DATA", "")
+# Modules of the DysRegNet runs, some of them import their submodules lazily
+PRELOAD_MODULES = (
+    "dysregnet",
+    "dysregnet.functions",
+    "statsmodels.api",
+    "statsmodels.stats.multitest",
+    "sklearn.linear_model",
+    "scipy.sparse",
+    "scipy.stats",
+    "cmapPy.pandasGEXpress.parse_gct",
+    "mygene",
+)
+# Modules with a NetworkDB instance
+NETWORK_DB_MODULES = ("pages.main", "pages.components.settings")
+
+
+def preload_modules():
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Could not preload {name}: {e}")
+
+
+def preload_control_data():
+    if not PRELOAD_CONTROL_DATA:
+        return
+    from pages.components.user_input import control_data
+
+    filenames = (
+        "all"
+        if PRELOAD_CONTROL_DATA == "all"
+        else [name.strip() for name in PRELOAD_CONTROL_DATA.split(",") if name.strip()]
+    )
+    try:
+        control_data.preload_control_data(filenames)
+    except OSError as e:
+        print(f"Could not preload the control data: {e}")
+
+
+def warm_up_run():
+    """
+    Fits a tiny DysRegNet run, so the first real run does not pay for the
+    first calls into statsmodels, scipy and BLAS.
+    """
+    from pages.components.dysregnet_parallel import fit_chunk, prepare_run
+
+    rng = np.random.default_rng(0)
+    samples = [f"s{i}" for i in range(12)]
+    expression = pd.DataFrame(rng.normal(size=(12, 3)), columns=["a", "b", "c"])
+    expression.insert(0, "sample", samples)
+    meta = pd.DataFrame({"sample": samples, "condition": [0] * 8 + [1] * 4})
+    network = pd.DataFrame({"source": ["a", "b"], "target": ["b", "c"]})
+
+    data = prepare_run(
+        expression_data=expression,
+        GRN=network,
+        meta=meta,
+        conCol="condition",
+        CatCov=[],
+        ConCov=[],
+        zscoring=False,
+        bonferroni_alpha=1e-2,
+        R2_threshold=None,
+        normaltest=False,
+        normaltest_alpha=1e-3,
+        direction_condition=False,
+    )
+    with redirect_stderr(io.StringIO()), redirect_stdout(io.StringIO()):
+        fit_chunk(data, 0, len(data.GRN))
+
+
+def warm_connections():
+    """
+    Opens the Redis and Neo4j connections of this process ahead of the first run.
+    """
+    from pages.components.dysregnet_cache import cache
+
+    try:
+        cache.ping()
+    except Exception as e:
+        print(f"Could not connect to Redis: {e}")
+
+    # database connections the pages open when they are imported
+    for name in NETWORK_DB_MODULES:
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+        try:
+            module.db.driver.verify_connectivity()
+        except Exception as e:
+            print(f"Could not connect to Neo4j: {e}")
+
+
+def on_worker_init(sender=None, **kwargs):
+    """
+    Preloads the worker before its pool starts, the prefork pool inherits the
+    modules and data. Pools which do not fork open the connections here.
+    """
+    start = time.time()
+    preload_modules()
+    preload_control_data()
+    warm_up_run()
+    if "prefork" not in str(getattr(sender, "pool_cls", "prefork")):
+        warm_connections()
+    print(f"Worker preloaded in {time.time() - start:.1f}s")
+
+
+def on_worker_process_init(**kwargs):
+    """
+    Opens the connections of a prefork pool process, connections must not be
+    shared with the parent process.
+    """
+    warm_connections()
+
+
+def register_worker_hooks():
+    """
+    Connects the preloading of Celery workers to their start.
+    """
+    worker_init.connect(on_worker_init, weak=False)
+    worker_process_init.connect(on_worker_process_init, weak=False)
@@ -1,13 +1,16 @@
 import collections
+import os
 
 import dash
 import dash_bootstrap_components as dbc
 import dash_cytoscape as cyto
 from dash import callback, clientside_callback, dcc, html
 from dash.dependencies import ClientsideFunction, Input, Output, State
+from flask import send_from_directory
 
 import pages.components.neo4j2csv as neo4j2csv
 import pages.components.neo4j2Store as neo4j2Store
+from pages.components.bulk_export import EXPORT_DIR, export_cancer_network
 from pages.components.db import NetworkDB
 from pages.components.detail import detail, edge_detail, node_detail
 from pages.components.graph import get_graph
@@ -23,6 +26,7 @@ from pages.components.tabs import tabs
 
 dash.register_page(__name__, path="/")
 
+app = dash.get_app()
 db = NetworkDB()
 cyto.load_extra_layouts()
 
@@ -331,6 +335,46 @@ def download_graph_full(n_clicks, selection_data):
     raise dash.exceptions.PreventUpdate
 
 
+@app.callback(
+    Output(component_id="export_link", component_property="children"),
+    Input(component_id="btn_export_network", component_property="n_clicks"),
+    State(component_id="cancer_id_input", component_property="value"),
+    State(component_id="export_dysregulation_switch", component_property="value"),
+    background=True,
+    running=[
+        (Output("btn_export_network", "disabled"), True, False),
+        (Output("export_progress", "style"), {"display": "flex"}, {"display": "none"}),
+    ],
+    progress=[
+        Output("export_progress", "value"),
+        Output("export_progress", "max"),
+        Output("export_progress", "label"),
+    ],
+    prevent_initial_call=True,
+)
+def export_network(set_progress, n_clicks, cancer_id, include_dysregulation):
+    if n_clicks is not None and cancer_id is not None:
+        try:
+            filename = export_cancer_network(
+                cancer_id, include_dysregulation, set_progress=set_progress
+            )
+        except Exception as e:
+            return html.Small(f"Export failed ({e})", className="text-danger")
+
+        return html.A(
+            [html.I(className="fa fa-file-archive-o mr-1"), f" {filename}"],
+            href=app.get_relative_path(f"/exports/{filename}"),
+        )
+    raise dash.exceptions.PreventUpdate
+
+
+@app.server.route("/exports/<path:filename>")
+def serve_export(filename):
+    return send_from_directory(
+        os.path.abspath(EXPORT_DIR), filename, as_attachment=True
+    )
+
+
 @callback(
     Output(component_id="download_graph_displayed", component_property="data"),
     Input(component_id="btn_download_graph_displayed", component_property="n_clicks"),